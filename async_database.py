@@ -0,0 +1,1105 @@
+"""
+שכבת MongoDB אסינכרונית (motor) עבור המטפלים בבוט.
+
+כל פעולה ממתינה (await) לדרייבר האסינכרוני במקום לחסום את ה-event loop של
+python-telegram-bot, כך שפנייה איטית אחת למסד לא מעכבת משתמשים אחרים.
+ממשק הקריאה זהה ל-Database שב-database.py; כתיבות לפרומפטים ולקטגוריות קיימות רק כאן.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Optional, List, Dict, Any, Awaitable, Callable, NamedTuple, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, InsertOne, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+
+import config
+import fuzzy_match
+from category_cache import CategoryCache, CategorySnapshot
+from database import DatabaseBase
+from inline_index import Card, InlineIndex, UserCards, build_cards
+from models import PromptSummary, summaries
+from mongo_client import get_async_client, get_client
+from near_duplicates import (SIGNATURE_FIELD, Match, NearDuplicateIndex, UserSignatures,
+                             build_signatures, signature)
+from pagination import NEXT, Page, PageRequest, build_page
+from prompt_cache import PromptCache, RedisStore
+from search_engine import SearchEngine, UserIndex, build_index
+from search_results import SearchResultCache, SearchResults
+from tag_trie import TagTrie, TagTrieCache
+from write_behind import WriteBehindBuffer
+
+logger = logging.getLogger(__name__)
+
+
+class ListScreen(NamedTuple):
+    """כל מה שמסך רשימה צריך: העמוד (פריטי PromptSummary), מספר המסמכים בתצוגה ומפת האימוג׳י."""
+    page: Page
+    total: int
+    category_lookup: Dict[str, str]
+
+
+class SearchPage(NamedTuple):
+    """עמוד תוצאות חיפוש: הפריטים, סך התוצאות, והאם אלה תוצאות החיפוש העמום."""
+    items: List[PromptSummary]
+    total: int
+    fuzzy: bool
+
+
+class AsyncDatabase(DatabaseBase):
+    def __init__(self):
+        """הלקוח (motor) נוצר בגישה הראשונה עם ההגדרות המשותפות של mongo_client.py"""
+        # מטמון קטגוריות לכל משתמש – נכתב מחדש בכל שינוי קטגוריות (write-through)
+        self.category_cache = CategoryCache(
+            self._category_name_key,
+            max_users=config.CATEGORY_CACHE_MAX_USERS,
+            ttl_seconds=config.CATEGORY_CACHE_TTL_SECONDS,
+        )
+        # מוני $inc (use_count, stats.*) נצברים בזיכרון ונכתבים ב-bulk_write תקופתי
+        self.write_buffer = WriteBehindBuffer(
+            lambda: get_client()[config.MONGO_DB_NAME],
+            flush_interval=config.WRITE_BEHIND_FLUSH_SECONDS,
+            max_pending=config.WRITE_BEHIND_MAX_PENDING,
+        ) if config.ENABLE_WRITE_BEHIND else None
+        # אינדקס חיפוש BM25 בזיכרון לכל משתמש (עברית + אנגלית) – נבנה בחיפוש הראשון
+        self.search_engine = SearchEngine(config.SEARCH_INDEX_MAX_POSTINGS) if config.ENABLE_SEARCH_ENGINE else None
+        # נעילות טעינה לכל משתמש ([נעילה, ממתינים] – ראו _load_per_user)
+        self._search_build_locks: Dict[int, list] = {}
+        # כרטיסי פרומפטים למצב inline – נטענים בשאילתת ה-inline הראשונה של המשתמש
+        self.inline_index = InlineIndex(config.INLINE_INDEX_MAX_PROMPTS) if config.ENABLE_INLINE_MODE else None
+        self._inline_load_locks: Dict[int, list] = {}
+        # trie של תגיות עם מונים לכל משתמש – השלמה אוטומטית ותפריט התגיות בלי לקרוא את prompts
+        self.tag_tries = TagTrieCache(config.TAG_TRIE_MAX_USERS)
+        self._tag_trie_load_locks: Dict[int, list] = {}
+        # חתימות MinHash עם LSH לכל משתמש – אזהרת כפילות בשמירה בלי לסרוק את הספרייה
+        self.near_duplicates = NearDuplicateIndex(
+            config.NEAR_DUPLICATE_INDEX_MAX_PROMPTS
+        ) if config.ENABLE_NEAR_DUPLICATE_CHECK else None
+        self._near_duplicate_load_locks: Dict[int, list] = {}
+        # מטמון דו-שכבתי ל-get_prompt: LRU בזיכרון ומעליו Redis משותף (אם הוגדר)
+        self.prompt_cache = PromptCache(
+            max_entries=config.PROMPT_CACHE_MAX_ENTRIES,
+            ttl_seconds=config.PROMPT_CACHE_TTL_SECONDS,
+            store=RedisStore(config.REDIS_URL) if config.ENABLE_REDIS_CACHE else None,
+            store_ttl_seconds=config.PROMPT_CACHE_REDIS_TTL_SECONDS,
+            retry_seconds=config.REDIS_RETRY_SECONDS,
+        ) if config.ENABLE_PROMPT_CACHE else None
+        # רשימות _id מדורגות של חיפושים אחרונים – דפדוף בלי להריץ את השאילתה מחדש
+        self.search_results = SearchResultCache(
+            max_entries=config.SEARCH_RESULT_CACHE_MAX_ENTRIES,
+            ttl_seconds=config.SEARCH_RESULT_CACHE_TTL_SECONDS,
+        )
+
+    @property
+    def client(self) -> AsyncIOMotorClient:
+        return get_async_client()
+
+    @property
+    def db(self):
+        return self.client[config.MONGO_DB_NAME]
+
+    # Collections
+    @property
+    def prompts(self):
+        return self.db.prompts
+
+    @property
+    def users(self):
+        return self.db.users
+
+    @property
+    def collections(self):
+        return self.db.collections
+
+    @property
+    def stats(self):
+        return self.db.stats
+
+    # ========== פעולות משתמשים ==========
+
+    async def get_or_create_user(self, user_id: int, username: str = None,
+                                 first_name: str = None) -> Dict:
+        """קבלת או יצירת משתמש"""
+        version = self.category_cache.version(user_id)
+        user = await self.users.find_one({"user_id": user_id})
+
+        if not user:
+            user = self._new_user_document(user_id, username, first_name)
+            await self.users.insert_one(user)
+            self.category_cache.put(user_id, user["categories"])
+        elif not user.get("categories"):
+            categories = self._default_categories()
+            await self.users.update_one(
+                {"user_id": user_id},
+                {"$set": {"categories": categories}}
+            )
+            user["categories"] = categories
+            self.category_cache.put(user_id, categories)
+        else:
+            # המסמך כבר בידינו – נחמם את המטמון בלי קריאה נוספת
+            self.category_cache.store(user_id, user["categories"], version)
+
+        self._overlay_pending(self.users.name, "user_id", [user])
+        return user
+
+    async def find_user_by_identifier(self, identifier: Optional[str]) -> Optional[Dict]:
+        """איתור משתמש לפי user_id או שם משתמש (עם או בלי @)."""
+        user_id, regex = self._username_regex(identifier)
+
+        # ניסיון לפי מזהה מספרי
+        if user_id is not None:
+            user = await self.users.find_one({"user_id": user_id})
+            if user:
+                return user
+
+        # ניסיון לפי שם משתמש
+        if not regex:
+            return None
+        return await self.users.find_one({"username": {"$regex": regex, "$options": "i"}})
+
+    def _overlay_pending(self, collection: str, key_field: str, docs) -> None:
+        """הוספת מונים שעוד לא נכתבו למסמכים שנקראו – המשתמש רואה מיד את הפעולה שלו."""
+        if self.write_buffer is not None:
+            self.write_buffer.overlay(collection, key_field, docs)
+
+    def _overlay_prompts(self, docs):
+        self._overlay_pending(self.prompts.name, "_id", docs)
+        return docs
+
+    async def update_user_stats(self, user_id: int, stat_name: str, increment: int = 1):
+        """עדכון סטטיסטיקות משתמש (דרך מאגר הכתיבה המושהית, אם פעיל ועוד לא נעצר)"""
+        if self.write_buffer is not None and self.write_buffer.increment(
+                self.users.name, "user_id", user_id, {f"stats.{stat_name}": increment}):
+            return
+        await self.users.update_one(
+            {"user_id": user_id},
+            {"$inc": {f"stats.{stat_name}": increment}}
+        )
+
+    # ========== קטגוריות משתמש ==========
+
+    async def _category_snapshot(self, user_id: int) -> CategorySnapshot:
+        """תמונת הקטגוריות של המשתמש מהמטמון, או טעינה מהמסד בהחטאה."""
+        snapshot = self.category_cache.get(user_id)
+        if snapshot is not None:
+            return snapshot
+        # הגרסה נלקחת לפני הקריאה: אם קטגוריה תשתנה בינתיים, התוצאה לא תישמר
+        version = self.category_cache.version(user_id)
+        user = await self.users.find_one({"user_id": user_id}, {"categories": 1})
+        categories = (user or {}).get("categories")
+        if not categories:
+            categories = self._default_categories()
+            await self.users.update_one(
+                {"user_id": user_id},
+                {"$set": {"categories": categories}},
+                upsert=True
+            )
+            return self.category_cache.put(user_id, categories)
+        return self.category_cache.store(user_id, categories, version)
+
+    async def get_user_categories(self, user_id: int) -> List[Dict[str, str]]:
+        """החזרת רשימת הקטגוריות של משתמש (יוזנו ברירות מחדל אם חסרות)."""
+        return (await self._category_snapshot(user_id)).as_list()
+
+    async def get_category_lookup(self, user_id: int) -> Dict[str, str]:
+        """מילון מהיר של שם קטגוריה -> אימוג׳י."""
+        return dict((await self._category_snapshot(user_id)).lookup)
+
+    async def get_versioned_category_lookup(self, user_id: int) -> Tuple[int, Dict[str, str]]:
+        """(גרסה, שם קטגוריה -> אימוג׳י) – הגרסה משתנה בכל שינוי בקטגוריות, ומשמשת כמפתח מטמון."""
+        snapshot = await self._category_snapshot(user_id)
+        return snapshot.version, dict(snapshot.lookup)
+
+    async def get_category(self, user_id: int, name: str) -> Optional[Dict[str, str]]:
+        """החזרת אובייקט קטגוריה לפי שם (case-insensitive)."""
+        cat = (await self._category_snapshot(user_id)).by_key.get(self._category_name_key(name or ""))
+        return dict(cat) if cat else None
+
+    async def ensure_category_name(self, user_id: int, category: Optional[str]) -> str:
+        """ודאות שהקטגוריה קיימת; אם לא – חזרה לברירת מחדל."""
+        snapshot = await self._category_snapshot(user_id)
+        cat = snapshot.by_key.get(self._category_name_key(category or ""))
+        if cat:
+            return cat.get("name")
+        return self._fallback_category(snapshot.categories) or "Other"
+
+    async def add_user_category(self, user_id: int, name: str, emoji: str = "📁") -> bool:
+        categories = self._plan_add_category(await self.get_user_categories(user_id), name, emoji)
+        await self.users.update_one(
+            {"user_id": user_id},
+            {"$set": {"categories": categories}}
+        )
+        self.category_cache.put(user_id, categories)
+        return True
+
+    async def update_user_category(self, user_id: int, old_name: str, new_name: str, emoji: str) -> bool:
+        categories, renamed_from, new_name = self._plan_update_category(
+            await self.get_user_categories(user_id), old_name, new_name, emoji
+        )
+        await self.users.update_one(
+            {"user_id": user_id},
+            {"$set": {"categories": categories}}
+        )
+        self.category_cache.put(user_id, categories)
+        if renamed_from:
+            await self.prompts.update_many(
+                {"user_id": user_id, "category": renamed_from},
+                {"$set": {"category": new_name}}
+            )
+            self.search_results.invalidate(user_id)
+            await self._invalidate_user_prompts(user_id)
+            await self._move_summary_category(user_id, renamed_from, new_name)
+        return True
+
+    async def delete_user_category(self, user_id: int, name: str) -> str:
+        filtered, target_name, fallback = self._plan_delete_category(
+            await self.get_user_categories(user_id), name
+        )
+        # עדכון פרומפטים לקטגוריית fallback
+        await self.prompts.update_many(
+            {"user_id": user_id, "category": target_name},
+            {"$set": {"category": fallback}}
+        )
+        self.search_results.invalidate(user_id)
+        await self._invalidate_user_prompts(user_id)
+        await self._move_summary_category(user_id, target_name, fallback)
+        await self.users.update_one(
+            {"user_id": user_id},
+            {"$set": {"categories": filtered}}
+        )
+        self.category_cache.put(user_id, filtered)
+        return fallback
+
+    # ========== פעולות פרומפטים ==========
+
+    async def content_signature(self, content: str) -> Optional[bytes]:
+        """חתימת MinHash של התוכן (ב-thread); None כשזיהוי הכפילויות כבוי."""
+        if self.near_duplicates is None:
+            return None
+        return await asyncio.to_thread(signature, content)
+
+    async def save_prompt(self, user_id: int, content: str, title: str = None,
+                          category: str = "Other", tags: List[str] = None,
+                          content_signature: Optional[bytes] = None) -> Dict:
+        """שמירת פרומפט חדש (content_signature – חתימה שכבר חושבה בשיחת השמירה)"""
+        category = await self.ensure_category_name(user_id, category)
+        if content_signature is None:
+            content_signature = await self.content_signature(content)
+        prompt = self._new_prompt_document(user_id, content, title, category, tags, content_signature)
+
+        # ה-_id והקוד הקצר נקבעים מראש – כתיבה אחת, וניסיון חוזר רק בהתנגשות קוד
+        for attempt in self._short_code_attempts(prompt):
+            try:
+                await self.prompts.insert_one(attempt)
+            except DuplicateKeyError as exc:
+                if not self._is_short_code_collision(exc):
+                    raise
+                continue
+            prompt = attempt
+            break
+
+        # עדכון סטטיסטיקות – אוספים שונים, ולכן במקביל ולא באותו batch
+        await asyncio.gather(
+            self.update_user_stats(user_id, "total_prompts"),
+            self._apply_summary_delta(user_id, self._summary_delta(None, prompt)),
+        )
+        self._index_prompt(user_id, prompt)
+
+        return prompt
+
+    async def bulk_save_prompts(self, user_id: int, items: List[Dict[str, Any]]) -> Tuple[int, int]:
+        """שמירת אצוות פרומפטים (ייבוא) ב-bulk_write אחד; מחזיר (כמה נשמרו, כמה נכשלו).
+
+        כל פריט: content, ואופציונלית title, category, tags וחתימה מחושבת
+        (content_signature, ראו drop_near_duplicates). ה-_id והקוד הקצר
+        נקבעים מראש; רק מסמכים שהתנגשו בקוד קצר נשלחים שוב עם קוד ארוך יותר.
+        שגיאת כתיבה אחרת נרשמת ללוג והמסמך נספר ככישלון.
+        """
+        if not items:
+            return 0, 0
+        snapshot = await self._category_snapshot(user_id)
+        fallback = self._fallback_category(snapshot.categories) or "Other"
+        if self.near_duplicates is not None:
+            unsigned = [item for item in items if item.get(SIGNATURE_FIELD) is None]
+            if unsigned:
+                await asyncio.to_thread(self._sign_items, unsigned)
+
+        pending = []
+        for item in items:
+            cat = snapshot.by_key.get(self._category_name_key(item.get("category") or ""))
+            prompt = self._new_prompt_document(
+                user_id, item["content"], item.get("title"),
+                cat.get("name") if cat else fallback, list(item.get("tags") or []),
+                item.get(SIGNATURE_FIELD) if self.near_duplicates is not None else None
+            )
+            attempts = self._short_code_attempts(prompt)
+            pending.append((next(attempts), attempts))
+
+        inserted: List[Dict] = []
+        failed = 0
+        while pending:
+            retry = []
+            failed_indexes = {}
+            try:
+                await self.prompts.bulk_write([InsertOne(doc) for doc, _ in pending], ordered=False)
+            except BulkWriteError as exc:
+                failed_indexes = {error["index"]: error for error in exc.details.get("writeErrors", [])}
+            for index, (doc, attempts) in enumerate(pending):
+                error = failed_indexes.get(index)
+                if error is None:
+                    inserted.append(doc)
+                elif error.get("code") == 11000 and self._is_short_code_collision(
+                        DuplicateKeyError(error.get("errmsg", ""), 11000, error)):
+                    next_doc = next(attempts, None)
+                    if next_doc is not None:
+                        retry.append((next_doc, attempts))
+                    else:
+                        failed += 1
+                        logger.warning("Import for user %s: no free short code for %s", user_id, doc["_id"])
+                else:
+                    failed += 1
+                    logger.warning("Import for user %s: write error %s: %s",
+                                   user_id, error.get("code"), error.get("errmsg"))
+            pending = retry
+
+        if inserted:
+            delta: Dict[str, int] = {}
+            for doc in inserted:
+                for field, count in self._summary_delta(None, doc).items():
+                    delta[field] = delta.get(field, 0) + count
+            await asyncio.gather(
+                self.update_user_stats(user_id, "total_prompts", len(inserted)),
+                self._apply_summary_delta(user_id, delta),
+            )
+            for doc in inserted:
+                self._index_prompt(user_id, doc)
+        return len(inserted), failed
+
+    async def get_prompt(self, prompt_id: str, user_id: int) -> Optional[Dict]:
+        """קבלת פרומפט לפי מזהה או קוד קצר (דטרמיניסטי), דרך מטמון הפרומפטים."""
+        filter_query = self._prompt_lookup_filter(prompt_id, user_id)
+        if filter_query is None:
+            return None
+
+        async def load():
+            prompt = await self.prompts.find_one(filter_query)
+            self._overlay_prompts([prompt])
+            return prompt
+
+        if self.prompt_cache is None:
+            return await load()
+        return await self.prompt_cache.get(user_id, prompt_id, load)
+
+    async def _invalidate_prompt(self, prompt_id):
+        if self.prompt_cache is not None:
+            await self.prompt_cache.invalidate(prompt_id)
+
+    async def _invalidate_user_prompts(self, user_id: int):
+        if self.prompt_cache is not None:
+            await self.prompt_cache.invalidate_user(user_id)
+
+    async def update_prompt(self, prompt_id: str, user_id: int,
+                            update_data: Dict) -> bool:
+        """עדכון פרומפט"""
+        from bson import ObjectId
+        try:
+            update_data['updated_at'] = datetime.utcnow()
+            changes = {"$set": update_data}
+            if 'content' in update_data:
+                if self.near_duplicates is not None:
+                    update_data[SIGNATURE_FIELD] = await asyncio.to_thread(signature, update_data['content'])
+                else:
+                    # חתימה ישנה תטעה את הזיהוי אם יופעל שוב – עדיף בלי חתימה (מחושבת מחדש בטעינה)
+                    changes["$unset"] = {SIGNATURE_FIELD: ""}
+            before = await self.prompts.find_one_and_update(
+                {"_id": ObjectId(prompt_id), "user_id": user_id},
+                changes,
+                return_document=ReturnDocument.BEFORE
+            )
+            if before is None:
+                return False
+            await self._invalidate_prompt(before["_id"])
+            after = {**before, **update_data}
+            await self._apply_summary_delta(user_id, self._summary_delta(before, after))
+            self.search_results.invalidate(user_id)
+            if not after.get("is_deleted"):
+                if {"title", "content", "tags"} & update_data.keys():
+                    self._index_prompt(user_id, after)
+                elif self.inline_index is not None:
+                    self.inline_index.add(user_id, after)
+            return True
+        except Exception:
+            return False
+
+    async def delete_prompt(self, prompt_id: str, user_id: int,
+                            permanent: bool = False) -> bool:
+        """מחיקת פרומפט (רכה או קשה)"""
+        from bson import ObjectId
+        try:
+            if permanent:
+                before = await self.prompts.find_one_and_delete({
+                    "_id": ObjectId(prompt_id),
+                    "user_id": user_id
+                })
+                after = None
+            else:
+                before = await self.prompts.find_one_and_update(
+                    {"_id": ObjectId(prompt_id), "user_id": user_id},
+                    {"$set": {
+                        "is_deleted": True,
+                        "deleted_at": datetime.utcnow()
+                    }},
+                    return_document=ReturnDocument.BEFORE
+                )
+                after = {**before, "is_deleted": True} if before else None
+
+            if before is not None:
+                await self._invalidate_prompt(before["_id"])
+                await asyncio.gather(
+                    self.update_user_stats(user_id, "total_prompts", -1),
+                    self._apply_summary_delta(user_id, self._summary_delta(before, after)),
+                )
+                self.search_results.invalidate(user_id)
+                if self.search_engine is not None:
+                    self.search_engine.remove(user_id, before["_id"])
+                if self.inline_index is not None:
+                    self.inline_index.remove(user_id, before["_id"])
+                if self.near_duplicates is not None:
+                    self.near_duplicates.remove(user_id, before["_id"])
+                return True
+            return False
+        except Exception:
+            return False
+
+    async def restore_prompt(self, prompt_id: str, user_id: int) -> bool:
+        """שחזור פרומפט מהאשפה"""
+        from bson import ObjectId
+        try:
+            before = await self.prompts.find_one_and_update(
+                {"_id": ObjectId(prompt_id), "user_id": user_id, "is_deleted": True},
+                {"$set": {"is_deleted": False}, "$unset": {"deleted_at": ""}},
+                return_document=ReturnDocument.BEFORE
+            )
+            if before is not None:
+                await self._invalidate_prompt(before["_id"])
+                await asyncio.gather(
+                    self.update_user_stats(user_id, "total_prompts", 1),
+                    self._apply_summary_delta(
+                        user_id, self._summary_delta(before, {**before, "is_deleted": False})
+                    ),
+                )
+                self._index_prompt(user_id, before)
+                return True
+            return False
+        except Exception:
+            return False
+
+    async def increment_use_count(self, prompt_id: str, user_id: int):
+        """הגדלת מונה שימושים.
+
+        עם מאגר הכתיבה המושהית המפתח הוא _id בלבד – הקורא כבר טען את הפרומפט
+        עם user_id (get_prompt), כך שהבעלות נבדקה.
+        """
+        from bson import ObjectId
+        try:
+            if self.inline_index is not None:
+                self.inline_index.bump(user_id, ObjectId(prompt_id))
+            if self.prompt_cache is not None:
+                await self.prompt_cache.bump(prompt_id, "use_count")
+            # מאגר שכבר נעצר (כיבוי) לא מקבל עוד – אז כותבים ישירות
+            if self.write_buffer is not None and self.write_buffer.increment(
+                    self.prompts.name, "_id", ObjectId(prompt_id), {"use_count": 1}):
+                await self.update_user_stats(user_id, "total_uses")
+                return
+            await self.prompts.update_one(
+                {"_id": ObjectId(prompt_id), "user_id": user_id},
+                {"$inc": {"use_count": 1}}
+            )
+            await self.update_user_stats(user_id, "total_uses")
+        except Exception:
+            pass
+
+    # ========== חיפוש וסינון ==========
+
+    def _index_prompt(self, user_id: int, prompt: Dict):
+        """עדכון אינדקס החיפוש, כרטיסי ה-inline וחתימות הכפילויות (רק אם כבר נטענו למשתמש) וניקוי תוצאות החיפוש השמורות."""
+        self.search_results.invalidate(user_id)
+        if self.search_engine is not None:
+            self.search_engine.add(user_id, prompt)
+        if self.inline_index is not None:
+            self.inline_index.add(user_id, prompt)
+        if self.near_duplicates is not None:
+            self.near_duplicates.add(user_id, prompt)
+
+    async def _search_index(self, user_id: int) -> UserIndex:
+        """האינדקס של המשתמש; בפעם הראשונה נבנה מהפרומפטים הפעילים (בניה אחת במקביל לכל משתמש)."""
+        index = self.search_engine.get(user_id)
+        if index is not None:
+            return index
+
+        async def load():
+            docs = await self.prompts.find(
+                {"user_id": user_id, "is_deleted": False},
+                {"title": 1, "content": 1, "tags": 1}
+            ).to_list(length=None)
+            return await asyncio.to_thread(build_index, docs)
+
+        # כתיבות שמגיעות בזמן הבניה נשמרות ומוחלות על האינדקס בסופה (SearchEngine.store)
+        return await self._load_per_user(self.search_engine, self._search_build_locks, user_id, load)
+
+    async def _load_per_user(self, registry, locks: Dict[int, list], user_id: int,
+                             loader: Callable[[], Awaitable[Any]]) -> Any:
+        """טעינה אחת במקביל לכל משתמש למבנה בזיכרון (get / begin_load / store / abort_load).
+
+        הנעילה נשמרת כל עוד מישהו ממתין לה, כך שאחרי טעינה שנכשלה לא נפתחת טעינה שנייה במקביל.
+        """
+        value = registry.get(user_id)
+        if value is not None:
+            return value
+        entry = locks.setdefault(user_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                value = registry.get(user_id)
+                if value is not None:
+                    return value
+                version = registry.begin_load(user_id)
+                try:
+                    value = await loader()
+                except BaseException:
+                    registry.abort_load(user_id)
+                    raise
+                return registry.store(user_id, value, version)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                locks.pop(user_id, None)
+
+    @staticmethod
+    def _search_key(query: str, fuzzy: bool, category: str = None,
+                    tags: List[str] = None, favorites_only: bool = False) -> tuple:
+        return (" ".join((query or "").lower().split()), fuzzy, category,
+                tuple(sorted(tags or ())), favorites_only)
+
+    async def _filter_ranked_ids(self, user_id: int, ids: List, category: str = None,
+                                 tags: List[str] = None, favorites_only: bool = False) -> List:
+        """החלת שאר המסננים על רשימת _id מדורגת (שליפה אחת של _id בלבד), בלי לשנות את הסדר."""
+        if not ids or not (category or tags or favorites_only):
+            return ids
+        filter_query = self._search_filter(user_id, None, category, tags, favorites_only)
+        filter_query["_id"] = {"$in": ids}
+        docs = await self.prompts.find(filter_query, {"_id": 1}).to_list(length=None)
+        allowed = {doc["_id"] for doc in docs}
+        return [doc_id for doc_id in ids if doc_id in allowed]
+
+    async def _rank_ids(self, user_id: int, query: str, fuzzy: bool, category: str = None,
+                        tags: List[str] = None, favorites_only: bool = False) -> List:
+        """כל ה-_id התואמים מהטוב לגרוע: BM25 / חיפוש עמום בזיכרון, או $text מדורג במסד.
+        בלי שאילתה (סינון לפי תגית בלבד) – מהחדש לישן."""
+        if not query:
+            filter_query = self._search_filter(user_id, None, category, tags, favorites_only)
+            docs = await (self.prompts.find(filter_query, {"_id": 1})
+                          .sort(self.SORT_NEWEST)
+                          .limit(config.SEARCH_MAX_CANDIDATES)
+                          .to_list(length=None))
+            return [doc["_id"] for doc in docs]
+        if self.search_engine is None:
+            if fuzzy:
+                return []
+            filter_query = self._search_filter(user_id, query, category, tags, favorites_only)
+            pipeline = self._text_rank_pipeline(filter_query, {"_id": 1},
+                                                limit=config.SEARCH_MAX_CANDIDATES)
+            docs = await self.prompts.aggregate(pipeline).to_list(length=None)
+            return [doc["_id"] for doc in docs]
+
+        index = await self._search_index(user_id)
+        if fuzzy:
+            candidates = index.fuzzy_candidates(query, limit=config.FUZZY_MAX_CANDIDATES)
+            # לפי מספר המועמדים: מעט – בלולאה, בינוני – ב-thread, הרבה – ב-process pool
+            ranked = await fuzzy_match.rank(
+                query, candidates, config.FUZZY_MIN_SCORE,
+                inline_max=config.FUZZY_INLINE_MAX_CANDIDATES,
+                pool_min=config.FUZZY_POOL_MIN_CANDIDATES,
+                workers=config.FUZZY_POOL_WORKERS,
+                chunk_size=config.FUZZY_POOL_CHUNK_SIZE,
+            )
+            ranked = ranked[:config.SEARCH_MAX_CANDIDATES]
+        else:
+            ranked = index.search(query, limit=config.SEARCH_MAX_CANDIDATES)
+        ids = [doc_id for doc_id, _ in ranked]
+        return await self._filter_ranked_ids(user_id, ids, category, tags, favorites_only)
+
+    async def _search_results(self, user_id: int, query: str, fuzzy: bool = False,
+                              category: str = None, tags: List[str] = None,
+                              favorites_only: bool = False) -> SearchResults:
+        """רשימת ה-_id המדורגת מהמטמון; מחושבת פעם אחת לכל (משתמש, שאילתה, מסננים)."""
+        key = self._search_key(query, fuzzy, category, tags, favorites_only)
+        results = self.search_results.get(user_id, key)
+        if results is None:
+            ids = await self._rank_ids(user_id, query, fuzzy, category, tags, favorites_only)
+            results = self.search_results.put(user_id, key, ids, fuzzy)
+        return results
+
+    async def _fetch_by_ids(self, user_id: int, ids) -> List[Dict]:
+        """שליפת עמוד תוצאות לפי _id בסדר הנתון – רק השדות שרשימת התוצאות מציגה."""
+        if not ids:
+            return []
+        rank = {doc_id: position for position, doc_id in enumerate(ids)}
+        docs = await self.prompts.find(
+            {"_id": {"$in": list(rank)}, "user_id": user_id, "is_deleted": False},
+            self.SEARCH_RESULT_PROJECTION
+        ).to_list(length=None)
+        docs.sort(key=lambda doc: rank[doc["_id"]])
+        return self._overlay_prompts(docs)
+
+    async def similar_prompts(self, user_id: int, prompt_id: str,
+                              limit: int = config.SIMILAR_PROMPTS_LIMIT) -> List[PromptSummary]:
+        """הפרומפטים הדומים ביותר (קירוב של cosine על TF-IDF מאינדקס החיפוש – ראו UserIndex.similar), הדומה ביותר ראשון."""
+        from bson import ObjectId
+        if self.search_engine is None or not ObjectId.is_valid(prompt_id):
+            return []
+        index = await self._search_index(user_id)
+        if index.vector_norms_stale():
+            # חישוב מחדש של הנורמות אחרי שהספרייה השתנתה הרבה – מחוץ ל-event loop
+            await asyncio.to_thread(index.refresh_vector_norms)
+        ranked = index.similar(ObjectId(prompt_id), limit)
+        return summaries(await self._fetch_by_ids(user_id, [doc_id for doc_id, _ in ranked]))
+
+    async def get_search_page(self, user_id: int, query: str, page: int = 0,
+                              page_size: int = config.PROMPTS_PER_PAGE,
+                              fuzzy: bool = False, tag: str = None) -> SearchPage:
+        """עמוד תוצאות מתוך הרשימה המדורגת שבמטמון; בלי התאמה מדויקת – חיפוש עמום.
+        tag בלי query – כל הפרומפטים עם התגית."""
+        tags = [tag] if tag else None
+        results = await self._search_results(user_id, query, fuzzy, tags=tags)
+        if query and not results.ids and not fuzzy and self.search_engine is not None:
+            results = await self._search_results(user_id, query, fuzzy=True, tags=tags)
+        start = max(0, page) * page_size
+        items = await self._fetch_by_ids(user_id, results.ids[start:start + page_size])
+        return SearchPage(summaries(items), len(results.ids), results.fuzzy)
+
+    async def fuzzy_search_prompts(self, user_id: int, query: str, category: str = None,
+                                   tags: List[str] = None, favorites_only: bool = False,
+                                   skip: int = 0, limit: int = 10) -> List[Dict]:
+        """חיפוש עמום (שגיאות הקלדה) בכותרות ובתגיות: סינון טריגרמות ואז ניקוד Levenshtein באצווה."""
+        if not query:
+            return []
+        results = await self._search_results(user_id, query, True, category, tags, favorites_only)
+        return await self._fetch_by_ids(user_id, results.ids[skip:skip + limit])
+
+    async def search_prompts(self, user_id: int, query: str = None,
+                             category: str = None, tags: List[str] = None,
+                             favorites_only: bool = False,
+                             skip: int = 0, limit: int = 10) -> List[Dict]:
+        """חיפוש פרומפטים עם סינון; שאילתת טקסט מדורגת לפי רלוונטיות ומדפדפת מתוך המטמון"""
+        if query:
+            results = await self._search_results(user_id, query, False, category, tags, favorites_only)
+            return await self._fetch_by_ids(user_id, results.ids[skip:skip + limit])
+        filter_query = self._search_filter(user_id, query, category, tags, favorites_only)
+
+        cursor = (self.prompts.find(filter_query)
+                  .sort(self.SORT_NEWEST)
+                  .skip(skip)
+                  .limit(limit))
+        return self._overlay_prompts(await cursor.to_list(length=limit))
+
+    # ========== כפילויות קרובות ==========
+
+    async def _signatures(self, user_id: int) -> UserSignatures:
+        """חתימות התוכן של המשתמש; בפעם הראשונה נטענות מהשדה השמור בלבד – בלי תוכן.
+
+        פרומפטים ישנים בלי חתימה מדולגים; את החתימות שלהם ממלאת מיגרציית הרקע
+        SignatureBackfill (migrations.py), והן נכנסות לאינדקס בטעינה הבאה.
+        """
+
+        async def load():
+            docs = await self.prompts.find(
+                {"user_id": user_id, "is_deleted": False, SIGNATURE_FIELD: {"$exists": True}},
+                {SIGNATURE_FIELD: 1, "short_code": 1, "title": 1}
+            ).to_list(length=None)
+            return await asyncio.to_thread(build_signatures, docs)
+
+        return await self._load_per_user(self.near_duplicates, self._near_duplicate_load_locks, user_id, load)
+
+    async def find_near_duplicates(self, user_id: int, content: str, limit: int = 3,
+                                   threshold: float = config.NEAR_DUPLICATE_THRESHOLD,
+                                   content_signature: Optional[bytes] = None) -> List[Match]:
+        """פרומפטים פעילים שתוכנם כמעט זהה ל-content (LSH – בלי מעבר על כל הספרייה).
+
+        content_signature – חתימה שכבר חושבה (content_signature()), כדי לא לחשב אותה שוב.
+        """
+        if self.near_duplicates is None:
+            return []
+        signatures = await self._signatures(user_id)
+        sig = content_signature
+        if sig is None:
+            sig = await asyncio.to_thread(signature, content)
+        return signatures.query(sig, threshold, limit)
+
+    @staticmethod
+    def _sign_items(items: List[Dict[str, Any]]) -> None:
+        """חישוב חתימות לאצוות פריטים – רץ ב-thread אחד לכל האצווה."""
+        for item in items:
+            item[SIGNATURE_FIELD] = signature(item["content"])
+
+    async def drop_near_duplicates(self, user_id: int, items: List[Dict[str, Any]],
+                                   threshold: float = config.NEAR_DUPLICATE_THRESHOLD
+                                   ) -> Tuple[List[Dict[str, Any]], int]:
+        """סינון פריטי ייבוא שכמעט זהים לפרומפט קיים או לפריט קודם באותה אצווה.
+
+        מחזיר (הפריטים שנשארו, מספר שסוננו). החתימה נשמרת בפריט כדי ש-bulk_save_prompts לא יחשב אותה שוב.
+        """
+        if self.near_duplicates is None or not items:
+            return items, 0
+        signatures = await self._signatures(user_id)
+        await asyncio.to_thread(self._sign_items, items)
+        batch = UserSignatures()
+        kept = []
+        for index, item in enumerate(items):
+            sig = item[SIGNATURE_FIELD]
+            if signatures.query(sig, threshold, 1) or batch.query(sig, threshold, 1):
+                continue
+            batch.add({"_id": index, SIGNATURE_FIELD: sig})
+            kept.append(item)
+        return kept, len(items) - len(kept)
+
+    # ========== מצב inline ==========
+
+    async def _inline_cards(self, user_id: int) -> UserCards:
+        """כרטיסי ה-inline של המשתמש; בפעם הראשונה נטענים בשאילתה אחת (טעינה אחת במקביל לכל משתמש)."""
+
+        async def load():
+            docs = await self.prompts.find(
+                {"user_id": user_id, "is_deleted": False},
+                {"title": 1, "content": 1, "tags": 1, "short_code": 1,
+                 "is_favorite": 1, "use_count": 1, "created_at": 1}
+            ).to_list(length=None)
+            return await asyncio.to_thread(build_cards, self._overlay_prompts(docs))
+
+        return await self._load_per_user(self.inline_index, self._inline_load_locks, user_id, load)
+
+    async def inline_search(self, user_id: int, query: str,
+                            limit: int = config.INLINE_MAX_RESULTS) -> List[Card]:
+        """פרומפטים לתשובת inline לפי קידומות של כותרת / תגית / קוד קצר; ריק = מועדפים ופופולריים."""
+        if self.inline_index is None:
+            return []
+        cards = await self._inline_cards(user_id)
+        return cards.search(query, limit)
+
+    async def record_inline_choice(self, user_id: int, result_id: str) -> bool:
+        """תוצאת inline שנבחרה נספרת כשימוש – רק אם היא אכן פרומפט של המשתמש."""
+        from bson import ObjectId
+        if not ObjectId.is_valid(result_id):
+            return False
+        cards = self.inline_index.get(user_id) if self.inline_index is not None else None
+        if cards is not None:
+            owned = ObjectId(result_id) in cards.cards
+        else:
+            owned = await self.prompts.count_documents(
+                {"_id": ObjectId(result_id), "user_id": user_id, "is_deleted": False}, limit=1
+            ) > 0
+        if owned:
+            await self.increment_use_count(result_id, user_id)
+        return owned
+
+    async def get_all_prompts(self, user_id: int, skip: int = 0,
+                              limit: int = 10) -> List[Dict]:
+        """קבלת כל הפרומפטים של משתמש"""
+        cursor = self.prompts.find({
+            "user_id": user_id,
+            "is_deleted": False
+        }).sort(self.SORT_NEWEST).skip(skip).limit(limit)
+        return self._overlay_prompts(await cursor.to_list(length=limit))
+
+    async def get_favorites(self, user_id: int, limit: int = 0) -> List[Dict]:
+        """קבלת פרומפטים מועדפים (limit=0 – ללא הגבלה)"""
+        cursor = self.prompts.find({
+            "user_id": user_id,
+            "is_favorite": True,
+            "is_deleted": False
+        }).sort(self.SORT_POPULAR).limit(limit)
+        return self._overlay_prompts(await cursor.to_list(length=limit or None))
+
+    async def get_trash(self, user_id: int, limit: int = 0) -> List[Dict]:
+        """קבלת פרומפטים באשפה (limit=0 – ללא הגבלה)"""
+        cursor = self.prompts.find({
+            "user_id": user_id,
+            "is_deleted": True
+        }).sort(self.SORT_RECENTLY_DELETED).limit(limit)
+        return await cursor.to_list(length=limit or None)
+
+    async def get_popular_prompts(self, user_id: int, limit: int = 10) -> List[Dict]:
+        """קבלת הפרומפטים הפופולריים ביותר"""
+        cursor = self.prompts.find({
+            "user_id": user_id,
+            "is_deleted": False
+        }).sort(self.SORT_POPULAR).limit(limit)
+        return self._overlay_prompts(await cursor.to_list(length=limit))
+
+    async def get_prompt_page(self, user_id: int, view: str, request: PageRequest = None,
+                              limit: int = None, category: str = None) -> Page:
+        """עמוד בתצוגת רשימה לפי סמן (keyset) – ללא skip, כך שעמוד עמוק עולה כמו הראשון."""
+        request = request or PageRequest(0, NEXT, None)
+        limit = limit or config.PROMPTS_PER_PAGE
+        filter_query, sort, field = self._page_query(user_id, view, request, category)
+        # נשלוף רשומה אחת נוספת כדי לדעת אם יש עמוד המשך
+        docs = await self.prompts.find(
+            filter_query, self.LIST_VIEW_PROJECTIONS[view]
+        ).sort(sort).limit(limit + 1).to_list(length=limit + 1)
+        page = build_page(docs, field, limit, request.direction, request.cursor is not None)
+        # אחרי build_page: הסמנים נשארים לפי הערכים השמורים במסד
+        return page._replace(items=summaries(self._overlay_prompts(page.items)))
+
+    async def get_list_screen(self, user_id: int, view: str, request: PageRequest = None,
+                              limit: int = None, category: str = None) -> ListScreen:
+        """עמוד + ספירה + קטגוריות בסבב אחד מול השרת (במקום שלוש קריאות נפרדות)."""
+        request = request or PageRequest(0, NEXT, None)
+        limit = limit or config.PROMPTS_PER_PAGE
+        filter_query, sort, field = self._page_query(user_id, view, request, category)
+        # קטגוריות שכבר במטמון לא נשלפות שוב
+        snapshot = self.category_cache.get(user_id)
+        version = self.category_cache.version(user_id)
+        pipeline = self._list_screen_pipeline(user_id, filter_query, sort, limit + 1,
+                                              self.LIST_VIEW_PROJECTIONS[view],
+                                              include_user=snapshot is None)
+        try:
+            docs = await self.db.aggregate(pipeline).to_list(length=1)
+        except OperationFailure:
+            # שרת ללא $documents (לפני 5.1) – אותן קריאות במקביל
+            return await self._list_screen_parallel(user_id, view, request, limit, category)
+        bundle = docs[0] if docs else {}
+
+        summary = (bundle.get("summary") or [None])[0]
+        if summary is None:
+            summary = await self.rebuild_user_summary(user_id)
+        if snapshot is None:
+            categories = ((bundle.get("user") or [{}])[0]).get("categories")
+            if categories:
+                snapshot = self.category_cache.store(user_id, categories, version)
+            else:
+                snapshot = await self._category_snapshot(user_id)
+
+        page = build_page(bundle.get("items") or [], field, limit,
+                          request.direction, request.cursor is not None)
+        page = page._replace(items=summaries(self._overlay_prompts(page.items)))
+        return ListScreen(page, self._summary_view_count(summary, view, category),
+                          dict(snapshot.lookup))
+
+    async def _list_screen_parallel(self, user_id: int, view: str, request: PageRequest,
+                                    limit: int, category: str = None) -> ListScreen:
+        page, summary, snapshot = await asyncio.gather(
+            self.get_prompt_page(user_id, view, request, limit, category),
+            self.get_user_summary(user_id),
+            self._category_snapshot(user_id),
+        )
+        return ListScreen(page, self._summary_view_count(summary, view, category),
+                          dict(snapshot.lookup))
+
+    async def count_page_view(self, user_id: int, view: str, category: str = None) -> int:
+        """ספירת כל המסמכים בתצוגה (לתצוגת מספר העמודים)."""
+        return await self.prompts.count_documents(self._page_view_filter(user_id, view, category))
+
+    async def iter_user_prompts(self, user_id: int, include_trash: bool = False,
+                                batch_size: int = 500):
+        """מעבר על כל הפרומפטים של משתמש בסמן עם batch_size – בלי לבנות רשימה בזיכרון."""
+        filter_query = {"user_id": user_id}
+        if not include_trash:
+            filter_query["is_deleted"] = False
+        # פעילים ואחריהם אשפה – אותו סדר של user_active_created, כך שאין מיון בזיכרון
+        sort = [("is_deleted", ASCENDING)] + self.SORT_NEWEST
+        cursor = self.prompts.find(filter_query, {SIGNATURE_FIELD: 0}).sort(sort).batch_size(batch_size)
+        async for prompt in cursor:
+            yield prompt
+
+    async def count_prompts(self, user_id: int, **filters) -> int:
+        """ספירת פרומפטים"""
+        filter_query = {"user_id": user_id, "is_deleted": False}
+        filter_query.update(filters)
+        return await self.prompts.count_documents(filter_query)
+
+    # ========== תגיות ==========
+
+    async def _tag_trie(self, user_id: int) -> TagTrie:
+        """ה-trie של המשתמש; בפעם הראשונה נבנה ממוני התגיות שבמסמך הסיכום."""
+
+        async def load():
+            counts = self._summary_counts(await self.get_user_summary(user_id), "tags")
+            return TagTrie((item["_id"], item["count"]) for item in counts)
+
+        return await self._load_per_user(self.tag_tries, self._tag_trie_load_locks, user_id, load)
+
+    async def get_all_tags(self, user_id: int) -> List[str]:
+        """קבלת כל התגיות של משתמש, מהנפוצה ביותר"""
+        trie = await self._tag_trie(user_id)
+        return [tag for tag, _ in trie.top(limit=0)]
+
+    async def suggest_tags(self, user_id: int, prefix: str = "",
+                           limit: int = config.TAG_SUGGESTIONS,
+                           exclude: List[str] = ()) -> List[str]:
+        """השלמה אוטומטית: התגיות הנפוצות ביותר שמתחילות ב-prefix (ריק = הנפוצות בכלל)."""
+        trie = await self._tag_trie(user_id)
+        return [tag for tag, _ in trie.complete(prefix, limit, exclude)]
+
+    # ========== סטטיסטיקות ==========
+
+    async def get_user_statistics(self, user_id: int) -> Dict:
+        """קבלת סטטיסטיקות מפורטות – קריאה אחת של מסמך הסיכום יחד עם מסמך המשתמש."""
+        pipeline = [
+            {"$match": {"_id": user_id}},
+            {"$lookup": {
+                "from": self.users.name,
+                "localField": "_id",
+                "foreignField": "user_id",
+                "as": "user",
+            }},
+        ]
+        docs = await self.stats.aggregate(pipeline).to_list(length=1)
+        if not docs:
+            await self.rebuild_user_summary(user_id)
+            docs = await self.stats.aggregate(pipeline).to_list(length=1)
+        summary = docs[0] if docs else {}
+        user = (summary.get("user") or [{}])[0]
+        self._overlay_pending(self.users.name, "user_id", [user])
+
+        return {
+            "user": user.get('stats', {}),
+            "categories": self._summary_counts(summary, "categories")[:5],
+            "tags": self._summary_counts(summary, "tags")[:5],
+            "favorites": summary.get("favorites", 0),
+        }
+
+    async def get_admin_statistics(self, days: int = 7) -> Dict[str, Any]:
+        """
+        החזרת נתוני סטטיסטיקה גלובליים למנהל.
+
+        מספר משתמשים חדשים ב-X הימים האחרונים + מספר פעולות (שמירות + שימושים)
+        לכל משתמש.
+        """
+        since = datetime.utcnow() - timedelta(days=days)
+        recent_users, total_users = await asyncio.gather(
+            self.users.count_documents({"created_at": {"$gte": since}}),
+            self.users.count_documents({}),
+        )
+
+        user_actions: List[Dict[str, Any]] = []
+        cursor = self.users.find(
+            {},
+            {
+                "user_id": 1,
+                "username": 1,
+                "first_name": 1,
+                "stats": 1
+            }
+        )
+        docs = await cursor.to_list(length=None)
+        self._overlay_pending(self.users.name, "user_id", docs)
+        for doc in docs:
+            user_actions.append(self._admin_user_action(doc))
+
+        user_actions.sort(key=lambda item: (item["action_count"], item["total_uses"]), reverse=True)
+
+        return {
+            "recent_users": recent_users,
+            "total_users": total_users,
+            "user_actions": user_actions
+        }
+
+    # ========== מסמך סיכום ==========
+
+    async def _apply_summary_delta(self, user_id: int, delta: Dict[str, int]):
+        """עדכון מוני הסיכום. בלי upsert: אם עוד אין מסמך, הוא ייבנה במלואו בקריאה הראשונה."""
+        if not delta:
+            return
+        await self.stats.update_one(
+            {"_id": user_id},
+            {"$inc": delta, "$set": {"updated_at": datetime.utcnow()}}
+        )
+        self.tag_tries.apply(user_id, {
+            self._summary_name(field[len("tags."):]): count
+            for field, count in delta.items() if field.startswith("tags.")
+        })
+
+    async def _move_summary_category(self, user_id: int, old_name: str, new_name: str):
+        """העברת מונה קטגוריה בשינוי שם/מחיקה (הפרומפטים עברו ב-update_many).
+
+        עדכון pipeline יחיד – קריאה ואז כתיבה הייתה מאבדת $inc שנכנס ביניהן.
+        """
+        old_field = f"categories.{self._summary_key(old_name)}"
+        new_field = f"categories.{self._summary_key(new_name)}"
+        if old_field == new_field:
+            return
+        await self.stats.update_one(
+            {"_id": user_id, old_field: {"$exists": True}},
+            [
+                {"$set": {
+                    new_field: {"$add": [{"$ifNull": [f"${new_field}", 0]},
+                                         {"$ifNull": [f"${old_field}", 0]}]},
+                    "updated_at": datetime.utcnow(),
+                }},
+                {"$unset": old_field},
+            ]
+        )
+
+    async def get_user_summary(self, user_id: int) -> Dict:
+        """מסמך הסיכום של המשתמש (נבנה מחדש אם חסר)."""
+        summary = await self.stats.find_one({"_id": user_id})
+        if summary is None:
+            summary = await self.rebuild_user_summary(user_id)
+        return summary
+
+    async def get_category_counts(self, user_id: int) -> Dict[str, int]:
+        """מספר הפרומפטים הפעילים בכל קטגוריה."""
+        summary = await self.get_user_summary(user_id)
+        return {item["_id"]: item["count"] for item in self._summary_counts(summary, "categories")}
+
+    async def get_tag_counts(self, user_id: int) -> List[Dict[str, Any]]:
+        """תגיות ומספר הפרומפטים הפעילים בכל אחת, מהנפוצה ביותר (מתוך ה-trie)."""
+        trie = await self._tag_trie(user_id)
+        return [{"_id": tag, "count": count} for tag, count in trie.top(limit=0)]
+
+    async def _compute_user_summary(self, user_id: int) -> Dict:
+        facets = await self.prompts.aggregate(self._summary_rebuild_pipeline(user_id)).to_list(length=1)
+        return self._summary_from_facets(user_id, facets[0] if facets else {})
+
+    async def rebuild_user_summary(self, user_id: int) -> Dict:
+        """חישוב מלא של מסמך הסיכום מתוך prompts ושמירתו."""
+        summary = await self._compute_user_summary(user_id)
+        await self.stats.replace_one({"_id": user_id}, summary, upsert=True)
+        self.tag_tries.drop(user_id)
+        return summary
+
+    async def verify_user_summary(self, user_id: int, repair: bool = True) -> Dict[str, Any]:
+        """בדיקת סטייה בין המונים השמורים לחישוב מלא; מתקן כברירת מחדל.
+        מחזיר {שדה: (שמור, מחושב)} – ריק כאשר אין סטייה."""
+        stored, fresh = await asyncio.gather(
+            self.stats.find_one({"_id": user_id}),
+            self._compute_user_summary(user_id),
+        )
+        drift = self._summary_drift(stored, fresh)
+        if drift and repair:
+            await self.stats.replace_one({"_id": user_id}, fresh, upsert=True)
+            self.tag_tries.drop(user_id)
+        return drift
+
+    # ========== ניקוי ==========
+
+    async def cleanup_old_trash(self):
+        """מחיקה סופית של פרומפטים ישנים באשפה"""
+        expired = {
+            "is_deleted": True,
+            "deleted_at": {"$lt": self._trash_threshold()}
+        }
+        per_user = await self.prompts.aggregate([
+            {"$match": expired},
+            {"$group": {"_id": "$user_id", "count": {"$sum": 1}}},
+        ]).to_list(length=None)
+        result = await self.prompts.delete_many(expired)
+        await asyncio.gather(*(
+            self._apply_summary_delta(item["_id"], {"trash": -item["count"]})
+            for item in per_user
+        ))
+        return result.deleted_count
+
+# יצירת instance גלובלי
+db = AsyncDatabase()
@@ -1,37 +1,51 @@
 """
 PromptTracker Bot - בוט לניהול פרומפטים
 """
+import asyncio
 import logging
 import threading
 from http.server import BaseHTTPRequestHandler, HTTPServer
 from datetime import datetime, timezone
 from telegram import Update, BotCommand, BotCommandScopeChat
+from telegram.error import RetryAfter
 from telegram.ext import (
     Application,
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
+    ChosenInlineResultHandler,
     ConversationHandler,
+    InlineQueryHandler,
     filters
 )
 
 import config
+import fuzzy_match
 from distributed_lock import MongoDistributedLock
-from database import db
-from keyboards import main_menu_keyboard, back_button
+from migrations import apply_schema_migrations, start_background_migrations
+from mongo_client import warm_up_async
+from update_processor import PerUserUpdateProcessor
+from rate_limiter import PriorityRateLimiter
+from async_database import db
+from index_audit import run_audit, format_report
+from keyboards import main_menu_keyboard, back_button, pagination_keyboard
+from pagination import parse_callback as parse_page_callback
 from handlers.save import (
     start_save_prompt,
     receive_prompt_content,
     receive_prompt_title,
     receive_prompt_category,
     cancel_save,
+    confirm_near_duplicate,
     WAITING_FOR_PROMPT,
     WAITING_FOR_TITLE,
-    WAITING_FOR_CATEGORY
+    WAITING_FOR_CATEGORY,
+    WAITING_FOR_DUPLICATE_CHOICE
 )
 from handlers.manage import (
     view_my_prompts,
     view_prompt_details,
+    show_similar_prompts,
     handle_view_command_text,
     copy_prompt,
     toggle_favorite,
@@ -54,6 +68,8 @@ from handlers.manage import (
 from handlers.search import (
     start_search,
     receive_search_query,
+    show_search_page,
+    search_by_tag,
     filter_by_category,
     show_categories_menu,
     manage_categories,
@@ -71,10 +87,20 @@ from handlers.search import (
     CATEGORY_ADDING,
     CATEGORY_RENAMING
 )
+from handlers.exporter import export_command
+from handlers.inline import inline_query, chosen_inline_result
+from handlers.importer import (
+    start_import,
+    receive_import_file,
+    remind_import_file,
+    cancel_import,
+    WAITING_FOR_IMPORT_FILE
+)
 from handlers.tags import (
     manage_tags,
     start_add_tag,
     receive_new_tag,
+    pick_suggested_tag,
     remove_tag,
     cancel_add_tag,
     WAITING_FOR_NEW_TAG
@@ -136,6 +162,21 @@ def start_healthcheck_server():
     logger.info("Health-check server is listening on port %s", port)
 
 
+async def post_init(application: Application):
+    """חימום מאגר החיבורים של motor לפני העדכון הראשון, ואז תפריט הפקודות."""
+    await warm_up_async()
+    await setup_bot_commands(application)
+
+
+async def post_shutdown(application: Application):
+    """כתיבת מונים שממתינים במאגר, סגירת תהליכי החיפוש העמום וחיבור ה-Redis לפני סגירת התהליך."""
+    if db.write_buffer is not None:
+        await asyncio.to_thread(db.write_buffer.stop)
+    await asyncio.to_thread(fuzzy_match.shutdown_pool)
+    if db.prompt_cache is not None:
+        await db.prompt_cache.close()
+
+
 async def setup_bot_commands(application: Application):
     """Register admin-specific commands in Telegram's command menu."""
     admin_id = config.ADMIN_USER_ID
@@ -146,7 +187,9 @@ async def setup_bot_commands(application: Application):
         admin_commands = [
             BotCommand("start", "מתחילים ✅"),
             BotCommand("statsa", "סטטיסטיקות מנהל"),
-            BotCommand("debug_saves", "תצוגת שמירות (דיבאג)")
+            BotCommand("debug_saves", "תצוגת שמירות (דיבאג)"),
+            BotCommand("indexaudit", "בדיקת שימוש באינדקסים"),
+            BotCommand("summarycheck", "בדיקת מוני סיכום")
         ]
         await bot.set_my_commands(
             admin_commands,
@@ -162,7 +205,7 @@ async def start_command(update: Update, context):
     user = update.effective_user
     
     # יצירת/עדכון משתמש
-    db.get_or_create_user(
+    await db.get_or_create_user(
         user_id=user.id,
         username=user.username,
         first_name=user.first_name
@@ -197,9 +240,12 @@ async def help_command(update: Update, context):
     commands = [
         "🔹 /start - תפריט ראשי",
         "🔹 /save - שמור פרומפט חדש",
+        "🔹 /import - ייבוא פרומפטים מקובץ",
+        "🔹 /export - ייצוא כל הפרומפטים לקובץ",
         "🔹 /list - הצג את כל הפרומפטים",
         "🔹 /search - חיפוש פרומפטים",
         "🔹 /favorites - פרומפטים מועדפים",
+        "🔹 /popular - פרומפטים פופולריים",
         "🔹 /stats - סטטיסטיקות",
         "🔹 /categories - קטגוריות",
         "🔹 /tags - תגיות",
@@ -233,7 +279,7 @@ async def show_settings(update: Update, context):
     if query:
         await query.answer()
     user = update.effective_user
-    user_doc = db.get_or_create_user(user.id, user.username, user.first_name)
+    user_doc = await db.get_or_create_user(user.id, user.username, user.first_name)
 
     settings = user_doc.get('settings', {})
     text = (
@@ -261,14 +307,15 @@ async def stats_command(update: Update, context):
     if query:
         await query.answer()
 
-    stats = db.get_user_statistics(user.id)
-    category_lookup = db.get_category_lookup(user.id)
+    stats = await db.get_user_statistics(user.id)
+    category_lookup = await db.get_category_lookup(user.id)
+    favorites_count = stats.get('favorites', 0)
     user_stats = stats.get('user', {})
 
     text = "📊 <b>הסטטיסטיקות שלך</b>\n\n"
     text += f"📋 סה״כ פרומפטים: <b>{user_stats.get('total_prompts', 0)}</b>\n"
     text += f"🔢 סה״כ שימושים: <b>{user_stats.get('total_uses', 0)}</b>\n"
-    text += f"⭐ מועדפים: <b>{db.count_prompts(user.id, is_favorite=True)}</b>\n\n"
+    text += f"⭐ מועדפים: <b>{favorites_count}</b>\n\n"
 
     categories = stats.get('categories') or []
     tags = stats.get('tags') or []
@@ -313,7 +360,7 @@ async def admin_stats_command(update: Update, context):
         )
         return
 
-    stats = db.get_admin_statistics(days=7)
+    stats = await db.get_admin_statistics(days=7)
     user_actions = stats.get("user_actions", [])
     max_rows = 25
 
@@ -347,6 +394,16 @@ async def admin_stats_command(update: Update, context):
     else:
         text += "⚙️ אין נתוני פעולות להצגה."
 
+    limiter = context.bot.rate_limiter
+    if isinstance(limiter, PriorityRateLimiter):
+        metrics = limiter.metrics()
+        text += (
+            "\n\n📤 <b>תור שליחה</b>\n"
+            f"ממתינות: {metrics['queued_interactive']} אינטראקטיביות | {metrics['queued_background']} רקע "
+            f"(שיא: {metrics['max_queued']})\n"
+            f"עוכבו: {metrics['delayed']} | הצפה (429): {metrics['retry_after']}"
+        )
+
     await update.message.reply_text(
         text,
         parse_mode='HTML',
@@ -391,7 +448,7 @@ async def debug_user_saves_command(update: Update, context):
     if len(args) > 1:
         limit = _parse_limit(args[1])
 
-    target_user = db.find_user_by_identifier(identifier)
+    target_user = await db.find_user_by_identifier(identifier)
     if not target_user:
         await update.message.reply_text(
             "⚠️ המשתמש לא נמצא במסד הנתונים.",
@@ -407,8 +464,8 @@ async def debug_user_saves_command(update: Update, context):
         )
         return
 
-    total_prompts = db.count_prompts(target_user_id)
-    prompts = db.get_all_prompts(target_user_id, skip=0, limit=limit)
+    total_prompts = await db.count_prompts(target_user_id)
+    prompts = await db.get_all_prompts(target_user_id, skip=0, limit=limit)
 
     display_name = target_user.get("username") or target_user.get("first_name") or "ללא שם"
     text = (
@@ -422,7 +479,7 @@ async def debug_user_saves_command(update: Update, context):
     if not prompts:
         text += "אין פרומפטים פעילים להצגה."
     else:
-        category_lookup = db.get_category_lookup(target_user_id)
+        category_lookup = await db.get_category_lookup(target_user_id)
         for idx, prompt in enumerate(prompts, 1):
             title = prompt.get("title") or "ללא כותרת"
             short_code = prompt.get("short_code") or str(prompt.get("_id"))
@@ -449,11 +506,69 @@ async def debug_user_saves_command(update: Update, context):
         reply_markup=back_button("back_main")
     )
 
+async def index_audit_command(update: Update, context):
+    """פקודת מנהל: explain לכל צורות השאילתות וסימון COLLSCAN / מיון בזיכרון."""
+    user = update.effective_user
+    if not user or not is_admin_user(user.id):
+        await update.message.reply_text(
+            "⚠️ הפקודה זמינה רק למנהל המערכת.",
+            reply_markup=back_button("back_main")
+        )
+        return
+
+    args = getattr(context, "args", None) or []
+    sample_user_id = user.id
+    if args and args[0].isdigit():
+        sample_user_id = int(args[0])
+
+    # explain רץ על הדרייבר הסינכרוני – מחוץ ל-event loop
+    results = await asyncio.to_thread(run_audit, sample_user_id)
+    report = format_report(results)
+    await update.message.reply_text(
+        "🔎 <b>בדיקת אינדקסים</b>\n"
+        f"משתמש לדוגמה: {code_inline(sample_user_id)}\n\n"
+        f"{escape_html(report)}",
+        parse_mode='HTML',
+        reply_markup=back_button("back_main")
+    )
+
+async def summary_check_command(update: Update, context):
+    """פקודת מנהל: השוואת מוני הסיכום לחישוב מלא ותיקון סטיות (/summarycheck [user_id])."""
+    user = update.effective_user
+    if not user or not is_admin_user(user.id):
+        await update.message.reply_text(
+            "⚠️ הפקודה זמינה רק למנהל המערכת.",
+            reply_markup=back_button("back_main")
+        )
+        return
+
+    args = getattr(context, "args", None) or []
+    target_user_id = int(args[0]) if args and args[0].isdigit() else user.id
+
+    drift = await db.verify_user_summary(target_user_id, repair=True)
+    text = (
+        "🧮 <b>בדיקת מוני סיכום</b>\n"
+        f"משתמש: {code_inline(target_user_id)}\n\n"
+    )
+    if not drift:
+        text += "✅ אין סטייה."
+    else:
+        text += f"🔧 תוקנו {len(drift)} מונים:\n"
+        for field, (stored, fresh) in sorted(drift.items())[:30]:
+            text += f"• {escape_html(field)}: {stored} → {fresh}\n"
+    await update.message.reply_text(
+        text,
+        parse_mode='HTML',
+        reply_markup=back_button("back_main")
+    )
+
 async def trash_command(update: Update, context):
     """הצגת סל מחזור"""
     user = update.effective_user
-    trash_items = db.get_trash(user.id)
     query = update.callback_query
+    request = parse_page_callback(query.data if query else None, "trashpage")
+    result, total_count, category_lookup = await db.get_list_screen(user.id, "trash", request)
+    trash_items = result.items
     # מענה מיידי ללחיצה על כפתור כדי למנוע חסימת לחיצות המשך
     if query:
         await query.answer()
@@ -475,17 +590,13 @@ async def trash_command(update: Update, context):
             )
         return
     
-    text = f"🗑️ <b>סל המחזור</b> ({len(trash_items)})\n\n"
+    text = f"🗑️ <b>סל המחזור</b> ({total_count})\n\n"
     text += "<i>פרומפטים נמחקים לצמיתות אחרי 30 יום</i>\n\n"
     
-    category_lookup = db.get_category_lookup(user.id)
-    for i, prompt in enumerate(trash_items[:20], 1):
-        emoji = category_lookup.get(prompt['category'], '📁')
-        title = prompt['title']
-        if len(title) > 40:
-            title = title[:40] + "..."
+    for i, prompt in enumerate(trash_items, start=request.page * config.PROMPTS_PER_PAGE + 1):
+        emoji = category_lookup.get(prompt.category, '📁')
         
-        deleted_at = prompt.get('deleted_at')
+        deleted_at = prompt.deleted_at
         days_ago = None
         if isinstance(deleted_at, datetime):
             # הבטחת זמן מודע לאזור זמן (UTC) לצורך חיסור בטוח
@@ -496,23 +607,26 @@ async def trash_command(update: Update, context):
                 days_ago = (now_utc - deleted_at).days
             except Exception:
                 days_ago = None
-        text += f"{i}. {emoji} <b>{title}</b>\n"
+        text += f"{i}. {emoji} <b>{escape_html(prompt.short_title())}</b>\n"
         if days_ago is not None:
             text += f"   נמחק לפני {days_ago} ימים\n"
         else:
             text += f"   נמחק לאחרונה\n"
-        text += f"   /restore_{str(prompt['_id'])}\n\n"
+        text += f"   /restore_{prompt.id}\n\n"
+    total_pages = (total_count + config.PROMPTS_PER_PAGE - 1) // config.PROMPTS_PER_PAGE
+    keyboard = pagination_keyboard(request.page, total_pages, "trashpage",
+                                   result.prev_cursor, result.next_cursor)
     if query:
         await query.edit_message_text(
             text,
             parse_mode='HTML',
-            reply_markup=back_button("back_main")
+            reply_markup=keyboard
         )
     else:
         await update.message.reply_text(
             text,
             parse_mode='HTML',
-            reply_markup=back_button("back_main")
+            reply_markup=keyboard
         )
 
 async def restore_command(update: Update, context):
@@ -526,7 +640,7 @@ async def restore_command(update: Update, context):
     user = update.effective_user
     prompt_id = context.args[0].replace('_', '')
     
-    success = db.restore_prompt(prompt_id, user.id)
+    success = await db.restore_prompt(prompt_id, user.id)
     
     if success:
         await update.message.reply_text(
@@ -590,6 +704,9 @@ async def back_to_main(update: Update, context):
 async def error_handler(update: Update, context):
     """טיפול בשגיאות"""
     logger.error(f"Update {update} caused error {context.error}")
+    if isinstance(context.error, RetryAfter):
+        # הצפה – הודעה נוספת רק תחמיר את המצב
+        return
     
     try:
         if update and update.effective_message:
@@ -633,17 +750,43 @@ def main():
         lock.acquire_blocking()
         logger.warning("Distributed lock acquired. Starting heartbeat and polling.")
         lock.start_heartbeat()
+        if db.write_buffer is not None:
+            # מונים שבזיכרון נכתבים לפני שהנעילה משתחררת (כולל SIGTERM / atexit)
+            lock.add_release_callback(db.write_buffer.stop)
     except Exception as exc:
         logger.error("Failed to acquire distributed lock: %s", exc)
         return
 
+    # הנעילה כבר פתחה את הלקוח המשותף (mongo_client) – Database והמיגרציות משתמשים באותו מאגר.
+    # מיגרציות – רק המופע שמחזיק את הנעילה. שלבי סכמה ממתינים (בדרך כלל אין –
+    # קריאה אחת) רצים לפני ה-polling; מילוי נתונים רץ ברקע בלי לעכב אותו.
+    from database import db as sync_db
+    try:
+        apply_schema_migrations(sync_db)
+    except Exception as exc:
+        logger.error("Schema migrations failed: %s", exc)
+    start_background_migrations(sync_db)
+
     # יצירת האפליקציה
-    application = (
+    builder = (
         Application.builder()
         .token(config.BOT_TOKEN)
-        .post_init(setup_bot_commands)
-        .build()
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
     )
+    if config.ENABLE_RATE_LIMITER:
+        builder = builder.rate_limiter(PriorityRateLimiter(
+            global_per_second=config.TELEGRAM_GLOBAL_PER_SECOND,
+            private_per_second=config.TELEGRAM_PRIVATE_PER_SECOND,
+            private_burst=config.TELEGRAM_PRIVATE_BURST,
+            group_per_minute=config.TELEGRAM_GROUP_PER_MINUTE,
+            max_retries=config.TELEGRAM_FLOOD_MAX_RETRIES,
+        ))
+    if config.MAX_CONCURRENT_UPDATES > 1:
+        # משתמשים שונים במקביל, אותו משתמש בסדר קפדני (חשוב ל-ConversationHandler)
+        builder = builder.concurrent_updates(PerUserUpdateProcessor(config.MAX_CONCURRENT_UPDATES))
+        logger.info("Concurrent update processing enabled (max=%s)", config.MAX_CONCURRENT_UPDATES)
+    application = builder.build()
     
     # פקודות בסיס
     application.add_handler(CommandHandler("start", start_command))
@@ -653,9 +796,25 @@ def main():
     application.add_handler(CommandHandler("stats", stats_command))
     application.add_handler(CommandHandler(["statsA", "statsa"], admin_stats_command))
     application.add_handler(CommandHandler("debug_saves", debug_user_saves_command))
+    application.add_handler(CommandHandler("indexaudit", index_audit_command))
+    application.add_handler(CommandHandler("summarycheck", summary_check_command))
     application.add_handler(CommandHandler("trash", trash_command))
+    application.add_handler(CommandHandler("popular", show_popular_prompts))
+    application.add_handler(CommandHandler("export", export_command))
     application.add_handler(CommandHandler("restore", restore_command))
     application.add_handler(CommandHandler("search", start_search))
+    # ייבוא מקובץ – לפני /cancel הכללי כדי שהביטול יגיע לשיחה הפעילה
+    import_conv = ConversationHandler(
+        entry_points=[CommandHandler("import", start_import)],
+        states={
+            WAITING_FOR_IMPORT_FILE: [
+                MessageHandler(filters.Document.ALL, receive_import_file),
+                MessageHandler(~filters.COMMAND, remind_import_file)
+            ]
+        },
+        fallbacks=[CommandHandler("cancel", cancel_import)]
+    )
+    application.add_handler(import_conv)
     application.add_handler(CommandHandler("cancel", cancel_search))
     # תמיכה גם בצורה /view_<id> (ObjectId) וגם /view_<SHORT>
     application.add_handler(MessageHandler(filters.Regex(r"^/view_([0-9a-fA-F]{24}|[0-9a-fA-F]{4,8})$"), handle_view_command_text))
@@ -670,6 +829,9 @@ def main():
             WAITING_FOR_PROMPT: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, receive_prompt_content)
             ],
+            WAITING_FOR_DUPLICATE_CHOICE: [
+                CallbackQueryHandler(confirm_near_duplicate, pattern="^dupsave_continue$")
+            ],
             WAITING_FOR_TITLE: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, receive_prompt_title)
             ],
@@ -736,6 +898,7 @@ def main():
     application.add_handler(CallbackQueryHandler(view_my_prompts, pattern="^my_prompts$"))
     application.add_handler(CallbackQueryHandler(view_my_prompts, pattern="^page_"))
     application.add_handler(CallbackQueryHandler(view_prompt_details, pattern="^view_"))
+    application.add_handler(CallbackQueryHandler(show_similar_prompts, pattern="^similar_"))
     application.add_handler(CallbackQueryHandler(copy_prompt, pattern="^copy_"))
     application.add_handler(CallbackQueryHandler(toggle_favorite, pattern="^fav_"))
     application.add_handler(CallbackQueryHandler(start_edit_prompt, pattern="^edit_"))
@@ -743,17 +906,25 @@ def main():
     application.add_handler(CallbackQueryHandler(confirm_delete, pattern="^confirm_"))
     application.add_handler(CallbackQueryHandler(cancel_delete, pattern="^cancel_"))
     application.add_handler(CallbackQueryHandler(view_favorites, pattern="^favorites$"))
+    application.add_handler(CallbackQueryHandler(view_favorites, pattern="^favpage_"))
+    application.add_handler(CallbackQueryHandler(show_popular_prompts, pattern="^(popular|poppage_.*)$"))
     application.add_handler(CallbackQueryHandler(show_categories_menu, pattern="^categories$"))
     application.add_handler(CallbackQueryHandler(manage_categories, pattern="^catcfg_manage$"))
     application.add_handler(CallbackQueryHandler(start_remove_category, pattern="^catcfg_remove_"))
     application.add_handler(CallbackQueryHandler(apply_remove_category, pattern="^catcfg_remove_confirm_"))
-    application.add_handler(CallbackQueryHandler(filter_by_category, pattern="^cat_"))
+    application.add_handler(CallbackQueryHandler(filter_by_category, pattern="^(cat_|catpage_)"))
     application.add_handler(CallbackQueryHandler(show_tags_menu, pattern="^tags$"))
     application.add_handler(CallbackQueryHandler(manage_tags, pattern="^tags_"))
     application.add_handler(CallbackQueryHandler(remove_tag, pattern="^rmtag_"))
     application.add_handler(CallbackQueryHandler(show_settings, pattern="^settings$"))
-    application.add_handler(CallbackQueryHandler(trash_command, pattern="^trash$"))
+    application.add_handler(CallbackQueryHandler(trash_command, pattern="^(trash|trashpage_.*)$"))
     application.add_handler(CallbackQueryHandler(start_search, pattern="^search$"))
+    application.add_handler(CallbackQueryHandler(show_search_page, pattern="^srchpage_"))
+    application.add_handler(CallbackQueryHandler(search_by_tag, pattern="^srchtag_"))
+    if config.ENABLE_INLINE_MODE:
+        # מצב inline (@bot שאילתה) – דורש /setinline ב-BotFather; הספירה דורשת /setinlinefeedback
+        application.add_handler(InlineQueryHandler(inline_query))
+        application.add_handler(ChosenInlineResultHandler(chosen_inline_result))
 
     # Conversation Handler להוספת תגית
     tags_conv = ConversationHandler(
@@ -762,7 +933,8 @@ def main():
         ],
         states={
             WAITING_FOR_NEW_TAG: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, receive_new_tag)
+                MessageHandler(filters.TEXT & ~filters.COMMAND, receive_new_tag),
+                CallbackQueryHandler(pick_suggested_tag, pattern="^picktag_")
             ]
         },
         fallbacks=[CommandHandler("cancel", cancel_add_tag)]
@@ -0,0 +1,119 @@
+"""
+In-process cache of per-user categories.
+
+Every screen that lists, views or saves prompts needs the user's categories
+(name -> emoji lookup, case-insensitive name resolution). Reading them from
+the `users` collection each time costs a round trip plus a deepcopy, so the
+cache keeps one immutable snapshot per user, bounded by size (LRU) and age
+(TTL).
+
+Writes go through `put()`, which bumps the user's version and stores the new
+list. A load that started before a write carries the old version and is
+discarded by `store()`, so a slow read can never overwrite newer data.
+Versions come from one monotonic counter; when a user's version is evicted
+the floor rises to it, so a forgotten user can never appear unchanged.
+"""
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+
+class CategorySnapshot(NamedTuple):
+    version: int
+    categories: tuple
+    lookup: Dict[str, str]                 # name -> emoji
+    by_key: Dict[str, Dict[str, str]]      # normalized name -> category
+    loaded_at: float
+
+    def as_list(self) -> List[Dict[str, str]]:
+        """Fresh copy that callers may mutate."""
+        return [dict(cat) for cat in self.categories]
+
+
+class CategoryCache:
+    def __init__(self, key_func: Callable[[str], str], max_users: int = 10000,
+                 ttl_seconds: float = 300, clock: Callable[[], float] = time.monotonic):
+        self._key_func = key_func
+        self._max_users = max(1, max_users)
+        self._ttl = ttl_seconds
+        self._clock = clock
+        self._entries: "OrderedDict[int, CategorySnapshot]" = OrderedDict()
+        # Versions outlive evicted entries so an in-flight load can still be rejected
+        self._versions: "OrderedDict[int, int]" = OrderedDict()
+        self._counter = 0
+        self._floor = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int) -> Optional[CategorySnapshot]:
+        entry = self._entries.get(user_id)
+        if entry is None or entry.version != self.version(user_id):
+            self.misses += 1
+            return None
+        if self._ttl and self._clock() - entry.loaded_at > self._ttl:
+            del self._entries[user_id]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        return entry
+
+    def version(self, user_id: int) -> int:
+        """Version to pass to store() after loading from the database."""
+        return self._versions.get(user_id, self._floor)
+
+    def store(self, user_id: int, categories: List[Dict[str, str]],
+              version: int) -> CategorySnapshot:
+        """Cache a loaded list unless a write happened since `version` was read."""
+        snapshot = self._build(categories, version)
+        if version == self.version(user_id):
+            self._remember(user_id, snapshot)
+        return snapshot
+
+    def put(self, user_id: int, categories: List[Dict[str, str]]) -> CategorySnapshot:
+        """Write-through after the database was updated: bump the version and store."""
+        version = self._bump(user_id)
+        snapshot = self._build(categories, version)
+        self._remember(user_id, snapshot)
+        return snapshot
+
+    def invalidate(self, user_id: int) -> None:
+        self._bump(user_id)
+        self._entries.pop(user_id, None)
+
+    def clear(self) -> None:
+        for user_id in list(self._entries):
+            self.invalidate(user_id)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _bump(self, user_id: int) -> int:
+        self._counter += 1
+        self._versions[user_id] = self._counter
+        self._versions.move_to_end(user_id)
+        while len(self._versions) > self._max_users:
+            _, evicted = self._versions.popitem(last=False)
+            self._floor = max(self._floor, evicted)
+        return self._counter
+
+    def _build(self, categories: List[Dict[str, str]], version: int) -> CategorySnapshot:
+        frozen = tuple(dict(cat) for cat in categories)
+        by_key: Dict[str, Dict[str, str]] = {}
+        for cat in frozen:
+            by_key.setdefault(self._key_func(cat.get("name")), cat)
+        return CategorySnapshot(
+            version=version,
+            categories=frozen,
+            lookup={cat.get("name"): cat.get("emoji", "📁") for cat in frozen},
+            by_key=by_key,
+            loaded_at=self._clock(),
+        )
+
+    def _remember(self, user_id: int, snapshot: CategorySnapshot) -> None:
+        self._entries[user_id] = snapshot
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self._max_users:
+            self._entries.popitem(last=False)
@@ -41,6 +41,9 @@ MAX_PROMPT_LENGTH = 4000  # אורך מקסימלי לפרומפט
 PROMPTS_PER_PAGE = 10     # כמה פרומפטים בעמוד
 MAX_TAGS = 10             # מקסימום תגיות לפרומפט
 TRASH_RETENTION_DAYS = 30 # כמה ימים לשמור פרומפטים במחיקה
+MAX_IMPORT_FILE_MB = 20   # מגבלת ההורדה של Bot API
+IMPORT_BATCH_SIZE = 500   # כמה פרומפטים בכל bulk_write בייבוא
+EXPORT_SPOOL_MAX_MB = 8   # מעבר לגודל זה קובץ הייצוא נכתב לדיסק ולא נשמר בזיכרון
 
 # Health-check server (לרנדר)
 ENABLE_HEALTHCHECK_SERVER = os.getenv('ENABLE_HEALTHCHECK_SERVER', 'true').lower() not in {'false', '0', 'no', 'off'}
@@ -79,3 +82,101 @@ LOCK_ACQUIRE_MAX_WAIT = _int_env('LOCK_ACQUIRE_MAX_WAIT', 0)  # 0 = no limit
 # Passive wait backoff window (seconds)
 LOCK_WAIT_MIN_SECONDS = _int_env('LOCK_WAIT_MIN_SECONDS', 15)
 LOCK_WAIT_MAX_SECONDS = _int_env('LOCK_WAIT_MAX_SECONDS', 45)
+
+# Update processing
+# כמה עדכונים (של משתמשים שונים) מעובדים במקביל; 1 = עיבוד סדרתי כמו קודם.
+# עדכונים של אותו משתמש תמיד מעובדים לפי סדר הגעתם.
+MAX_CONCURRENT_UPDATES = max(1, _int_env('MAX_CONCURRENT_UPDATES', 16))
+
+# הגבלת קצב לבקשות יוצאות לטלגרם (rate_limiter.py): דלי אסימונים גלובלי ולכל צ'אט,
+# תשובות אינטראקטיביות לפני עבודת רקע (ייצוא), והמתנה ל-retry_after בהצפה
+ENABLE_RATE_LIMITER = _bool_env('ENABLE_RATE_LIMITER', True)
+TELEGRAM_GLOBAL_PER_SECOND = max(1, _int_env('TELEGRAM_GLOBAL_PER_SECOND', 30))
+TELEGRAM_PRIVATE_PER_SECOND = max(1, _int_env('TELEGRAM_PRIVATE_PER_SECOND', 1))
+TELEGRAM_PRIVATE_BURST = max(1, _int_env('TELEGRAM_PRIVATE_BURST', 3))
+TELEGRAM_GROUP_PER_MINUTE = max(1, _int_env('TELEGRAM_GROUP_PER_MINUTE', 20))
+TELEGRAM_FLOOD_MAX_RETRIES = max(0, _int_env('TELEGRAM_FLOOD_MAX_RETRIES', 2))  # ניסיונות חוזרים אחרי RetryAfter
+
+# מיגרציות רקע (מילוי short_code וכו') – רצות רק במופע שמחזיק את הנעילה
+ENABLE_BACKGROUND_MIGRATIONS = _bool_env('ENABLE_BACKGROUND_MIGRATIONS', True)
+MIGRATION_BATCH_SIZE = max(1, _int_env('MIGRATION_BATCH_SIZE', 500))
+MIGRATION_BATCH_PAUSE_SECONDS = _int_env('MIGRATION_BATCH_PAUSE_MS', 200) / 1000.0
+
+# MongoDB – לקוח משותף (mongo_client.py)
+MONGO_APP_NAME = os.getenv('MONGO_APP_NAME', 'prompttracker-bot')
+MONGO_MAX_POOL_SIZE = max(1, _int_env('MONGO_MAX_POOL_SIZE', 20))
+MONGO_MIN_POOL_SIZE = max(0, _int_env('MONGO_MIN_POOL_SIZE', 2))   # חיבורים שנשמרים פתוחים
+# מאגר הלקוח הסינכרוני (נעילה, מיגרציות, כתיבה מושהית, סקריפטים) – עבודת רקע בלבד, ולכן קטן
+MONGO_SYNC_MAX_POOL_SIZE = max(1, _int_env('MONGO_SYNC_MAX_POOL_SIZE', 5))
+MONGO_MAX_IDLE_TIME_MS = _int_env('MONGO_MAX_IDLE_TIME_MS', 300000)  # 0 = ללא הגבלה
+MONGO_SERVER_SELECTION_TIMEOUT_MS = _int_env('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000)
+MONGO_CONNECT_TIMEOUT_MS = _int_env('MONGO_CONNECT_TIMEOUT_MS', 5000)
+# דחיסת תעבורה לפי סדר עדיפות; מה שלא מותקן (zstandard / python-snappy) מדולג
+MONGO_COMPRESSORS = [
+    name.strip().lower()
+    for name in os.getenv('MONGO_COMPRESSORS', 'zstd,snappy,zlib').split(',')
+    if name.strip()
+]
+MONGO_ZLIB_LEVEL = min(9, max(-1, _int_env('MONGO_ZLIB_LEVEL', 6)))
+
+# כתיבה מושהית של מונים (use_count, stats.*) – bulk_write אחד לכל מחזור במקום כתיבה לכל פעולה
+ENABLE_WRITE_BEHIND = _bool_env('ENABLE_WRITE_BEHIND', True)
+WRITE_BEHIND_FLUSH_SECONDS = max(1, _int_env('WRITE_BEHIND_FLUSH_SECONDS', 5))
+WRITE_BEHIND_MAX_PENDING = max(1, _int_env('WRITE_BEHIND_MAX_PENDING', 1000))  # מסמכים ממתינים לפני flush מיידי
+
+# חיפוש BM25 בזיכרון (search_engine.py) – במקום $text עם המנתח האנגלי
+ENABLE_SEARCH_ENGINE = _bool_env('ENABLE_SEARCH_ENGINE', True)
+SEARCH_INDEX_MAX_POSTINGS = max(1000, _int_env('SEARCH_INDEX_MAX_POSTINGS', 500000))  # תקציב זיכרון לכל האינדקסים
+SEARCH_MAX_CANDIDATES = max(10, _int_env('SEARCH_MAX_CANDIDATES', 200))
+
+# דירוג $text (כשמנוע החיפוש כבוי): textScore + משקל·ln(1+use_count) + משקל·טריות
+SEARCH_USE_COUNT_WEIGHT = max(0, _int_env('SEARCH_USE_COUNT_WEIGHT', 20)) / 100.0
+SEARCH_RECENCY_WEIGHT = max(0, _int_env('SEARCH_RECENCY_WEIGHT', 50)) / 100.0
+SEARCH_RECENCY_HALF_LIFE_DAYS = max(1, _int_env('SEARCH_RECENCY_HALF_LIFE_DAYS', 30))  # גיל שבו בונוס הטריות יורד לחצי
+
+# מטמון תוצאות חיפוש (search_results.py) – רשימת _id מדורגת לכל (משתמש, שאילתה) לדפדוף
+SEARCH_RESULT_CACHE_MAX_ENTRIES = max(1, _int_env('SEARCH_RESULT_CACHE_MAX_ENTRIES', 5000))
+SEARCH_RESULT_CACHE_TTL_SECONDS = _int_env('SEARCH_RESULT_CACHE_TTL_SECONDS', 600)  # 0 = ללא תפוגה
+
+# "פרומפטים דומים" במסך הפרומפט (TF-IDF על אינדקס החיפוש)
+SIMILAR_PROMPTS_LIMIT = min(10, max(1, _int_env('SIMILAR_PROMPTS_LIMIT', 5)))
+
+# חיפוש עמום (fuzzy_match.py) – כשאין התאמה מדויקת, או במפורש עם ~שאילתה
+FUZZY_MIN_SCORE = min(100, max(1, _int_env('FUZZY_MIN_SCORE', 75))) / 100.0  # דמיון מינימלי (0-100)
+FUZZY_MAX_CANDIDATES = max(10, _int_env('FUZZY_MAX_CANDIDATES', 2000))  # אחרי סינון טריגרמות
+FUZZY_INLINE_MAX_CANDIDATES = max(0, _int_env('FUZZY_INLINE_MAX_CANDIDATES', 50))  # עד כמות זו – ניקוד בלולאת האירועים
+FUZZY_POOL_MIN_CANDIDATES = max(1, _int_env('FUZZY_POOL_MIN_CANDIDATES', 500))  # מכמות זו – process pool; ביניהן thread
+FUZZY_POOL_WORKERS = max(1, _int_env('FUZZY_POOL_WORKERS', 2))
+FUZZY_POOL_CHUNK_SIZE = max(50, _int_env('FUZZY_POOL_CHUNK_SIZE', 500))
+
+# מצב inline (@bot שאילתה) – כרטיסי פרומפטים בזיכרון לכל משתמש (inline_index.py)
+ENABLE_INLINE_MODE = _bool_env('ENABLE_INLINE_MODE', True)
+INLINE_INDEX_MAX_PROMPTS = max(100, _int_env('INLINE_INDEX_MAX_PROMPTS', 20000))  # תקציב כרטיסים לכל המשתמשים
+INLINE_MAX_RESULTS = min(50, max(1, _int_env('INLINE_MAX_RESULTS', 20)))  # טלגרם מגביל ל-50
+INLINE_CACHE_SECONDS = max(0, _int_env('INLINE_CACHE_SECONDS', 30))  # cache_time בצד טלגרם (is_personal)
+
+# השלמה אוטומטית של תגיות (tag_trie.py)
+TAG_TRIE_MAX_USERS = max(1, _int_env('TAG_TRIE_MAX_USERS', 10000))
+TAG_SUGGESTIONS = max(1, _int_env('TAG_SUGGESTIONS', 6))  # כפתורי הצעה בהוספת תגית ובחיפוש
+
+# זיהוי כפילויות קרובות בשמירה ובייבוא (near_duplicates.py – MinHash + LSH)
+ENABLE_NEAR_DUPLICATE_CHECK = _bool_env('ENABLE_NEAR_DUPLICATE_CHECK', True)
+NEAR_DUPLICATE_THRESHOLD = min(100, max(1, _int_env('NEAR_DUPLICATE_THRESHOLD', 70))) / 100.0  # דמיון Jaccard משוער (0-100)
+NEAR_DUPLICATE_INDEX_MAX_PROMPTS = max(100, _int_env('NEAR_DUPLICATE_INDEX_MAX_PROMPTS', 50000))  # חתימות לכל המשתמשים
+NEAR_DUPLICATE_SKIP_ON_IMPORT = _bool_env('NEAR_DUPLICATE_SKIP_ON_IMPORT', True)
+
+# מטמון פרומפטים ל-get_prompt (prompt_cache.py): LRU בזיכרון + Redis משותף כש-REDIS_URL מוגדר
+ENABLE_PROMPT_CACHE = _bool_env('ENABLE_PROMPT_CACHE', True)
+PROMPT_CACHE_MAX_ENTRIES = max(1, _int_env('PROMPT_CACHE_MAX_ENTRIES', 5000))
+PROMPT_CACHE_TTL_SECONDS = _int_env('PROMPT_CACHE_TTL_SECONDS', 300)  # 0 = ללא תפוגה
+ENABLE_REDIS_CACHE = _bool_env('ENABLE_REDIS_CACHE', bool(os.getenv('REDIS_URL')))
+PROMPT_CACHE_REDIS_TTL_SECONDS = max(1, _int_env('PROMPT_CACHE_REDIS_TTL_SECONDS', 3600))
+REDIS_RETRY_SECONDS = max(1, _int_env('REDIS_RETRY_SECONDS', 30))  # אחרי שגיאה – דילוג על Redis לזמן זה
+
+# מטמון הודעות פרטי פרומפט מרונדרות (render_cache.py)
+ENABLE_DETAIL_RENDER_CACHE = _bool_env('ENABLE_DETAIL_RENDER_CACHE', True)
+DETAIL_RENDER_CACHE_MAX_ENTRIES = max(1, _int_env('DETAIL_RENDER_CACHE_MAX_ENTRIES', 1000))
+
+# מטמון קטגוריות בזיכרון (לכל משתמש)
+CATEGORY_CACHE_MAX_USERS = max(1, _int_env('CATEGORY_CACHE_MAX_USERS', 10000))
+CATEGORY_CACHE_TTL_SECONDS = _int_env('CATEGORY_CACHE_TTL_SECONDS', 300)  # 0 = ללא תפוגה
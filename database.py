@@ -9,51 +9,73 @@ from copy import deepcopy
 import hashlib
 import re
 import config
+from mongo_client import get_client
+from near_duplicates import SIGNATURE_FIELD
+from pagination import PREV, PageRequest, keyset_filter
 
-class Database:
-    def __init__(self):
-        """אתחול חיבור למסד הנתונים"""
-        self.client = MongoClient(config.MONGO_URI)
-        self.db = self.client[config.MONGO_DB_NAME]
-        
-        # Collections
-        self.prompts = self.db.prompts
-        self.users = self.db.users
-        self.collections = self.db.collections
-        self.stats = self.db.stats
-        
-        # יצירת אינדקסים
-        self._create_indexes()
-        # מילוי קודים קצרים למסמכים קיימים (קריאה קלה, בטוחה)
-        try:
-            self.backfill_short_codes()
-        except Exception:
-            pass
-    
-    def _create_indexes(self):
-        """יצירת אינדקסים לחיפוש מהיר"""
-        # אינדקסים לפרומפטים
-        self.prompts.create_index([("user_id", ASCENDING)])
-        self.prompts.create_index([("category", ASCENDING)])
-        self.prompts.create_index([("tags", ASCENDING)])
-        self.prompts.create_index([("created_at", DESCENDING)])
-        self.prompts.create_index([("title", TEXT), ("content", TEXT)])
-        self.prompts.create_index([("is_deleted", ASCENDING)])
-        # קוד קצר ייחודי לכל משתמש; מתעלם ממסמכים ללא short_code תקין
-        # נוודא הסרת אינדקס קודם אם נוצר עם אפשרויות שונות
-        try:
-            self.prompts.drop_index("uniq_short_code_per_user")
-        except Exception:
-            pass
-        self.prompts.create_index(
-            [("user_id", ASCENDING), ("short_code", ASCENDING)],
-            unique=True,
-            name="uniq_short_code_per_user",
-            partialFilterExpression={"short_code": {"$type": "string"}}
-        )
-        
-        # אינדקס ייחודי למשתמשים
-        self.users.create_index([("user_id", ASCENDING)], unique=True)
+# אינדקסים מורכבים לפי צורות השאילתות בפועל: שוויון (user_id, is_deleted ...) ואחריו
+# שדה המיון עם _id כשובר שוויון, כך שהמיון נשען על האינדקס ולא מתבצע בזיכרון.
+PROMPT_INDEXES = [
+    # get_all_prompts, search_prompts, count_prompts, סטטיסטיקות
+    ("user_active_created", [("user_id", ASCENDING), ("is_deleted", ASCENDING),
+                             ("created_at", DESCENDING), ("_id", DESCENDING)]),
+    # get_popular_prompts
+    ("user_active_popular", [("user_id", ASCENDING), ("is_deleted", ASCENDING),
+                             ("use_count", DESCENDING), ("_id", DESCENDING)]),
+    # get_favorites, ספירת מועדפים
+    ("user_favorites_popular", [("user_id", ASCENDING), ("is_favorite", ASCENDING),
+                                ("is_deleted", ASCENDING), ("use_count", DESCENDING),
+                                ("_id", DESCENDING)]),
+    # get_trash
+    ("user_trash_deleted", [("user_id", ASCENDING), ("is_deleted", ASCENDING),
+                            ("deleted_at", DESCENDING), ("_id", DESCENDING)]),
+    # סינון לפי קטגוריה + update_user_category / delete_user_category
+    ("user_category_created", [("user_id", ASCENDING), ("category", ASCENDING),
+                               ("is_deleted", ASCENDING), ("created_at", DESCENDING),
+                               ("_id", DESCENDING)]),
+    # סינון לפי תגיות (multikey)
+    ("user_tags_created", [("user_id", ASCENDING), ("tags", ASCENDING),
+                           ("is_deleted", ASCENDING), ("created_at", DESCENDING),
+                           ("_id", DESCENDING)]),
+    # cleanup_old_trash (גלובלי, ללא user_id)
+    ("trash_retention", [("is_deleted", ASCENDING), ("deleted_at", ASCENDING)]),
+]
+
+# אינדקס טקסט עם קידומת user_id: כל שאילתת $text כבר מסננת לפי משתמש
+TEXT_INDEX_NAME = "user_text"
+TEXT_INDEX_KEYS = [("user_id", ASCENDING), ("title", TEXT), ("content", TEXT)]
+
+
+class DatabaseBase:
+    """לוגיקה משותפת (ללא גישה למסד) ל-Database הסינכרוני ול-AsyncDatabase."""
+
+    # סדרי מיון יציבים (תואמים ל-PROMPT_INDEXES)
+    SORT_NEWEST = [("created_at", DESCENDING), ("_id", DESCENDING)]
+    SORT_POPULAR = [("use_count", DESCENDING), ("_id", DESCENDING)]
+    SORT_RECENTLY_DELETED = [("deleted_at", DESCENDING), ("_id", DESCENDING)]
+
+    # השדות שרשימת תוצאות החיפוש מציגה (use_count – בשביל ה-overlay של מונים ממתינים)
+    SEARCH_RESULT_PROJECTION = {"title": 1, "category": 1, "is_favorite": 1,
+                                "short_code": 1, "use_count": 1}
+
+    # תצוגות רשימה עם דפדוף keyset: שם -> (שדה מיון, פילטר בסיס מעבר ל-user_id)
+    PAGE_VIEWS = {
+        "all": ("created_at", {"is_deleted": False}),
+        "favorites": ("use_count", {"is_favorite": True, "is_deleted": False}),
+        "trash": ("deleted_at", {"is_deleted": True}),
+        "category": ("created_at", {"is_deleted": False}),
+        "popular": ("use_count", {"is_deleted": False}),
+    }
+
+    # השדות שכל תצוגת רשימה מציגה (models.PromptSummary) – בלי content; כולל את שדה המיון בשביל הסמן
+    _LIST_FIELDS = {"title": 1, "category": 1, "short_code": 1, "is_favorite": 1, "use_count": 1}
+    LIST_VIEW_PROJECTIONS = {
+        "all": {**_LIST_FIELDS, "tags": 1, "created_at": 1},
+        "favorites": _LIST_FIELDS,
+        "trash": {**_LIST_FIELDS, "deleted_at": 1},
+        "category": {**_LIST_FIELDS, "created_at": 1},
+        "popular": _LIST_FIELDS,
+    }
 
     # ====== קטגוריות ברירת מחדל ומסייעים פנימיים ======
 
@@ -76,7 +98,7 @@ class Database:
 
     @staticmethod
     def _category_name_key(name: str) -> str:
-        return Database._normalize_category_name(name).lower()
+        return DatabaseBase._normalize_category_name(name).lower()
 
     def _fallback_category(self, categories: List[Dict[str, str]], removed: Optional[str] = None) -> Optional[str]:
         """בחירת קטגוריית fallback כאשר קטגוריה מוסרת."""
@@ -92,144 +114,27 @@ class Database:
             if self._category_name_key(cat.get("name")) != removed_key:
                 return cat.get("name")
         return None
-    
-    # ========== פעולות משתמשים ==========
-    
-    def get_or_create_user(self, user_id: int, username: str = None, 
-                          first_name: str = None) -> Dict:
-        """קבלת או יצירת משתמש"""
-        user = self.users.find_one({"user_id": user_id})
-        
-        if not user:
-            user = {
-                "user_id": user_id,
-                "username": username,
-                "first_name": first_name,
-                "created_at": datetime.utcnow(),
-                "settings": {
-                    "show_ids": False,
-                    "short_titles": True,
-                    "show_tags": True,
-                    "copy_confirmation": True,
-                    "theme": "dark"
-                },
-                "stats": {
-                    "total_prompts": 0,
-                    "total_uses": 0,
-                    "total_collections": 0
-                },
-                "categories": self._default_categories()
-            }
-            self.users.insert_one(user)
-        elif not user.get("categories"):
-            categories = self._default_categories()
-            self.users.update_one(
-                {"user_id": user_id},
-                {"$set": {"categories": categories}}
-            )
-            user["categories"] = categories
-        
-        return user
-
-    def find_user_by_identifier(self, identifier: Optional[str]) -> Optional[Dict]:
-        """איתור משתמש לפי user_id או שם משתמש (עם או בלי @)."""
-        if identifier is None:
-            return None
-        value = str(identifier).strip()
-        if not value:
-            return None
-
-        # ניסיון לפי מזהה מספרי
-        if value.isdigit():
-            try:
-                user_id = int(value)
-            except ValueError:
-                user_id = None
-            if user_id is not None:
-                user = self.users.find_one({"user_id": user_id})
-                if user:
-                    return user
-
-        # ניסיון לפי שם משתמש
-        username = value[1:] if value.startswith("@") else value
-        if not username:
-            return None
-        try:
-            regex = rf"^{re.escape(username)}$"
-        except re.error:
-            return None
-        return self.users.find_one({"username": {"$regex": regex, "$options": "i"}})
-    
-    def update_user_stats(self, user_id: int, stat_name: str, increment: int = 1):
-        """עדכון סטטיסטיקות משתמש"""
-        self.users.update_one(
-            {"user_id": user_id},
-            {"$inc": {f"stats.{stat_name}": increment}}
-        )
-    
-    # ========== קטגוריות משתמש ==========
-
-    def get_user_categories(self, user_id: int) -> List[Dict[str, str]]:
-        """החזרת רשימת הקטגוריות של משתמש (יוזנו ברירות מחדל אם חסרות)."""
-        user = self.users.find_one({"user_id": user_id}, {"categories": 1})
-        categories = (user or {}).get("categories")
-        if not categories:
-            categories = self._default_categories()
-            self.users.update_one(
-                {"user_id": user_id},
-                {"$set": {"categories": categories}},
-                upsert=True
-            )
-        return deepcopy(categories)
-
-    def get_category_lookup(self, user_id: int) -> Dict[str, str]:
-        """מילון מהיר של שם קטגוריה -> אימוג׳י."""
-        return {
-            cat.get("name"): cat.get("emoji", "📁")
-            for cat in self.get_user_categories(user_id)
-        }
-
-    def get_category(self, user_id: int, name: str) -> Optional[Dict[str, str]]:
-        """החזרת אובייקט קטגוריה לפי שם (case-insensitive)."""
-        categories = self.get_user_categories(user_id)
-        normalized = self._category_name_key(name or "")
-        for cat in categories:
-            if self._category_name_key(cat.get("name")) == normalized:
-                return cat
-        return None
-
-    def ensure_category_name(self, user_id: int, category: Optional[str]) -> str:
-        """ודאות שהקטגוריה קיימת; אם לא – חזרה לברירת מחדל."""
-        categories = self.get_user_categories(user_id)
-        normalized = self._category_name_key(category or "")
-        for cat in categories:
-            if self._category_name_key(cat.get("name")) == normalized:
-                return cat.get("name")
-        fallback = self._fallback_category(categories)
-        return fallback or "Other"
 
-    def add_user_category(self, user_id: int, name: str, emoji: str = "📁") -> bool:
+    def _plan_add_category(self, categories: List[Dict[str, str]], name: str,
+                           emoji: str) -> List[Dict[str, str]]:
+        """אימות והחזרת רשימת הקטגוריות לאחר הוספה (מחריג ValueError)."""
         name = self._normalize_category_name(name)
         if len(name) < 2 or len(name) > 40:
             raise ValueError("שם הקטגוריה חייב להיות בין 2 ל-40 תווים.")
         emoji = self._normalize_category_emoji(emoji)
-        categories = self.get_user_categories(user_id)
         key = self._category_name_key(name)
         if any(self._category_name_key(cat.get("name")) == key for cat in categories):
             raise ValueError("קטגוריה בשם זה כבר קיימת.")
         categories.append({"emoji": emoji, "name": name})
-        self.users.update_one(
-            {"user_id": user_id},
-            {"$set": {"categories": categories}}
-        )
-        return True
+        return categories
 
-    def update_user_category(self, user_id: int, old_name: str, new_name: str, emoji: str) -> bool:
+    def _plan_update_category(self, categories: List[Dict[str, str]], old_name: str,
+                              new_name: str, emoji: str):
+        """אימות עדכון קטגוריה; מחזיר (קטגוריות, שם קודם לשינוי שם או None, שם חדש)."""
         new_name = self._normalize_category_name(new_name)
         if len(new_name) < 2 or len(new_name) > 40:
             raise ValueError("שם הקטגוריה חייב להיות בין 2 ל-40 תווים.")
         emoji = self._normalize_category_emoji(emoji)
-        categories = self.get_user_categories(user_id)
         old_key = self._category_name_key(old_name)
         target = None
         stored_old_name = None
@@ -245,19 +150,11 @@ class Database:
             raise ValueError("קטגוריה בשם זה כבר קיימת.")
         target["name"] = new_name
         target["emoji"] = emoji
-        self.users.update_one(
-            {"user_id": user_id},
-            {"$set": {"categories": categories}}
-        )
-        if new_key != old_key and stored_old_name:
-            self.prompts.update_many(
-                {"user_id": user_id, "category": stored_old_name},
-                {"$set": {"category": new_name}}
-            )
-        return True
+        renamed_from = stored_old_name if new_key != old_key and stored_old_name else None
+        return categories, renamed_from, new_name
 
-    def delete_user_category(self, user_id: int, name: str) -> str:
-        categories = self.get_user_categories(user_id)
+    def _plan_delete_category(self, categories: List[Dict[str, str]], name: str):
+        """אימות מחיקת קטגוריה; מחזיר (קטגוריות שנותרו, שם הקטגוריה שהוסרה, fallback)."""
         if len(categories) <= 1:
             raise ValueError("יש להשאיר לפחות קטגוריה אחת.")
         key = self._category_name_key(name)
@@ -273,23 +170,58 @@ class Database:
         fallback = self._fallback_category(filtered, removed=target_name)
         if not fallback:
             raise ValueError("אין קטגוריית fallback זמינה.")
-        # עדכון פרומפטים לקטגוריית fallback
-        self.prompts.update_many(
-            {"user_id": user_id, "category": target_name},
-            {"$set": {"category": fallback}}
-        )
-        self.users.update_one(
-            {"user_id": user_id},
-            {"$set": {"categories": filtered}}
-        )
-        return fallback
+        return filtered, target_name, fallback
 
-    # ========== פעולות פרומפטים ==========
-    
-    def save_prompt(self, user_id: int, content: str, title: str = None,
-                   category: str = "Other", tags: List[str] = None) -> Dict:
-        """שמירת פרומפט חדש"""
-        category = self.ensure_category_name(user_id, category)
+    @staticmethod
+    def _category_lookup_from(categories: List[Dict[str, str]]) -> Dict[str, str]:
+        return {cat.get("name"): cat.get("emoji", "📁") for cat in categories}
+
+    def _match_category(self, categories: List[Dict[str, str]], name: Optional[str]) -> Optional[Dict[str, str]]:
+        normalized = self._category_name_key(name or "")
+        for cat in categories:
+            if self._category_name_key(cat.get("name")) == normalized:
+                return cat
+        return None
+
+    def _resolve_category_name(self, categories: List[Dict[str, str]], category: Optional[str]) -> str:
+        cat = self._match_category(categories, category)
+        if cat:
+            return cat.get("name")
+        fallback = self._fallback_category(categories)
+        return fallback or "Other"
+
+    def _new_user_document(self, user_id: int, username: str = None,
+                           first_name: str = None) -> Dict:
+        """מסמך משתמש חדש עם הגדרות, סטטיסטיקות וקטגוריות ברירת מחדל."""
+        return {
+            "user_id": user_id,
+            "username": username,
+            "first_name": first_name,
+            "created_at": datetime.utcnow(),
+            "settings": {
+                "show_ids": False,
+                "short_titles": True,
+                "show_tags": True,
+                "copy_confirmation": True,
+                "theme": "dark"
+            },
+            "stats": {
+                "total_prompts": 0,
+                "total_uses": 0,
+                "total_collections": 0
+            },
+            "categories": self._default_categories()
+        }
+
+    @staticmethod
+    def _new_prompt_document(user_id: int, content: str, title: str = None,
+                             category: str = "Other", tags: List[str] = None,
+                             content_signature: Optional[bytes] = None) -> Dict:
+        """מסמך פרומפט חדש (ללא _id וללא short_code).
+
+        החתימה (MinHash) מחושבת מראש על ידי הקורא – מחוץ ל-event loop – ונשמרת רק כשיש כזו;
+        לפרומפטים ישנים בלי חתימה ממלאת אותה מיגרציית הרקע SignatureBackfill.
+        """
         prompt = {
             "user_id": user_id,
             "content": content,
@@ -301,195 +233,469 @@ class Database:
             "created_at": datetime.utcnow(),
             "updated_at": datetime.utcnow(),
             "use_count": 0,
-            "length": len(content)
+            "length": len(content),
         }
-        
-        result = self.prompts.insert_one(prompt)
-        prompt['_id'] = result.inserted_id
-        
-        # קוד קצר דטרמיניסטי על בסיס ה-ID, עם טיפול בהתנגשויות
-        try:
-            short_code = self._ensure_short_code_for(str(prompt['_id']), user_id)
-            if short_code:
-                prompt['short_code'] = short_code
-        except Exception:
-            # לא נכשיל שמירה בגלל קוד קצר
-            pass
-        
-        # עדכון סטטיסטיקות
-        self.update_user_stats(user_id, "total_prompts")
-        
+        if content_signature is not None:
+            prompt[SIGNATURE_FIELD] = content_signature
         return prompt
-    
-    def get_prompt(self, prompt_id: str, user_id: int) -> Optional[Dict]:
-        """קבלת פרומפט לפי מזהה או קוד קצר (דטרמיניסטי)."""
-        from bson import ObjectId
-        # ניסיון לפי ObjectId
-        if isinstance(prompt_id, str) and re.fullmatch(r"[0-9a-fA-F]{24}", prompt_id or ""):
+
+    @staticmethod
+    def _username_regex(identifier: Optional[str]):
+        """פירוק מזהה משתמש ל-(user_id, regex לשם משתמש); None כאשר אין ערך."""
+        if identifier is None:
+            return None, None
+        value = str(identifier).strip()
+        if not value:
+            return None, None
+        user_id = None
+        if value.isdigit():
             try:
-                return self.prompts.find_one({
-                    "_id": ObjectId(prompt_id),
-                    "user_id": user_id,
-                    "is_deleted": False
-                })
-            except Exception:
-                pass
-        # ניסיון לפי short_code (4-8 תווים הקסה, לא תלוי רישיות)
-        code = (prompt_id or "").strip().upper()
-        if re.fullmatch(r"[0-9A-F]{4,8}", code):
-            return self.prompts.find_one({
-                "short_code": code,
-                "user_id": user_id,
-                "is_deleted": False
-            })
-        return None
+                user_id = int(value)
+            except ValueError:
+                user_id = None
+        username = value[1:] if value.startswith("@") else value
+        if not username:
+            return user_id, None
+        try:
+            regex = rf"^{re.escape(username)}$"
+        except re.error:
+            return user_id, None
+        return user_id, regex
+
+    @staticmethod
+    def _trash_threshold() -> datetime:
+        return datetime.utcnow() - timedelta(days=config.TRASH_RETENTION_DAYS)
 
     # ====== קוד קצר ======
     def _generate_short_code(self, prompt_id: str, length: int = 4) -> str:
         digest = hashlib.md5(str(prompt_id).encode()).hexdigest().upper()
         return digest[:max(4, min(length, 12))]
 
-    def _ensure_short_code_for(self, prompt_id: str, user_id: int) -> Optional[str]:
-        """מקצה שדה short_code למסמך לפי prompt_id, עם טיפול בהתנגשויות.
-        מחזיר את הקוד שהוקצה או None אם נכשל בלי להחריג.
-        """
-        # ננסה להאריך עד 8 תווים במקרה התנגשות (נדיר מאוד)
-        for length in range(4, 9):
-            code = self._generate_short_code(prompt_id, length)
-            try:
-                # בדיקת קיום
-                existing = self.prompts.find_one({"user_id": user_id, "short_code": code})
-                if existing and str(existing.get("_id")) != str(prompt_id):
-                    continue  # התנגשות, ננסה אורך ארוך יותר
-                # עדכון השדה במסמך הנוכחי
-                from bson import ObjectId
-                self.prompts.update_one(
-                    {"_id": ObjectId(prompt_id), "user_id": user_id},
-                    {"$set": {"short_code": code}}
-                )
-                return code
-            except DuplicateKeyError:
-                continue
-            except Exception:
-                # לא נעצור את הזרימה
-                break
-        return None
+    # אורכי הקוד הקצר לניסיון: מתחילים ב-4 ומאריכים רק בהתנגשות (נדיר מאוד)
+    SHORT_CODE_LENGTHS = range(4, 9)
+    SHORT_CODE_INDEX = "uniq_short_code_per_user"
 
-    def backfill_short_codes(self):
-        """מילוי לאחור של short_code למסמכים חסרי שדה זה או עם ערך לא תקין."""
-        cursor = self.prompts.find({
-            "$or": [
-                {"short_code": {"$exists": False}},
-                {"short_code": None},
-                {"short_code": ""}
-            ]
-        })
-        for doc in cursor:
-            user_id = doc.get("user_id")
-            _id = str(doc.get("_id"))
-            try:
-                self._ensure_short_code_for(_id, user_id)
-            except Exception:
-                continue
-    
-    def update_prompt(self, prompt_id: str, user_id: int, 
-                     update_data: Dict) -> bool:
-        """עדכון פרומפט"""
+    def _short_code_attempts(self, prompt: Dict):
+        """מקצה _id בצד הלקוח ומחזיר גרסאות של המסמך לפי סדר הניסיון:
+        קוד קצר באורך 4..8 ולבסוף בלי קוד (לא נכשיל שמירה בגלל קוד קצר)."""
         from bson import ObjectId
-        try:
-            update_data['updated_at'] = datetime.utcnow()
-            result = self.prompts.update_one(
-                {"_id": ObjectId(prompt_id), "user_id": user_id},
-                {"$set": update_data}
-            )
-            return result.modified_count > 0
-        except:
-            return False
-    
-    def delete_prompt(self, prompt_id: str, user_id: int, 
-                     permanent: bool = False) -> bool:
-        """מחיקת פרומפט (רכה או קשה)"""
-        from bson import ObjectId
-        try:
-            if permanent:
-                result = self.prompts.delete_one({
-                    "_id": ObjectId(prompt_id),
-                    "user_id": user_id
-                })
-            else:
-                result = self.prompts.update_one(
-                    {"_id": ObjectId(prompt_id), "user_id": user_id},
-                    {"$set": {
-                        "is_deleted": True,
-                        "deleted_at": datetime.utcnow()
-                    }}
-                )
-            
-            if result.modified_count > 0 or result.deleted_count > 0:
-                self.update_user_stats(user_id, "total_prompts", -1)
-                return True
-            return False
-        except:
-            return False
-    
-    def restore_prompt(self, prompt_id: str, user_id: int) -> bool:
-        """שחזור פרומפט מהאשפה"""
-        from bson import ObjectId
-        try:
-            result = self.prompts.update_one(
-                {"_id": ObjectId(prompt_id), "user_id": user_id},
-                {"$set": {"is_deleted": False}, "$unset": {"deleted_at": ""}}
-            )
-            if result.modified_count > 0:
-                self.update_user_stats(user_id, "total_prompts", 1)
-                return True
-            return False
-        except:
-            return False
-    
-    def increment_use_count(self, prompt_id: str, user_id: int):
-        """הגדלת מונה שימושים"""
+        prompt.setdefault("_id", ObjectId())
+        for length in self.SHORT_CODE_LENGTHS:
+            yield {**prompt, "short_code": self._generate_short_code(str(prompt["_id"]), length)}
+        yield {key: value for key, value in prompt.items() if key != "short_code"}
+
+    @classmethod
+    def _is_short_code_collision(cls, exc: DuplicateKeyError) -> bool:
+        details = exc.details or {}
+        if "short_code" in (details.get("keyPattern") or {}):
+            return True
+        return cls.SHORT_CODE_INDEX in str(details.get("errmsg") or exc)
+
+    @staticmethod
+    def _prompt_lookup_filter(prompt_id: str, user_id: int) -> Optional[Dict]:
+        """פילטר איתור פרומפט פעיל לפי ObjectId או short_code; None אם המזהה לא תקין."""
         from bson import ObjectId
-        try:
-            self.prompts.update_one(
-                {"_id": ObjectId(prompt_id), "user_id": user_id},
-                {"$inc": {"use_count": 1}}
-            )
-            self.update_user_stats(user_id, "total_uses")
-        except:
-            pass
-    
-    # ========== חיפוש וסינון ==========
-    
-    def search_prompts(self, user_id: int, query: str = None, 
-                      category: str = None, tags: List[str] = None,
-                      favorites_only: bool = False, 
-                      skip: int = 0, limit: int = 10) -> List[Dict]:
-        """חיפוש פרומפטים עם סינון"""
+        if isinstance(prompt_id, str) and re.fullmatch(r"[0-9a-fA-F]{24}", prompt_id or ""):
+            return {
+                "_id": ObjectId(prompt_id),
+                "user_id": user_id,
+                "is_deleted": False
+            }
+        code = (prompt_id or "").strip().upper()
+        if re.fullmatch(r"[0-9A-F]{4,8}", code):
+            return {
+                "short_code": code,
+                "user_id": user_id,
+                "is_deleted": False
+            }
+        return None
+
+    @staticmethod
+    def _search_filter(user_id: int, query: str = None, category: str = None,
+                       tags: List[str] = None, favorites_only: bool = False) -> Dict:
         filter_query = {
             "user_id": user_id,
             "is_deleted": False
         }
-        
         # חיפוש טקסט
         if query:
             filter_query["$text"] = {"$search": query}
-        
         # סינון לפי קטגוריה
         if category:
             filter_query["category"] = category
-        
         # סינון לפי תגיות
         if tags:
             filter_query["tags"] = {"$in": tags}
-        
         # מועדפים בלבד
         if favorites_only:
             filter_query["is_favorite"] = True
+        return filter_query
+
+    @staticmethod
+    def _text_rank_pipeline(filter_query: Dict, projection: Dict,
+                            skip: int = 0, limit: int = None) -> List[Dict]:
+        """aggregation לשאילתת $text: textScore משוקלל עם use_count וטריות, מהטוב לגרוע."""
+        now = datetime.utcnow()
+        half_life = config.SEARCH_RECENCY_HALF_LIFE_DAYS
+        age_days = {"$max": [0, {"$divide": [
+            {"$subtract": [now, {"$ifNull": ["$created_at", now]}]}, 86400000
+        ]}]}
+        rank = {"$add": [
+            {"$meta": "textScore"},
+            {"$multiply": [config.SEARCH_USE_COUNT_WEIGHT,
+                           {"$ln": {"$add": [1, {"$max": [0, {"$ifNull": ["$use_count", 0]}]}]}}]},
+            {"$multiply": [config.SEARCH_RECENCY_WEIGHT,
+                           {"$divide": [half_life, {"$add": [half_life, age_days]}]}]},
+        ]}
+        pipeline = [
+            {"$match": filter_query},
+            {"$addFields": {"_rank": rank}},
+            {"$sort": {"_rank": -1, "_id": -1}},
+        ]
+        if skip:
+            pipeline.append({"$skip": skip})
+        if limit:
+            pipeline.append({"$limit": limit})
+        pipeline.append({"$project": projection})
+        return pipeline
+
+    def _page_view_filter(self, user_id: int, view: str, category: str = None) -> Dict:
+        """פילטר הבסיס של תצוגת רשימה (ללא תנאי הסמן), משמש גם לספירה."""
+        _, base = self.PAGE_VIEWS[view]
+        filter_query = {"user_id": user_id, **base}
+        if view == "category":
+            filter_query["category"] = category
+        return filter_query
+
+    def _page_query(self, user_id: int, view: str, request: PageRequest,
+                    category: str = None):
+        """החזרת (פילטר, מיון, שדה מיון) לשליפת עמוד keyset."""
+        field, _ = self.PAGE_VIEWS[view]
+        filter_query = self._page_view_filter(user_id, view, category)
+        if request.cursor is not None:
+            filter_query = {"$and": [filter_query, keyset_filter(field, request.cursor, request.direction)]}
+        order = ASCENDING if request.direction == PREV else DESCENDING
+        return filter_query, [(field, order), ("_id", order)], field
+
+    # ====== מסמך סיכום למשתמש (אוסף stats) ======
+    # מונים שנשמרים בהדרגה בכל כתיבה, כך שמסכי קטגוריות/תגיות/סטטיסטיקה
+    # קוראים מסמך אחד לפי _id במקום לספור את כל הספרייה.
+
+    @staticmethod
+    def _summary_key(name: str) -> str:
+        """קידוד שם קטגוריה/תגית כשם שדה חוקי ב-MongoDB (ללא '.' ו-'$')."""
+        return (name.replace("%", "%25")
+                    .replace(".", "%2E")
+                    .replace("$", "%24"))
+
+    @staticmethod
+    def _summary_name(key: str) -> str:
+        return (key.replace("%24", "$")
+                   .replace("%2E", ".")
+                   .replace("%25", "%"))
+
+    @classmethod
+    def _summary_contribution(cls, prompt: Optional[Dict]) -> Dict[str, int]:
+        """תרומת פרומפט בודד למוני הסיכום (פרומפט באשפה נספר רק ב-trash)."""
+        if not prompt:
+            return {}
+        if prompt.get("is_deleted"):
+            return {"trash": 1}
+        contribution = {"active": 1}
+        if prompt.get("is_favorite"):
+            contribution["favorites"] = 1
+        if prompt.get("category"):
+            contribution[f"categories.{cls._summary_key(prompt['category'])}"] = 1
+        for tag in set(prompt.get("tags") or []):
+            if tag:
+                contribution[f"tags.{cls._summary_key(tag)}"] = 1
+        return contribution
+
+    @classmethod
+    def _summary_delta(cls, before: Optional[Dict], after: Optional[Dict]) -> Dict[str, int]:
+        """ההפרש במונים בין מצב הפרומפט לפני ואחרי הכתיבה (ללא אפסים)."""
+        delta = dict(cls._summary_contribution(after))
+        for field, count in cls._summary_contribution(before).items():
+            delta[field] = delta.get(field, 0) - count
+        return {field: count for field, count in delta.items() if count}
+
+    @staticmethod
+    def _summary_rebuild_pipeline(user_id: int) -> List[Dict]:
+        """חישוב מלא של מסמך הסיכום מתוך prompts (לבנייה ראשונית ולתיקון סטיות)."""
+        active = {"is_deleted": False}
+        return [
+            {"$match": {"user_id": user_id}},
+            {"$facet": {
+                "totals": [{"$group": {
+                    "_id": None,
+                    "active": {"$sum": {"$cond": ["$is_deleted", 0, 1]}},
+                    "favorites": {"$sum": {"$cond": [
+                        {"$and": [{"$not": ["$is_deleted"]}, "$is_favorite"]}, 1, 0
+                    ]}},
+                    "trash": {"$sum": {"$cond": ["$is_deleted", 1, 0]}},
+                }}],
+                "categories": [
+                    {"$match": active},
+                    {"$group": {"_id": "$category", "count": {"$sum": 1}}},
+                ],
+                "tags": [
+                    {"$match": active},
+                    {"$unwind": "$tags"},
+                    {"$group": {"_id": "$tags", "count": {"$sum": 1}}},
+                ],
+            }},
+        ]
+
+    @classmethod
+    def _summary_from_facets(cls, user_id: int, facets: Dict) -> Dict:
+        totals = (facets.get("totals") or [{}])[0]
+        return {
+            "_id": user_id,
+            "active": totals.get("active", 0),
+            "favorites": totals.get("favorites", 0),
+            "trash": totals.get("trash", 0),
+            "categories": {cls._summary_key(item["_id"]): item["count"]
+                           for item in facets.get("categories", []) if item.get("_id")},
+            "tags": {cls._summary_key(item["_id"]): item["count"]
+                     for item in facets.get("tags", []) if item.get("_id")},
+            "rebuilt_at": datetime.utcnow(),
+        }
+
+    @classmethod
+    def _summary_counts(cls, summary: Optional[Dict], field: str) -> List[Dict[str, Any]]:
+        """מוני קטגוריות/תגיות מפוענחים, ממוינים מהגדול לקטן (ללא אפסים)."""
+        counts = [
+            {"_id": cls._summary_name(key), "count": count}
+            for key, count in ((summary or {}).get(field) or {}).items()
+            if count > 0
+        ]
+        counts.sort(key=lambda item: (-item["count"], item["_id"]))
+        return counts
+
+    @classmethod
+    def _summary_view_count(cls, summary: Dict, view: str, category: str = None) -> int:
+        """מספר המסמכים בתצוגת רשימה לפי מסמך הסיכום."""
+        if view == "category":
+            return (summary.get("categories") or {}).get(cls._summary_key(category or ""), 0)
+        field = {"all": "active", "popular": "active",
+                 "favorites": "favorites", "trash": "trash"}[view]
+        return summary.get(field, 0)
+
+    @staticmethod
+    def _list_screen_pipeline(user_id: int, filter_query: Dict, sort: List, limit: int,
+                              projection: Dict, include_user: bool) -> List[Dict]:
+        """צינור על מסד הנתונים כולו: מסמך זרע אחד ($documents) ואליו $lookup לא-מתואמים
+        לעמוד, למסמך הסיכום ולקטגוריות. כל תת-צינור מתוכנן בנפרד ומשתמש באינדקס שלו,
+        בניגוד ל-$facet שענפיו אינם משתמשים באינדקסים."""
+        pipeline = [
+            {"$documents": [{}]},
+            {"$lookup": {
+                "from": "prompts",
+                "pipeline": [
+                    {"$match": filter_query},
+                    {"$sort": dict(sort)},
+                    {"$limit": limit},
+                    {"$project": projection},
+                ],
+                "as": "items",
+            }},
+            {"$lookup": {
+                "from": "stats",
+                "pipeline": [{"$match": {"_id": user_id}}],
+                "as": "summary",
+            }},
+        ]
+        if include_user:
+            pipeline.append({"$lookup": {
+                "from": "users",
+                "pipeline": [
+                    {"$match": {"user_id": user_id}},
+                    {"$project": {"_id": 0, "categories": 1}},
+                ],
+                "as": "user",
+            }})
+        return pipeline
+
+    @classmethod
+    def _summary_drift(cls, stored: Optional[Dict], fresh: Dict) -> Dict[str, Any]:
+        """השוואת מסמך שמור לחישוב מלא; מחזיר {שדה: (שמור, מחושב)} עבור הפרשים.
+        קטגוריות ותגיות מופיעות בשמן המקורי (categories.<שם>) – לתצוגה, לא כנתיב שדה."""
+        stored = stored or {}
+        drift = {}
+        for field in ("active", "favorites", "trash"):
+            if stored.get(field, 0) != fresh[field]:
+                drift[field] = (stored.get(field, 0), fresh[field])
+        for field in ("categories", "tags"):
+            have = {k: v for k, v in (stored.get(field) or {}).items() if v}
+            for key in set(have) | set(fresh[field]):
+                if have.get(key, 0) != fresh[field].get(key, 0):
+                    drift[f"{field}.{cls._summary_name(key)}"] = (have.get(key, 0), fresh[field].get(key, 0))
+        return drift
+
+    @staticmethod
+    def _user_stats_pipelines(user_id: int):
+        """צינורות אגרגציה לקטגוריות ולתגיות הפופולריות."""
+        category_pipeline = [
+            {"$match": {"user_id": user_id, "is_deleted": False}},
+            {"$group": {"_id": "$category", "count": {"$sum": 1}}},
+            {"$sort": {"count": -1}},
+            {"$limit": 5}
+        ]
+        tag_pipeline = [
+            {"$match": {"user_id": user_id, "is_deleted": False}},
+            {"$unwind": "$tags"},
+            {"$group": {"_id": "$tags", "count": {"$sum": 1}}},
+            {"$sort": {"count": -1}},
+            {"$limit": 5}
+        ]
+        return category_pipeline, tag_pipeline
+
+    @staticmethod
+    def _admin_user_action(doc: Dict) -> Dict[str, Any]:
+        stats = doc.get("stats") or {}
+        total_prompts = int(stats.get("total_prompts") or 0)
+        total_uses = int(stats.get("total_uses") or 0)
+        action_count = total_prompts + total_uses
+        return {
+            "user_id": doc.get("user_id"),
+            "username": doc.get("username"),
+            "first_name": doc.get("first_name"),
+            "total_prompts": total_prompts,
+            "total_uses": total_uses,
+            "action_count": action_count
+        }
+
+
+class Database(DatabaseBase):
+    """גישה סינכרונית (pymongo) – אחראית על אינדקסים ותחזוקה.
+
+    המטפלים בבוט עובדים מול AsyncDatabase (async_database.py) כדי לא לחסום את ה-event loop.
+    כתיבות לפרומפטים ולקטגוריות קיימות רק שם, כך שמסמך הסיכום לכל משתמש מתעדכן בכל כתיבה.
+    """
+
+    def __init__(self, uri: Optional[str] = None):
+        """אין חיבור ביצירת האובייקט – הלקוח המשותף נוצר בגישה הראשונה (mongo_client.py).
+
+        אינדקסים ומילוי short_code מנוהלים כמיגרציות עם גרסה – ראו migrations.py
+        """
+        self._uri = uri
+
+    @property
+    def client(self) -> MongoClient:
+        return get_client(self._uri)
+
+    @property
+    def db(self):
+        return self.client[config.MONGO_DB_NAME]
+
+    # Collections
+    @property
+    def prompts(self):
+        return self.db.prompts
+
+    @property
+    def users(self):
+        return self.db.users
+
+    @property
+    def collections(self):
+        return self.db.collections
+
+    @property
+    def stats(self):
+        return self.db.stats
+
+    # ========== פעולות משתמשים ==========
+    
+    def get_or_create_user(self, user_id: int, username: str = None, 
+                          first_name: str = None) -> Dict:
+        """קבלת או יצירת משתמש"""
+        user = self.users.find_one({"user_id": user_id})
+        
+        if not user:
+            user = self._new_user_document(user_id, username, first_name)
+            self.users.insert_one(user)
+        elif not user.get("categories"):
+            categories = self._default_categories()
+            self.users.update_one(
+                {"user_id": user_id},
+                {"$set": {"categories": categories}}
+            )
+            user["categories"] = categories
+        
+        return user
+
+    def find_user_by_identifier(self, identifier: Optional[str]) -> Optional[Dict]:
+        """איתור משתמש לפי user_id או שם משתמש (עם או בלי @)."""
+        user_id, regex = self._username_regex(identifier)
+
+        # ניסיון לפי מזהה מספרי
+        if user_id is not None:
+            user = self.users.find_one({"user_id": user_id})
+            if user:
+                return user
+
+        # ניסיון לפי שם משתמש
+        if not regex:
+            return None
+        return self.users.find_one({"username": {"$regex": regex, "$options": "i"}})
+    
+    def update_user_stats(self, user_id: int, stat_name: str, increment: int = 1):
+        """עדכון סטטיסטיקות משתמש"""
+        self.users.update_one(
+            {"user_id": user_id},
+            {"$inc": {f"stats.{stat_name}": increment}}
+        )
+    
+    # ========== קטגוריות משתמש ==========
+
+    def get_user_categories(self, user_id: int) -> List[Dict[str, str]]:
+        """החזרת רשימת הקטגוריות של משתמש (יוזנו ברירות מחדל אם חסרות)."""
+        user = self.users.find_one({"user_id": user_id}, {"categories": 1})
+        categories = (user or {}).get("categories")
+        if not categories:
+            categories = self._default_categories()
+            self.users.update_one(
+                {"user_id": user_id},
+                {"$set": {"categories": categories}},
+                upsert=True
+            )
+        return deepcopy(categories)
+
+    def get_category_lookup(self, user_id: int) -> Dict[str, str]:
+        """מילון מהיר של שם קטגוריה -> אימוג׳י."""
+        return self._category_lookup_from(self.get_user_categories(user_id))
+
+    def get_category(self, user_id: int, name: str) -> Optional[Dict[str, str]]:
+        """החזרת אובייקט קטגוריה לפי שם (case-insensitive)."""
+        return self._match_category(self.get_user_categories(user_id), name)
+
+    # ========== פעולות פרומפטים ==========
+    
+    def get_prompt(self, prompt_id: str, user_id: int) -> Optional[Dict]:
+        """קבלת פרומפט לפי מזהה או קוד קצר (דטרמיניסטי)."""
+        filter_query = self._prompt_lookup_filter(prompt_id, user_id)
+        if filter_query is None:
+            return None
+        return self.prompts.find_one(filter_query)
+
+    # ========== חיפוש וסינון ==========
+    
+    def search_prompts(self, user_id: int, query: str = None, 
+                      category: str = None, tags: List[str] = None,
+                      favorites_only: bool = False, 
+                      skip: int = 0, limit: int = 10) -> List[Dict]:
+        """חיפוש פרומפטים עם סינון; שאילתת טקסט מדורגת לפי רלוונטיות, שימוש וטריות"""
+        filter_query = self._search_filter(user_id, query, category, tags, favorites_only)
+        
+        if query:
+            return list(self.prompts.aggregate(self._text_rank_pipeline(
+                filter_query, self.SEARCH_RESULT_PROJECTION, skip, limit
+            )))
         
         # ביצוע החיפוש
         prompts = list(self.prompts.find(filter_query)
-                      .sort("created_at", DESCENDING)
+                      .sort(self.SORT_NEWEST)
                       .skip(skip)
                       .limit(limit))
         
@@ -501,7 +707,7 @@ class Database:
         return list(self.prompts.find({
             "user_id": user_id,
             "is_deleted": False
-        }).sort("created_at", DESCENDING).skip(skip).limit(limit))
+        }).sort(self.SORT_NEWEST).skip(skip).limit(limit))
     
     def get_favorites(self, user_id: int) -> List[Dict]:
         """קבלת פרומפטים מועדפים"""
@@ -509,21 +715,21 @@ class Database:
             "user_id": user_id,
             "is_favorite": True,
             "is_deleted": False
-        }).sort("use_count", DESCENDING))
+        }).sort(self.SORT_POPULAR))
     
     def get_trash(self, user_id: int) -> List[Dict]:
         """קבלת פרומפטים באשפה"""
         return list(self.prompts.find({
             "user_id": user_id,
             "is_deleted": True
-        }).sort("deleted_at", DESCENDING))
+        }).sort(self.SORT_RECENTLY_DELETED))
     
     def get_popular_prompts(self, user_id: int, limit: int = 10) -> List[Dict]:
         """קבלת הפרומפטים הפופולריים ביותר"""
         return list(self.prompts.find({
             "user_id": user_id,
             "is_deleted": False
-        }).sort("use_count", DESCENDING).limit(limit))
+        }).sort(self.SORT_POPULAR).limit(limit))
     
     def count_prompts(self, user_id: int, **filters) -> int:
         """ספירת פרומפטים"""
@@ -550,23 +756,13 @@ class Database:
     def get_user_statistics(self, user_id: int) -> Dict:
         """קבלת סטטיסטיקות מפורטות"""
         user = self.users.find_one({"user_id": user_id})
+        category_pipeline, tag_pipeline = self._user_stats_pipelines(user_id)
         
         # קטגוריות פופולריות
-        category_stats = list(self.prompts.aggregate([
-            {"$match": {"user_id": user_id, "is_deleted": False}},
-            {"$group": {"_id": "$category", "count": {"$sum": 1}}},
-            {"$sort": {"count": -1}},
-            {"$limit": 5}
-        ]))
+        category_stats = list(self.prompts.aggregate(category_pipeline))
         
         # תגיות פופולריות
-        tag_stats = list(self.prompts.aggregate([
-            {"$match": {"user_id": user_id, "is_deleted": False}},
-            {"$unwind": "$tags"},
-            {"$group": {"_id": "$tags", "count": {"$sum": 1}}},
-            {"$sort": {"count": -1}},
-            {"$limit": 5}
-        ]))
+        tag_stats = list(self.prompts.aggregate(tag_pipeline))
         
         return {
             "user": user.get('stats', {}),
@@ -598,18 +794,7 @@ class Database:
             }
         )
         for doc in cursor:
-            stats = doc.get("stats") or {}
-            total_prompts = int(stats.get("total_prompts") or 0)
-            total_uses = int(stats.get("total_uses") or 0)
-            action_count = total_prompts + total_uses
-            user_actions.append({
-                "user_id": doc.get("user_id"),
-                "username": doc.get("username"),
-                "first_name": doc.get("first_name"),
-                "total_prompts": total_prompts,
-                "total_uses": total_uses,
-                "action_count": action_count
-            })
+            user_actions.append(self._admin_user_action(doc))
 
         user_actions.sort(key=lambda item: (item["action_count"], item["total_uses"]), reverse=True)
 
@@ -618,17 +803,7 @@ class Database:
             "total_users": total_users,
             "user_actions": user_actions
         }
-    
-    # ========== ניקוי ==========
-    
-    def cleanup_old_trash(self):
-        """מחיקה סופית של פרומפטים ישנים באשפה"""
-        threshold = datetime.utcnow() - timedelta(days=config.TRASH_RETENTION_DAYS)
-        result = self.prompts.delete_many({
-            "is_deleted": True,
-            "deleted_at": {"$lt": threshold}
-        })
-        return result.deleted_count
 
-# יצירת instance גלובלי
+
+# instance גלובלי (לא מתחבר בזמן import)
 db = Database()
@@ -13,13 +13,14 @@ import threading
 import time
 from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from typing import Callable, List, Optional
 
-from pymongo import MongoClient, ASCENDING
+from pymongo import ASCENDING
 from pymongo.collection import Collection
 from pymongo.errors import PyMongoError, DuplicateKeyError
 
 import config
+from mongo_client import get_client
 
 logger = logging.getLogger(__name__)
 
@@ -45,8 +46,8 @@ class MongoDistributedLock:
         collection_name: str = "bot_locks",
         lock_cfg: Optional[LockConfig] = None,
     ) -> None:
-        # Initialize Mongo client early; validate that URI is usable
-        self.client = MongoClient(mongo_uri)
+        # Shared process-wide client (same pool as Database); validated by the ping below
+        self.client = get_client(mongo_uri)
         self.db = self.client[db_name]
         self.collection: Collection = self.db[collection_name]
 
@@ -76,6 +77,7 @@ class MongoDistributedLock:
         self._stop_event = threading.Event()
         self._hb_thread: Optional[threading.Thread] = None
         self._is_owner = False
+        self._release_callbacks: List[Callable[[], None]] = []
 
         # One-time configuration log to aid diagnostics (safe, no secrets)
         logger.info(
@@ -237,15 +239,30 @@ class MongoDistributedLock:
                 )
                 if result.matched_count == 0:
                     logger.error("Lost distributed lock; terminating to avoid duplicate polling")
+                    self._run_release_callbacks()
                     os._exit(0)
             except PyMongoError as exc:
                 logger.error("Heartbeat failed: %s", exc)
                 # Keep trying; a transient error shouldn't drop the lock immediately
 
+    def add_release_callback(self, callback: Callable[[], None]) -> None:
+        """Run `callback` before the lock is given up (release, SIGTERM, lost lock)."""
+        self._release_callbacks.append(callback)
+
+    def _run_release_callbacks(self) -> None:
+        callbacks, self._release_callbacks = self._release_callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as exc:
+                logger.warning("Lock release callback failed: %s", exc)
+
     def release(self) -> None:
         if not self._is_owner:
             return
         self._stop_event.set()
+        # e.g. flush buffered writes while this instance still owns the lock
+        self._run_release_callbacks()
         try:
             self.collection.delete_one(
                 {"_id": self.cfg.service_id, "owner": self.cfg.instance_id}
@@ -0,0 +1,123 @@
+"""
+Typo-tolerant scoring of search candidates with python-Levenshtein.
+
+`UserIndex.fuzzy_candidates` (search_engine.py) prefilters a user's prompts
+by shared character trigrams; this module scores that short list in one
+batch:
+
+- Every field (the title and each tag, already normalized) is compared with
+  the normalized query twice: as a whole string, and token by token – each
+  query token takes its best match among the field's tokens and the token
+  scores are averaged. The better of the two is the field score; the best
+  field is the document score (0..1).
+- Documents below `min_score` are dropped; the rest come back best first.
+
+`rank` picks where to score by the number of candidates (the work grows with
+it, not with the library size): a handful are scored inline, a medium batch
+in a worker thread, and a large one is split into chunks that run in a shared
+process pool, so the Levenshtein work neither blocks the event loop nor
+competes with it for the GIL. The pool is
+created on first use with the `spawn` start method (the bot process already
+runs threads) and shut down by `shutdown_pool()` on exit.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, List, Optional, Sequence, Tuple
+
+from Levenshtein import ratio
+
+from search_engine import normalize, tokenize
+
+logger = logging.getLogger(__name__)
+
+Candidate = Tuple[Any, Tuple[str, ...]]
+
+_pool_lock = threading.Lock()
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+# ====== scoring (runs in worker processes as well) ======
+
+def _field_score(query: str, query_tokens: Sequence[str], field: str) -> float:
+    best = ratio(query, field)
+    field_tokens = tokenize(field)
+    if query_tokens and field_tokens:
+        per_token = sum(
+            max(ratio(token, other) for other in field_tokens)
+            for token in query_tokens
+        ) / len(query_tokens)
+        best = max(best, per_token)
+    return best
+
+
+def score_batch(query: str, candidates: Sequence[Candidate],
+                min_score: float) -> List[Tuple[Any, float]]:
+    """[(doc_id, score)] for the candidates scoring at least `min_score` (unsorted)."""
+    query = normalize(query).strip()
+    query_tokens = tokenize(query)
+    scored = []
+    for doc_id, fields in candidates:
+        score = max((_field_score(query, query_tokens, field) for field in fields), default=0.0)
+        if score >= min_score:
+            scored.append((doc_id, score))
+    return scored
+
+
+# ====== process pool ======
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=max(1, workers),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def shutdown_pool(wait: bool = True) -> None:
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=wait, cancel_futures=True)
+
+
+async def rank(query: str, candidates: Sequence[Candidate], min_score: float,
+               inline_max: int = 50, pool_min: int = 500, workers: int = 2,
+               chunk_size: int = 500) -> List[Tuple[Any, float]]:
+    """Score `candidates` against `query`; [(doc_id, score)] best first.
+
+    Up to `inline_max` candidates are scored on the event loop, fewer than
+    `pool_min` in a thread, and the rest in the process pool.
+    """
+    if not candidates:
+        return []
+    if len(candidates) <= inline_max:
+        scored = score_batch(query, candidates, min_score)
+    elif len(candidates) < pool_min:
+        scored = await asyncio.to_thread(score_batch, query, candidates, min_score)
+    else:
+        loop = asyncio.get_running_loop()
+        pool = _get_pool(workers)
+        chunks = [candidates[i:i + chunk_size] for i in range(0, len(candidates), chunk_size)]
+        try:
+            parts = await asyncio.gather(*(
+                loop.run_in_executor(pool, score_batch, query, chunk, min_score)
+                for chunk in chunks
+            ))
+            scored = [item for part in parts for item in part]
+        except BrokenProcessPool:
+            # a worker died (e.g. OOM-killed) – start a fresh pool next time, score this batch in a thread
+            logger.warning("Fuzzy scoring pool broke; falling back to a thread for this query")
+            shutdown_pool(wait=False)
+            scored = await asyncio.to_thread(score_batch, query, candidates, min_score)
+    scored.sort(key=lambda item: item[1], reverse=True)
+    return scored
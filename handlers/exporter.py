@@ -0,0 +1,106 @@
+"""
+מטפלי ייצוא ספריית הפרומפטים לקובץ (/export)
+"""
+import asyncio
+import gzip
+import json
+import tempfile
+import zipfile
+from datetime import datetime
+from typing import Any, Dict
+
+from telegram import InputFile, Update
+from telegram.ext import ContextTypes
+
+import config
+from async_database import db
+from keyboards import back_button
+from rate_limiter import BACKGROUND, PriorityRateLimiter
+
+EXPORT_FIELDS = ("title", "content", "category", "tags", "is_favorite", "use_count",
+                 "short_code", "is_deleted", "created_at", "updated_at", "deleted_at")
+
+# כמה שורות לצבור לפני דחיסה (הדחיסה רצה ב-thread)
+WRITE_CHUNK_LINES = 200
+# מגבלת העלאת מסמך של Bot API
+MAX_UPLOAD_BYTES = 50 * 1024 * 1024
+
+
+def _export_record(prompt: Dict[str, Any]) -> Dict[str, Any]:
+    """שורת JSONL אחת – באותה סכמה ש-/import קורא (content, title, category, tags)."""
+    record = {}
+    for field in EXPORT_FIELDS:
+        value = prompt.get(field)
+        if value is None:
+            continue
+        if isinstance(value, datetime):
+            value = value.isoformat() + "Z"
+        record[field] = value
+    return record
+
+
+def _open_writer(spool, archive: str):
+    """פותח כותב דחוס מעל ה-spool; מחזיר (כותב, פונקציית סגירה)."""
+    if archive == "zip":
+        zf = zipfile.ZipFile(spool, mode="w", compression=zipfile.ZIP_DEFLATED)
+        entry = zf.open("prompts.jsonl", mode="w", force_zip64=True)
+
+        def close():
+            entry.close()
+            zf.close()
+        return entry, close
+    gz = gzip.GzipFile(fileobj=spool, mode="wb")
+    return gz, gz.close
+
+
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """ייצוא כל הפרומפטים: /export [zip] [trash]"""
+    user = update.effective_user
+    args = [arg.lower() for arg in (getattr(context, "args", None) or [])]
+    archive = "zip" if "zip" in args else "gz"
+    include_trash = "trash" in args
+
+    progress = await update.message.reply_text("⏳ <b>מכין קובץ ייצוא...</b>", parse_mode='HTML')
+
+    # עד EXPORT_SPOOL_MAX_MB בזיכרון, ומעבר לכך קובץ זמני בדיסק
+    with tempfile.SpooledTemporaryFile(max_size=config.EXPORT_SPOOL_MAX_MB * 1024 * 1024) as spool:
+        writer, close_writer = _open_writer(spool, archive)
+        count = 0
+        lines = []
+        async for prompt in db.iter_user_prompts(user.id, include_trash=include_trash):
+            lines.append(json.dumps(_export_record(prompt), ensure_ascii=False) + "\n")
+            count += 1
+            if len(lines) >= WRITE_CHUNK_LINES:
+                await asyncio.to_thread(writer.write, "".join(lines).encode("utf-8"))
+                lines = []
+        if lines:
+            await asyncio.to_thread(writer.write, "".join(lines).encode("utf-8"))
+        await asyncio.to_thread(close_writer)
+
+        if not count:
+            await progress.edit_text("📭 אין פרומפטים לייצוא.")
+            return
+        if spool.tell() > MAX_UPLOAD_BYTES:
+            await progress.edit_text("⚠️ קובץ הייצוא גדול מ-50MB ולא ניתן לשלוח אותו בטלגרם.")
+            return
+
+        stamp = datetime.utcnow().strftime("%Y%m%d")
+        filename = f"prompts-{stamp}.zip" if archive == "zip" else f"prompts-{stamp}.jsonl.gz"
+        spool.seek(0)
+        # שליחה בעדיפות רקע – רק כשמגביל הקצב פעיל (אחרת ExtBot דוחה את rate_limit_args)
+        send_kwargs = {}
+        if isinstance(context.bot.rate_limiter, PriorityRateLimiter):
+            send_kwargs["rate_limit_args"] = BACKGROUND
+        await context.bot.send_document(
+            chat_id=update.effective_chat.id,
+            document=InputFile(spool, filename=filename),
+            caption=(
+                f"📦 ייצוא של {count} פרומפטים"
+                + (" (כולל סל המחזור)" if include_trash else "")
+                + "\nאפשר לטעון את הקובץ חזרה עם /import"
+                + (" (אחרי חילוץ)." if archive == "zip" else ".")
+            ),
+            reply_markup=back_button("back_main"),
+            **send_kwargs
+        )
+    await progress.delete()
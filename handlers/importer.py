@@ -0,0 +1,165 @@
+"""
+מטפלי ייבוא ספריית פרומפטים מקובץ (/import)
+"""
+import asyncio
+import gzip
+import os
+import tempfile
+import time
+from typing import Dict, Iterator, List
+
+from telegram import Update
+from telegram.error import BadRequest
+from telegram.ext import ContextTypes, ConversationHandler
+
+import config
+from async_database import db
+from keyboards import back_button
+from prompt_import import ImportFormatError, ImportStats, detect_format, is_gzipped, parse, validate
+from utils import escape_html
+
+# States
+WAITING_FOR_IMPORT_FILE = 0
+
+# עדכון הודעת ההתקדמות לכל היותר פעם בכמה שניות (מגבלות קצב של טלגרם)
+PROGRESS_INTERVAL_SECONDS = 2.0
+
+
+async def start_import(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """התחלת תהליך ייבוא – בקשת קובץ"""
+    await update.message.reply_text(
+        "📥 <b>ייבוא פרומפטים</b>\n\n"
+        "שלח לי קובץ עם הפרומפטים שלך:\n"
+        "• JSON / JSONL – שדות content, title, category, tags\n"
+        "• CSV – שורת כותרת עם העמודות האלה\n"
+        "• Markdown / TXT – כל כותרת (#) מתחילה פרומפט חדש\n"
+        "• conversations.json – ייצוא שיחות מ-ChatGPT\n"
+        "• קובץ .jsonl.gz שנוצר ב-/export\n\n"
+        f"💡 <i>עד {config.MAX_IMPORT_FILE_MB}MB. פרומפטים ארוכים מ-{config.MAX_PROMPT_LENGTH} "
+        f"תווים ידולגו.</i>\n\n"
+        "שלח /cancel לביטול.",
+        parse_mode='HTML'
+    )
+    return WAITING_FOR_IMPORT_FILE
+
+
+def _next_batch(prompts: Iterator, stats: ImportStats, size: int) -> List[Dict]:
+    """קריאת האצווה הבאה מהקובץ (רץ ב-thread – קריאה ופענוח חוסמים)."""
+    batch = []
+    for parsed in prompts:
+        prompt = validate(parsed, stats)
+        if prompt is None:
+            continue
+        batch.append(prompt._asdict())
+        if len(batch) >= size:
+            break
+    return batch
+
+
+def _progress_text(stats: ImportStats, done: bool = False) -> str:
+    header = "✅ <b>הייבוא הסתיים</b>" if done else "⏳ <b>מייבא...</b>"
+    text = f"{header}\n\n📥 נשמרו: <b>{stats.imported}</b>\n"
+    if stats.failed:
+        text += f"❌ נכשלו בשמירה: {stats.failed}\n"
+    if stats.skipped:
+        text += f"⏭️ דולגו: {stats.skipped}"
+        details = []
+        if stats.too_long:
+            details.append(f"{stats.too_long} ארוכים מדי")
+        if stats.empty:
+            details.append(f"{stats.empty} ריקים")
+        if stats.duplicates:
+            details.append(f"{stats.duplicates} כמעט זהים לפרומפט קיים")
+        text += f" ({', '.join(details)})\n"
+    if stats.tags_trimmed:
+        text += f"🏷️ תגיות קוצרו ל-{config.MAX_TAGS} ב-{stats.tags_trimmed} פרומפטים\n"
+    return text
+
+
+async def _edit_progress(message, text: str):
+    try:
+        await message.edit_text(text, parse_mode='HTML')
+    except BadRequest:
+        # "message is not modified" וכדומה – לא מפריע לייבוא
+        pass
+
+
+async def receive_import_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """קבלת הקובץ, פענוח בזרימה ושמירה באצוות"""
+    user = update.effective_user
+    document = update.message.document
+
+    fmt = detect_format(document.file_name)
+    if fmt is None:
+        await update.message.reply_text(
+            "⚠️ סוג קובץ לא נתמך.\n"
+            "שלח קובץ .json, .jsonl, .csv, .md, .txt או .jsonl.gz (או /cancel לביטול)."
+        )
+        return WAITING_FOR_IMPORT_FILE
+
+    if document.file_size and document.file_size > config.MAX_IMPORT_FILE_MB * 1024 * 1024:
+        await update.message.reply_text(
+            f"⚠️ הקובץ גדול מדי (מקסימום {config.MAX_IMPORT_FILE_MB}MB)."
+        )
+        return WAITING_FOR_IMPORT_FILE
+
+    progress = await update.message.reply_text("⏳ <b>מוריד את הקובץ...</b>", parse_mode='HTML')
+    stats = ImportStats()
+    error = None
+
+    with tempfile.TemporaryDirectory(prefix="import_") as tmp_dir:
+        path = os.path.join(tmp_dir, "upload")
+        tg_file = await document.get_file()
+        await tg_file.download_to_drive(path)
+
+        # newline='' נדרש ל-csv; utf-8-sig מסיר BOM של קבצים מ-Excel
+        opener = gzip.open if is_gzipped(document.file_name) else open
+        with opener(path, "rt", encoding="utf-8-sig", errors="replace", newline="") as stream:
+            prompts = parse(stream, fmt)
+            last_update = time.monotonic()
+            try:
+                while True:
+                    batch = await asyncio.to_thread(_next_batch, prompts, stats, config.IMPORT_BATCH_SIZE)
+                    if not batch:
+                        break
+                    if config.NEAR_DUPLICATE_SKIP_ON_IMPORT:
+                        batch, duplicates = await db.drop_near_duplicates(user.id, batch)
+                        stats.duplicates += duplicates
+                    imported, failed = await db.bulk_save_prompts(user.id, batch)
+                    stats.imported += imported
+                    stats.failed += failed
+                    if time.monotonic() - last_update >= PROGRESS_INTERVAL_SECONDS:
+                        last_update = time.monotonic()
+                        await _edit_progress(progress, _progress_text(stats))
+            except ImportFormatError as exc:
+                error = str(exc)
+
+    text = _progress_text(stats, done=True)
+    if error:
+        text += f"\n⚠️ הקריאה נעצרה: <code>{escape_html(error)}</code>\n"
+        text += "<i>הפרומפטים שלפני השגיאה נשמרו.</i>"
+    elif not stats.parsed:
+        text += "\n<i>לא נמצאו פרומפטים בקובץ.</i>"
+    await _edit_progress(progress, text)
+    await update.message.reply_text(
+        "📋 הפרומפטים זמינים ב'הפרומפטים שלי'.",
+        reply_markup=back_button("back_main")
+    )
+    return ConversationHandler.END
+
+
+async def remind_import_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """הודעה שאינה קובץ במהלך ייבוא"""
+    await update.message.reply_text(
+        "📎 שלח את הקובץ כמסמך (Document), או /cancel לביטול."
+    )
+    return WAITING_FOR_IMPORT_FILE
+
+
+async def cancel_import(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """ביטול הייבוא"""
+    await update.message.reply_text(
+        "❌ הייבוא בוטל.",
+        reply_markup=back_button("back_main")
+    )
+    return ConversationHandler.END
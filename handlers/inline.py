@@ -0,0 +1,61 @@
+"""
+מטפלי מצב inline (@bot שאילתה) – שליחת פרומפט לכל צ׳אט בלי להעתיק ידנית
+"""
+from telegram import (InlineQueryResultArticle, InlineQueryResultsButton,
+                      InputTextMessageContent, Update)
+from telegram.ext import ContextTypes
+
+import config
+from async_database import db
+
+DESCRIPTION_LENGTH = 100
+
+
+def _description(card) -> str:
+    """שורת התיאור מתחת לכותרת: תגיות ותחילת התוכן."""
+    parts = []
+    if card.tags:
+        parts.append(" ".join(f"#{tag}" for tag in card.tags[:3]))
+    content = " ".join(card.content.split())
+    if len(content) > DESCRIPTION_LENGTH:
+        content = content[:DESCRIPTION_LENGTH] + "..."
+    parts.append(content)
+    return " · ".join(parts)
+
+
+def _article(card) -> InlineQueryResultArticle:
+    fav = "⭐ " if card.is_favorite else ""
+    return InlineQueryResultArticle(
+        id=str(card.id),
+        title=f"{fav}{card.title}",
+        description=_description(card),
+        input_message_content=InputTextMessageContent(card.content),
+    )
+
+
+async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """חיפוש בפרומפטים של המשתמש לפי כותרת / תגית / קוד קצר – מהזיכרון, בלי פנייה למסד"""
+    inline = update.inline_query
+    if inline is None:
+        return
+
+    cards = await db.inline_search(inline.from_user.id, inline.query or "")
+    button = None
+    if not cards:
+        button = InlineQueryResultsButton(text="➕ שמירת פרומפט חדש בבוט", start_parameter="inline")
+
+    # is_personal: התשובה נשמרת בטלגרם לכל משתמש בנפרד, כך ששאילתה חוזרת לא מגיעה לבוט בכלל
+    await inline.answer(
+        [_article(card) for card in cards],
+        cache_time=config.INLINE_CACHE_SECONDS,
+        is_personal=True,
+        button=button,
+    )
+
+
+async def chosen_inline_result(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """פרומפט שנשלח דרך inline נספר כשימוש (דורש /setinlinefeedback ב-BotFather)"""
+    chosen = update.chosen_inline_result
+    if chosen is None:
+        return
+    await db.record_inline_choice(chosen.from_user.id, chosen.result_id)
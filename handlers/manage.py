@@ -4,7 +4,7 @@
 from telegram import Update
 from telegram.ext import ContextTypes, ConversationHandler
 from urllib.parse import unquote_plus
-from database import db
+from async_database import db
 from keyboards import (
     prompt_actions_keyboard, 
     pagination_keyboard,
@@ -17,6 +17,11 @@ from keyboards import (
 import config
 from bson import ObjectId
 from utils import escape_html, code_block, code_inline
+from pagination import parse_callback as parse_page_callback
+from render_cache import RenderCache, RenderedMessage
+
+# הודעות פרטים מרונדרות, לפי (פרומפט, updated_at, גרסת קטגוריות)
+detail_cache = RenderCache(config.DETAIL_RENDER_CACHE_MAX_ENTRIES) if config.ENABLE_DETAIL_RENDER_CACHE else None
 
 # States
 EDITING_CONTENT, EDITING_TITLE = range(2)
@@ -29,17 +34,14 @@ async def view_my_prompts(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.answer()
     
     user = update.effective_user
-    category_lookup = db.get_category_lookup(user.id)
     
-    # קבלת מספר העמוד
-    page = 0
-    if query and query.data.startswith('page_'):
-        page = int(query.data.split('_')[1])
+    # קבלת העמוד והסמן מתוך ה-callback
+    request = parse_page_callback(query.data if query else None, "page")
+    page = request.page
     
-    # קבלת פרומפטים
-    skip = page * config.PROMPTS_PER_PAGE
-    prompts = db.get_all_prompts(user.id, skip=skip, limit=config.PROMPTS_PER_PAGE)
-    total_count = db.count_prompts(user.id)
+    # קבלת פרומפטים, ספירה וקטגוריות בקריאה אחת
+    result, total_count, category_lookup = await db.get_list_screen(user.id, "all", request)
+    prompts = result.items
     
     if not prompts:
         text = "📋 <b>הפרומפטים שלי</b>\n\n"
@@ -62,40 +64,63 @@ async def view_my_prompts(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # בניית הטקסט
     text = f"📋 <b>הפרומפטים שלי</b> ({total_count} סה״כ)\n\n"
     
-    for i, prompt in enumerate(prompts, start=skip + 1):
-        emoji = category_lookup.get(prompt['category'], '📁')
-        fav = "⭐ " if prompt.get('is_favorite') else ""
-        
-        title = prompt['title']
-        if len(title) > 40:
-            title = title[:40] + "..."
+    for i, prompt in enumerate(prompts, start=page * config.PROMPTS_PER_PAGE + 1):
+        emoji = category_lookup.get(prompt.category, '📁')
+        fav = "⭐ " if prompt.is_favorite else ""
         
-        text += f"{i}. {fav}📝 <b>{escape_html(title)}</b>\n"
-        text += f"   {emoji} {escape_html(prompt['category'])}\n"
+        text += f"{i}. {fav}📝 <b>{escape_html(prompt.short_title())}</b>\n"
+        text += f"   {emoji} {escape_html(prompt.category)}\n"
         
         # תגיות
-        if prompt.get('tags'):
-            tags_str = " ".join([f"#{escape_html(tag)}" for tag in prompt['tags'][:3]])
+        if prompt.tags:
+            tags_str = " ".join([f"#{escape_html(tag)}" for tag in prompt.tags[:3]])
             text += f"   🏷️ {tags_str}\n"
         
-        text += f"   /view_{escape_html(prompt.get('short_code', str(prompt['_id'])))}\n\n"
+        text += f"   /view_{escape_html(prompt.code)}\n\n"
     
     # דפדוף
     total_pages = (total_count + config.PROMPTS_PER_PAGE - 1) // config.PROMPTS_PER_PAGE
     
+    keyboard = pagination_keyboard(page, total_pages, "page", result.prev_cursor, result.next_cursor)
+    
     if query:
         await query.edit_message_text(
             text,
             parse_mode='HTML',
-            reply_markup=pagination_keyboard(page, total_pages, "page")
+            reply_markup=keyboard
         )
     else:
         await update.message.reply_text(
             text,
             parse_mode='HTML',
-            reply_markup=pagination_keyboard(page, total_pages, "page")
+            reply_markup=keyboard
         )
 
+def _render_prompt_details(prompt: dict, emoji: str) -> RenderedMessage:
+    """בניית הודעת הפרטים – מחולקת סביב מונה השימושים, שמתעדכן בלי updated_at"""
+    fav = "⭐ " if prompt.get('is_favorite') else ""
+    code = prompt.get('short_code') or str(prompt['_id'])
+    
+    text = f"{fav}<b>{escape_html(prompt['title'])}</b>\n"
+    text += f"{'━' * 30}\n\n"
+    text += f"{escape_html(prompt['content'])}\n\n"
+    text += f"{'━' * 30}\n"
+    text += f"📊 <b>פרטים:</b>\n"
+    text += f"• קוד: {code_inline(code)}\n"
+    text += f"• קטגוריה: {emoji} {escape_html(prompt['category'])}\n"
+    text += f"• אורך: {prompt['length']} תווים\n"
+    text += f"• שימושים: "
+    
+    tail = f" פעמים\n"
+    tail += f"• נוצר: {prompt['created_at'].strftime('%d/%m/%Y')}\n"
+    
+    if prompt.get('tags'):
+        tags_str = " ".join([f"#{escape_html(tag)}" for tag in prompt['tags']])
+        tail += f"• תגיות: {tags_str}\n"
+    
+    keyboard = prompt_actions_keyboard(str(prompt['_id']), prompt.get('is_favorite', False))
+    return RenderedMessage(text, tail, keyboard)
+
 async def view_prompt_details(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """הצגת פרומפט מלא"""
     query = update.callback_query
@@ -123,7 +148,7 @@ async def view_prompt_details(update: Update, context: ContextTypes.DEFAULT_TYPE
         return
     
     user = update.effective_user
-    prompt = db.get_prompt(prompt_id, user.id)
+    prompt = await db.get_prompt(prompt_id, user.id)
     
     if not prompt:
         text = "⚠️ הפרומפט לא נמצא או שנמחק."
@@ -133,27 +158,15 @@ async def view_prompt_details(update: Update, context: ContextTypes.DEFAULT_TYPE
             await update.message.reply_text(text)
         return
     
-    # בניית ההודעה
-    category_lookup = db.get_category_lookup(user.id)
-    emoji = category_lookup.get(prompt['category'], '📁')
-    fav = "⭐ " if prompt.get('is_favorite') else ""
-    
-    text = f"{fav}<b>{escape_html(prompt['title'])}</b>\n"
-    text += f"{'━' * 30}\n\n"
-    text += f"{escape_html(prompt['content'])}\n\n"
-    text += f"{'━' * 30}\n"
-    text += f"📊 <b>פרטים:</b>\n"
-    text += f"• קוד: {code_inline(prompt.get('short_code', prompt_id))}\n"
-    text += f"• קטגוריה: {emoji} {escape_html(prompt['category'])}\n"
-    text += f"• אורך: {prompt['length']} תווים\n"
-    text += f"• שימושים: {prompt['use_count']} פעמים\n"
-    text += f"• נוצר: {prompt['created_at'].strftime('%d/%m/%Y')}\n"
-    
-    if prompt.get('tags'):
-        tags_str = " ".join([f"#{escape_html(tag)}" for tag in prompt['tags']])
-        text += f"• תגיות: {tags_str}\n"
-    
-    keyboard = prompt_actions_keyboard(str(prompt['_id']), prompt.get('is_favorite', False))
+    category_version, category_lookup = await db.get_versioned_category_lookup(user.id)
+    key = (str(prompt['_id']), prompt.get('updated_at'), category_version)
+    rendered = detail_cache.get(key) if detail_cache is not None else None
+    if rendered is None:
+        rendered = _render_prompt_details(prompt, category_lookup.get(prompt['category'], '📁'))
+        if detail_cache is not None:
+            detail_cache.put(key, rendered)
+    text = rendered.text(prompt['use_count'])
+    keyboard = rendered.markup
     
     if query:
         await query.edit_message_text(
@@ -168,6 +181,34 @@ async def view_prompt_details(update: Update, context: ContextTypes.DEFAULT_TYPE
             reply_markup=keyboard
         )
 
+async def show_similar_prompts(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """הפרומפטים הדומים ביותר לפרומפט המוצג"""
+    query = update.callback_query
+    await query.answer()
+    
+    user = update.effective_user
+    prompt_id = query.data.replace('similar_', '', 1)
+    similar = await db.similar_prompts(user.id, prompt_id)
+    
+    if not similar:
+        await query.edit_message_text(
+            "🔗 לא נמצאו פרומפטים דומים.",
+            reply_markup=back_button(f"view_{prompt_id}")
+        )
+        return
+    
+    text = "🔗 <b>פרומפטים דומים:</b>\n\n"
+    for i, prompt in enumerate(similar, 1):
+        fav = "⭐ " if prompt.is_favorite else ""
+        text += f"{i}. {fav}<b>{escape_html(prompt.short_title())}</b>\n"
+        text += f"   /view_{escape_html(prompt.code)}\n\n"
+    
+    await query.edit_message_text(
+        text,
+        parse_mode='HTML',
+        reply_markup=back_button(f"view_{prompt_id}")
+    )
+
 async def handle_view_command_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """תמיכה בפקודת /view וב-/view_<id> הנשלחים כטקסט"""
     message = update.message
@@ -198,14 +239,14 @@ async def copy_prompt(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     prompt_id = query.data.replace('copy_', '')
     
-    prompt = db.get_prompt(prompt_id, user.id)
+    prompt = await db.get_prompt(prompt_id, user.id)
     
     if not prompt:
         await query.answer("⚠️ הפרומפט לא נמצא", show_alert=True)
         return
     
     # עדכון מונה שימושים
-    db.increment_use_count(prompt_id, user.id)
+    await db.increment_use_count(str(prompt['_id']), user.id)
     
     # שליחת הפרומפט כהודעה שניתן להעתיק
     await context.bot.send_message(
@@ -228,14 +269,14 @@ async def toggle_favorite(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     prompt_id = query.data.replace('fav_', '')
     
-    prompt = db.get_prompt(prompt_id, user.id)
+    prompt = await db.get_prompt(prompt_id, user.id)
     
     if not prompt:
         await query.answer("⚠️ הפרומפט לא נמצא", show_alert=True)
         return
     
     new_fav_status = not prompt.get('is_favorite', False)
-    db.update_prompt(prompt_id, user.id, {'is_favorite': new_fav_status})
+    await db.update_prompt(prompt_id, user.id, {'is_favorite': new_fav_status})
     
     if new_fav_status:
         await query.answer("⭐ נוסף למועדפים!")
@@ -287,7 +328,7 @@ async def receive_new_content(update: Update, context: ContextTypes.DEFAULT_TYPE
         await update.message.reply_text("⚠️ שגיאה: לא נמצא פרומפט לעריכה")
         return ConversationHandler.END
     
-    success = db.update_prompt(prompt_id, user.id, {
+    success = await db.update_prompt(prompt_id, user.id, {
         'content': new_content,
         'length': len(new_content)
     })
@@ -327,7 +368,7 @@ async def start_change_category(update: Update, context: ContextTypes.DEFAULT_TY
     user = update.effective_user
     prompt_id = query.data.replace('chcat_', '')
     context.user_data['changing_category_for'] = prompt_id
-    categories = db.get_user_categories(user.id)
+    categories = await db.get_user_categories(user.id)
     await query.edit_message_text(
         "📁 <b>שינוי קטגוריה</b>\n\nבחר קטגוריה חדשה:",
         parse_mode='HTML',
@@ -348,8 +389,8 @@ async def apply_new_category(update: Update, context: ContextTypes.DEFAULT_TYPE)
     if raw_value == 'all':
         await query.answer("אנא בחר קטגוריה ספציפית", show_alert=True)
         return CHANGING_CATEGORY
-    category = db.ensure_category_name(user.id, unquote_plus(raw_value))
-    success = db.update_prompt(prompt_id, user.id, {'category': category})
+    category = await db.ensure_category_name(user.id, unquote_plus(raw_value))
+    success = await db.update_prompt(prompt_id, user.id, {'category': category})
     if success:
         await query.edit_message_text(
             "✅ הקטגוריה עודכנה בהצלחה!",
@@ -387,7 +428,7 @@ async def receive_new_title(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("⚠️ שגיאה: לא נמצא פרומפט לעריכה")
         return ConversationHandler.END
     
-    success = db.update_prompt(prompt_id, user.id, {'title': new_title})
+    success = await db.update_prompt(prompt_id, user.id, {'title': new_title})
     
     if success:
         await update.message.reply_text(
@@ -424,7 +465,7 @@ async def confirm_delete(update: Update, context: ContextTypes.DEFAULT_TYPE):
     _, action, prompt_id = query.data.split('_', 2)
     
     if action == 'delete':
-        success = db.delete_prompt(prompt_id, user.id, permanent=False)
+        success = await db.delete_prompt(prompt_id, user.id, permanent=False)
         
         if success:
             await query.edit_message_text(
@@ -452,7 +493,9 @@ async def view_favorites(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     user = update.effective_user
-    prompts = db.get_favorites(user.id)
+    request = parse_page_callback(query.data, "favpage")
+    result, total_count, category_lookup = await db.get_list_screen(user.id, "favorites", request)
+    prompts = result.items
     
     if not prompts:
         await query.edit_message_text(
@@ -464,20 +507,18 @@ async def view_favorites(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
-    text = f"⭐ <b>המועדפים שלי</b> ({len(prompts)})\n\n"
+    text = f"⭐ <b>המועדפים שלי</b> ({total_count})\n\n"
     
-    category_lookup = db.get_category_lookup(user.id)
-    for i, prompt in enumerate(prompts[:20], 1):  # מגביל ל-20
-        emoji = category_lookup.get(prompt['category'], '📁')
-        title = prompt['title']
-        if len(title) > 40:
-            title = title[:40] + "..."
+    for i, prompt in enumerate(prompts, start=request.page * config.PROMPTS_PER_PAGE + 1):
+        emoji = category_lookup.get(prompt.category, '📁')
         
-        text += f"{i}. {emoji} <b>{escape_html(title)}</b>\n"
-        text += f"   /view_{escape_html(prompt.get('short_code', str(prompt['_id'])))}\n\n"
+        text += f"{i}. {emoji} <b>{escape_html(prompt.short_title())}</b>\n"
+        text += f"   /view_{escape_html(prompt.code)}\n\n"
     
+    total_pages = (total_count + config.PROMPTS_PER_PAGE - 1) // config.PROMPTS_PER_PAGE
     await query.edit_message_text(
         text,
         parse_mode='HTML',
-        reply_markup=back_button("back_main")
+        reply_markup=pagination_keyboard(request.page, total_pages, "favpage",
+                                         result.prev_cursor, result.next_cursor)
     )
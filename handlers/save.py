@@ -4,13 +4,13 @@
 from telegram import Update
 from telegram.ext import ContextTypes, ConversationHandler
 from urllib.parse import unquote_plus
-from database import db
-from keyboards import category_keyboard, prompt_actions_keyboard, back_button
+from async_database import db
+from keyboards import category_keyboard, prompt_actions_keyboard, back_button, near_duplicate_keyboard
 import config
 from utils import escape_html
 
 # States for conversation
-WAITING_FOR_PROMPT, WAITING_FOR_TITLE, WAITING_FOR_CATEGORY = range(3)
+WAITING_FOR_PROMPT, WAITING_FOR_TITLE, WAITING_FOR_CATEGORY, WAITING_FOR_DUPLICATE_CHOICE = range(4)
 
 async def start_save_prompt(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """התחלת תהליך שמירת פרומפט"""
@@ -59,16 +59,48 @@ async def receive_prompt_content(update: Update, context: ContextTypes.DEFAULT_T
     # שמירה בהקשר
     context.user_data['new_prompt_content'] = content
     
+    # אזהרה לפני שמירת עותק כמעט זהה של פרומפט קיים; החתימה נשמרת ל-save_prompt
+    content_signature = await db.content_signature(content)
+    context.user_data['new_prompt_signature'] = content_signature
+    duplicates = await db.find_near_duplicates(user.id, content, content_signature=content_signature)
+    if duplicates:
+        text = "⚠️ <b>זה נראה כמו פרומפט קיים:</b>\n\n"
+        for match in duplicates:
+            text += f"📋 {escape_html(match.title)} ({round(match.similarity * 100)}% דמיון)\n"
+            text += f"   /view_{escape_html(match.short_code)}\n\n"
+        text += "לשמור בכל זאת כפרומפט חדש?"
+        await update.message.reply_text(
+            text,
+            parse_mode='HTML',
+            reply_markup=near_duplicate_keyboard()
+        )
+        return WAITING_FOR_DUPLICATE_CHOICE
+    
     # בקשת כותרת
-    preview = content[:100] + "..." if len(content) > 100 else content
+    await update.message.reply_text(_title_request_text(content), parse_mode='HTML')
     
-    await update.message.reply_text(
+    return WAITING_FOR_TITLE
+
+def _title_request_text(content: str) -> str:
+    preview = content[:100] + "..." if len(content) > 100 else content
+    return (
         f"✅ הפרומפט התקבל!\n\n"
         f"📄 <b>תצוגה מקדימה:</b>\n"
         f"<i>{escape_html(preview)}</i>\n\n"
-        f"📋 כעת, שלח כותרת לפרומפט (או שלח דלג):",
-        parse_mode='HTML'
+        f"📋 כעת, שלח כותרת לפרומפט (או שלח דלג):"
     )
+
+async def confirm_near_duplicate(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """המשתמש בחר לשמור למרות הדמיון לפרומפט קיים"""
+    query = update.callback_query
+    await query.answer()
+    
+    content = context.user_data.get('new_prompt_content')
+    if not content:
+        await query.edit_message_text("⚠️ הפרומפט לא נמצא. התחל מחדש עם /save.")
+        return ConversationHandler.END
+    
+    await query.edit_message_text(_title_request_text(content), parse_mode='HTML')
     
     return WAITING_FOR_TITLE
 
@@ -85,7 +117,7 @@ async def receive_prompt_title(update: Update, context: ContextTypes.DEFAULT_TYP
     context.user_data['new_prompt_title'] = title
     
     # בקשת קטגוריה
-    categories = db.get_user_categories(user.id)
+    categories = await db.get_user_categories(user.id)
     
     await update.message.reply_text(
         f"✅ הכותרת נשמרה: <b>{escape_html(title)}</b>\n\n"
@@ -107,24 +139,25 @@ async def receive_prompt_category(update: Update, context: ContextTypes.DEFAULT_
         await query.answer("אנא בחר קטגוריה ספציפית", show_alert=True)
         return WAITING_FOR_CATEGORY
     category = unquote_plus(raw_value)
-    category = db.ensure_category_name(user.id, category)
+    category = await db.ensure_category_name(user.id, category)
     
     # שמירת הפרומפט
     content = context.user_data.get('new_prompt_content')
     title = context.user_data.get('new_prompt_title')
     
-    prompt = db.save_prompt(
+    prompt = await db.save_prompt(
         user_id=user.id,
         content=content,
         title=title,
-        category=category
+        category=category,
+        content_signature=context.user_data.get('new_prompt_signature')
     )
     
     # ניקוי ההקשר
     context.user_data.clear()
     
     # הצגת הפרומפט החדש
-    emoji_map = db.get_category_lookup(user.id)
+    emoji_map = await db.get_category_lookup(user.id)
     emoji = emoji_map.get(category, '📁')
     
     await query.edit_message_text(
@@ -4,12 +4,20 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler
 from urllib.parse import quote_plus, unquote_plus
-from database import db
-from keyboards import category_keyboard, back_button, main_menu_keyboard
+from async_database import db
+from keyboards import (category_keyboard, back_button, main_menu_keyboard, pagination_keyboard,
+                       offset_pagination_keyboard, tag_suggestions_keyboard)
+from pagination import parse_callback as parse_page_callback
 from utils import escape_html
+import config
 
 CATEGORY_ADDING, CATEGORY_RENAMING = range(2)
 SEARCH_FLAG = "awaiting_search_query"
+FUZZY_PREFIX = "~"
+TAG_PREFIX = "#"
+SEARCH_QUERY_KEY = "search_query"  # (שאילתה, עמום מפורש, תגית) לדפדוף בתוצאות
+SEARCH_TAGS_KEY = "search_tag_suggestions"  # התגיות שמוצגות ככפתורים (srchtag_<i>)
+CATEGORY_FILTER_KEY = "category_filter"
 
 def _looks_like_emoji(token: str) -> bool:
     if not token:
@@ -39,24 +47,30 @@ async def start_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """התחלת חיפוש"""
     query = update.callback_query
     context.user_data[SEARCH_FLAG] = True
+    suggestions = await db.suggest_tags(update.effective_user.id)
+    context.user_data[SEARCH_TAGS_KEY] = suggestions
     text = (
         "🔍 <b>חיפוש פרומפטים</b>\n\n"
         "שלח מילת חיפוש או ביטוי לחיפוש בכל הפרומפטים שלך.\n\n"
-        "💡 <i>טיפ: החיפוש מתבצע בכותרת ובתוכן הפרומפט</i>\n\n"
+        "💡 <i>טיפ: החיפוש מתבצע בכותרת ובתוכן הפרומפט</i>\n"
+        "🔤 <i>התחל ב-~ (למשל ~פרומפתים) לחיפוש שסולח על שגיאות הקלדה בכותרות ובתגיות</i>\n"
+        "🏷️ <i>התחל ב-# (למשל #pyt) לחיפוש לפי תגית, או בחר תגית מהכפתורים</i>\n\n"
         "ליציאה – שלח /cancel או פשוט לחץ על כל כפתור אחר."
     )
+    keyboard = (tag_suggestions_keyboard(suggestions, "srchtag", back_callback="back_main")
+                if suggestions else back_button("back_main"))
     if query:
         await query.answer()
         await query.edit_message_text(
             text,
             parse_mode='HTML',
-            reply_markup=back_button("back_main")
+            reply_markup=keyboard
         )
     else:
         await update.message.reply_text(
             text,
             parse_mode='HTML',
-            reply_markup=back_button("back_main")
+            reply_markup=keyboard
         )
 
 async def receive_search_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -73,60 +87,140 @@ async def receive_search_query(update: Update, context: ContextTypes.DEFAULT_TYP
         return
 
     user = update.effective_user
-    category_lookup = db.get_category_lookup(user.id)
-    
-    # חיפוש
-    results = db.search_prompts(user.id, query=query_text, limit=20)
     context.user_data.pop(SEARCH_FLAG, None)
-    
-    if not results:
-        await message.reply_text(
-            f"🔍 לא נמצאו תוצאות עבור: <b>{escape_html(query_text)}</b>\n\n"
-            f"נסה מילות חיפוש אחרות.",
-            parse_mode='HTML',
-            reply_markup=back_button("back_main")
-        )
+
+    # #קידומת = חיפוש לפי תגית, עם השלמה מתוך התגיות הקיימות
+    if query_text.startswith(TAG_PREFIX) and query_text.strip(TAG_PREFIX + " "):
+        prefix = query_text.strip(TAG_PREFIX + " ").lower()
+        completions = await db.suggest_tags(user.id, prefix, limit=config.TAG_SUGGESTIONS)
+        exact = [tag for tag in completions if tag.lower() == prefix]
+        if exact or len(completions) == 1:
+            tag = (exact or completions)[0]
+            context.user_data[SEARCH_QUERY_KEY] = ("", False, tag)
+            text, keyboard = await _search_results_screen(user.id, "", False, 0, tag)
+        elif completions:
+            context.user_data[SEARCH_TAGS_KEY] = completions
+            text = f"🏷️ תגיות שמתחילות ב-<code>{escape_html(prefix)}</code> – בחר אחת:"
+            keyboard = tag_suggestions_keyboard(completions, "srchtag", back_callback="back_main")
+        else:
+            text = f"🏷️ אין תגית שמתחילה ב-<code>{escape_html(prefix)}</code>."
+            keyboard = back_button("back_main")
+        await message.reply_text(text, parse_mode='HTML', reply_markup=keyboard)
         return
-    
-    # הצגת תוצאות
-    text = f"🔍 <b>תוצאות חיפוש:</b> \"{escape_html(query_text)}\"\n"
-    text += f"נמצאו {len(results)} תוצאות\n\n"
-    
-    for i, prompt in enumerate(results, 1):
-        emoji = category_lookup.get(prompt['category'], '📁')
-        fav = "⭐ " if prompt.get('is_favorite') else ""
-        
-        title = prompt['title']
-        if len(title) > 40:
-            title = title[:40] + "..."
-        
-        text += f"{i}. {fav}{emoji} <b>{escape_html(title)}</b>\n"
-        text += f"   📁 {escape_html(prompt['category'])}\n"
-        text += f"   /view_{escape_html(prompt.get('short_code', str(prompt['_id'])))}\n\n"
-    
+
+    # ~שאילתה = חיפוש עמום מפורש; אחרת מדויק, ועמום רק אם לא נמצא דבר
+    fuzzy = query_text.startswith(FUZZY_PREFIX)
+    if fuzzy:
+        query_text = query_text[len(FUZZY_PREFIX):].strip() or query_text
+    context.user_data[SEARCH_QUERY_KEY] = (query_text, fuzzy, None)
+
+    text, keyboard = await _search_results_screen(user.id, query_text, fuzzy, 0)
     await message.reply_text(
         text,
         parse_mode='HTML',
-        reply_markup=back_button("back_main")
+        reply_markup=keyboard
+    )
+
+async def show_search_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """דפדוף בתוצאות החיפוש האחרון (srchpage_<n>) – מתוך הרשימה המדורגת שבמטמון"""
+    query = update.callback_query
+    await query.answer()
+
+    # השאילתה לא נכנסת ב-64 הבתים של callback_data – נשמרת בהקשר
+    saved = context.user_data.get(SEARCH_QUERY_KEY)
+    if not saved:
+        return await start_search(update, context)
+    raw_page = query.data.replace('srchpage_', '', 1)
+    page = int(raw_page) if raw_page.isdigit() else 0
+
+    query_text, fuzzy, tag = saved
+    text, keyboard = await _search_results_screen(update.effective_user.id, query_text, fuzzy, page, tag)
+    await query.edit_message_text(
+        text,
+        parse_mode='HTML',
+        reply_markup=keyboard
+    )
+
+async def search_by_tag(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """בחירת תגית מכפתורי ההשלמה בחיפוש (srchtag_<i>) – כל הפרומפטים עם התגית"""
+    query = update.callback_query
+    await query.answer()
+
+    suggestions = context.user_data.get(SEARCH_TAGS_KEY) or []
+    raw_index = query.data.replace('srchtag_', '', 1)
+    index = int(raw_index) if raw_index.isdigit() else -1
+    if not 0 <= index < len(suggestions):
+        return await start_search(update, context)
+
+    tag = suggestions[index]
+    context.user_data.pop(SEARCH_FLAG, None)
+    context.user_data[SEARCH_QUERY_KEY] = ("", False, tag)
+    text, keyboard = await _search_results_screen(update.effective_user.id, "", False, 0, tag)
+    await query.edit_message_text(
+        text,
+        parse_mode='HTML',
+        reply_markup=keyboard
     )
 
+async def _search_results_screen(user_id: int, query_text: str, fuzzy: bool, page: int,
+                                 tag: str = None):
+    """טקסט ומקלדת של עמוד תוצאות חיפוש (לפי שאילתה או לפי תגית)."""
+    category_lookup = await db.get_category_lookup(user_id)
+    result = await db.get_search_page(user_id, query_text, page,
+                                      config.PROMPTS_PER_PAGE, fuzzy=fuzzy, tag=tag)
+    label = f"#{tag}" if tag else query_text
+
+    if not result.total:
+        text = (
+            f"🔍 לא נמצאו תוצאות עבור: <b>{escape_html(label)}</b>\n\n"
+            f"נסה מילות חיפוש אחרות."
+        )
+        return text, back_button("back_main")
+
+    # הצגת תוצאות
+    text = f"🔍 <b>תוצאות חיפוש:</b> \"{escape_html(label)}\"\n"
+    if result.fuzzy:
+        text += "🔤 <i>תוצאות דומות (חיפוש שסולח על שגיאות הקלדה)</i>\n"
+    text += f"נמצאו {result.total} תוצאות\n\n"
+    
+    for i, prompt in enumerate(result.items, start=page * config.PROMPTS_PER_PAGE + 1):
+        emoji = category_lookup.get(prompt.category, '📁')
+        fav = "⭐ " if prompt.is_favorite else ""
+        
+        text += f"{i}. {fav}{emoji} <b>{escape_html(prompt.short_title())}</b>\n"
+        text += f"   📁 {escape_html(prompt.category)}\n"
+        text += f"   /view_{escape_html(prompt.code)}\n\n"
+    
+    total_pages = (result.total + config.PROMPTS_PER_PAGE - 1) // config.PROMPTS_PER_PAGE
+    return text, offset_pagination_keyboard(page, total_pages, "srchpage")
+
 async def filter_by_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """סינון לפי קטגוריה"""
     query = update.callback_query
     await query.answer()
     
-    raw_value = query.data.replace('cat_', '', 1)
     user = update.effective_user
+    request = parse_page_callback(query.data, "catpage")
     
-    if raw_value == 'all':
-        # הצגת כל הפרומפטים
-        from handlers.manage import view_my_prompts
-        return await view_my_prompts(update, context)
+    if query.data.startswith('catpage_'):
+        # שם הקטגוריה לא נכנס ב-64 הבתים של callback_data יחד עם הסמן – נשמר בהקשר
+        category = context.user_data.get(CATEGORY_FILTER_KEY)
+        if not category:
+            return await show_categories_menu(update, context)
+    else:
+        raw_value = query.data.replace('cat_', '', 1)
+        if raw_value == 'all':
+            # הצגת כל הפרומפטים
+            from handlers.manage import view_my_prompts
+            return await view_my_prompts(update, context)
+        category = await db.ensure_category_name(user.id, unquote_plus(raw_value))
+        context.user_data[CATEGORY_FILTER_KEY] = category
     
-    category = db.ensure_category_name(user.id, unquote_plus(raw_value))
-    category_lookup = db.get_category_lookup(user.id)
     # סינון לפי קטגוריה
-    prompts = db.search_prompts(user.id, category=category, limit=50)
+    result, total_count, category_lookup = await db.get_list_screen(
+        user.id, "category", request, category=category
+    )
+    prompts = result.items
     
     if not prompts:
         emoji = category_lookup.get(category, '📁')
@@ -141,23 +235,22 @@ async def filter_by_category(update: Update, context: ContextTypes.DEFAULT_TYPE)
     # הצגת תוצאות
     emoji = category_lookup.get(category, '📁')
     text = f"📁 <b>{emoji} {escape_html(category)}</b>\n"
-    text += f"נמצאו {len(prompts)} פרומפטים\n\n"
+    text += f"נמצאו {total_count} פרומפטים\n\n"
     
-    for i, prompt in enumerate(prompts[:20], 1):
-        fav = "⭐ " if prompt.get('is_favorite') else ""
+    for i, prompt in enumerate(prompts, start=request.page * config.PROMPTS_PER_PAGE + 1):
+        fav = "⭐ " if prompt.is_favorite else ""
         
-        title = prompt['title']
-        if len(title) > 40:
-            title = title[:40] + "..."
-        
-        text += f"{i}. {fav}<b>{escape_html(title)}</b>\n"
-        text += f"   🔢 {prompt['use_count']} שימושים\n"
-        text += f"   /view_{escape_html(prompt.get('short_code', str(prompt['_id'])))}\n\n"
+        text += f"{i}. {fav}<b>{escape_html(prompt.short_title())}</b>\n"
+        text += f"   🔢 {prompt.use_count} שימושים\n"
+        text += f"   /view_{escape_html(prompt.code)}\n\n"
     
+    total_pages = (total_count + config.PROMPTS_PER_PAGE - 1) // config.PROMPTS_PER_PAGE
     await query.edit_message_text(
         text,
         parse_mode='HTML',
-        reply_markup=back_button("categories")
+        reply_markup=pagination_keyboard(request.page, total_pages, "catpage",
+                                         result.prev_cursor, result.next_cursor,
+                                         back_callback="categories")
     )
 
 async def show_categories_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -167,9 +260,10 @@ async def show_categories_menu(update: Update, context: ContextTypes.DEFAULT_TYP
     
     user = update.effective_user
     
-    categories = db.get_user_categories(user.id)
+    categories = await db.get_user_categories(user.id)
+    # ספירת פרומפטים לכל קטגוריה – מתוך מסמך הסיכום
+    counts = await db.get_category_counts(user.id)
     
-    # ספירת פרומפטים לכל קטגוריה
     text = "📁 <b>קטגוריות</b>\n\n"
     text += "בחר קטגוריה לצפייה:\n\n"
     
@@ -177,7 +271,7 @@ async def show_categories_menu(update: Update, context: ContextTypes.DEFAULT_TYP
     for item in categories:
         name = item.get('name')
         emoji = item.get('emoji', '📁')
-        count = db.count_prompts(user.id, category=name)
+        count = counts.get(name, 0)
         if count > 0:
             any_counts = True
             text += f"{emoji} <b>{escape_html(name)}</b>: {count} פרומפטים\n"
@@ -198,7 +292,7 @@ async def manage_categories(update: Update, context: ContextTypes.DEFAULT_TYPE,
     if query and not skip_answer:
         await query.answer()
     user = update.effective_user
-    categories = db.get_user_categories(user.id)
+    categories = await db.get_user_categories(user.id)
     text = "⚙️ <b>ניהול קטגוריות</b>\n"
     if notice:
         text += f"{notice}\n"
@@ -271,7 +365,7 @@ async def receive_new_category(update: Update, context: ContextTypes.DEFAULT_TYP
         emoji = "📁"
     
     try:
-        db.add_user_category(user.id, name, emoji)
+        await db.add_user_category(user.id, name, emoji)
     except ValueError as exc:
         await update.message.reply_text(f"⚠️ {escape_html(str(exc))}", parse_mode='HTML')
         return CATEGORY_ADDING
@@ -289,7 +383,7 @@ async def start_edit_category(update: Update, context: ContextTypes.DEFAULT_TYPE
     raw_value = query.data.replace('catcfg_edit_', '', 1)
     decoded = unquote_plus(raw_value)
     
-    category = db.get_category(user.id, decoded)
+    category = await db.get_category(user.id, decoded)
     if not category:
         await query.edit_message_text(
             "⚠️ הקטגוריה לא נמצאה.",
@@ -331,11 +425,11 @@ async def receive_updated_category(update: Update, context: ContextTypes.DEFAULT
         return CATEGORY_RENAMING
     
     if not emoji:
-        current = db.get_category(user.id, original_name)
+        current = await db.get_category(user.id, original_name)
         emoji = (current or {}).get('emoji', '📁')
     
     try:
-        db.update_user_category(user.id, original_name, name, emoji)
+        await db.update_user_category(user.id, original_name, name, emoji)
     except ValueError as exc:
         await update.message.reply_text(f"⚠️ {escape_html(str(exc))}", parse_mode='HTML')
         return CATEGORY_RENAMING
@@ -353,12 +447,12 @@ async def start_remove_category(update: Update, context: ContextTypes.DEFAULT_TY
     raw_value = query.data.replace('catcfg_remove_', '', 1)
     decoded = unquote_plus(raw_value)
     
-    categories = db.get_user_categories(user.id)
+    categories = await db.get_user_categories(user.id)
     if len(categories) <= 1:
         await query.answer("⚠️ חייבת להישאר לפחות קטגוריה אחת.", show_alert=True)
         return
     
-    category = db.get_category(user.id, decoded)
+    category = await db.get_category(user.id, decoded)
     if not category:
         await query.answer("⚠️ הקטגוריה לא נמצאה.", show_alert=True)
         return
@@ -388,7 +482,7 @@ async def apply_remove_category(update: Update, context: ContextTypes.DEFAULT_TY
     raw_value = query.data.replace('catcfg_remove_confirm_', '', 1)
     decoded = unquote_plus(raw_value)
     
-    category = db.get_category(user.id, decoded)
+    category = await db.get_category(user.id, decoded)
     if not category:
         await query.edit_message_text(
             "⚠️ הקטגוריה כבר אינה קיימת.",
@@ -398,7 +492,7 @@ async def apply_remove_category(update: Update, context: ContextTypes.DEFAULT_TY
         return
     
     try:
-        fallback = db.delete_user_category(user.id, category.get('name'))
+        fallback = await db.delete_user_category(user.id, category.get('name'))
     except ValueError as exc:
         await query.edit_message_text(
             f"⚠️ {escape_html(str(exc))}",
@@ -433,7 +527,7 @@ async def show_tags_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     user = update.effective_user
-    tags = db.get_all_tags(user.id)
+    tags = await db.get_tag_counts(user.id)
     
     if not tags:
         await query.edit_message_text(
@@ -449,9 +543,7 @@ async def show_tags_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text += "התגיות הפופולריות ביותר:\n\n"
     
     for i, tag in enumerate(tags[:20], 1):
-        # ספירת שימושים
-        count = len(db.search_prompts(user.id, tags=[tag], limit=100))
-        text += f"{i}. #{escape_html(tag)} ({count})\n"
+        text += f"{i}. #{escape_html(tag['_id'])} ({tag['count']})\n"
     
     text += f"\n<i>סה״כ {len(tags)} תגיות</i>"
     
@@ -464,8 +556,13 @@ async def show_tags_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def show_popular_prompts(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """הצגת פרומפטים פופולריים"""
     user = update.effective_user
-    prompts = db.get_popular_prompts(user.id, limit=10)
-    category_lookup = db.get_category_lookup(user.id)
+    query = update.callback_query
+    if query:
+        await query.answer()
+    request = parse_page_callback(query.data if query else None, "poppage")
+    result, total_count, category_lookup = await db.get_list_screen(user.id, "popular", request)
+    prompts = result.items
+    keyboard = back_button("back_main")
     
     if not prompts:
         text = "🔥 <b>פרומפטים פופולריים</b>\n\n"
@@ -474,29 +571,29 @@ async def show_popular_prompts(update: Update, context: ContextTypes.DEFAULT_TYP
     else:
         text = "🔥 <b>הפרומפטים הפופולריים ביותר</b>\n\n"
         
-        for i, prompt in enumerate(prompts, 1):
-            emoji = category_lookup.get(prompt['category'], '📁')
-            fav = "⭐ " if prompt.get('is_favorite') else ""
+        for i, prompt in enumerate(prompts, start=request.page * config.PROMPTS_PER_PAGE + 1):
+            emoji = category_lookup.get(prompt.category, '📁')
+            fav = "⭐ " if prompt.is_favorite else ""
             
-            title = prompt['title']
-            if len(title) > 40:
-                title = title[:40] + "..."
-            
-            text += f"{i}. {fav}{emoji} <b>{escape_html(title)}</b>\n"
-            text += f"   🔢 {prompt['use_count']} שימושים\n"
-            text += f"   /view_{escape_html(prompt.get('short_code', str(prompt['_id'])))}\n\n"
+            text += f"{i}. {fav}{emoji} <b>{escape_html(prompt.short_title())}</b>\n"
+            text += f"   🔢 {prompt.use_count} שימושים\n"
+            text += f"   /view_{escape_html(prompt.code)}\n\n"
+        
+        total_pages = (total_count + config.PROMPTS_PER_PAGE - 1) // config.PROMPTS_PER_PAGE
+        keyboard = pagination_keyboard(request.page, total_pages, "poppage",
+                                       result.prev_cursor, result.next_cursor)
     
-    if update.callback_query:
-        await update.callback_query.edit_message_text(
+    if query:
+        await query.edit_message_text(
             text,
             parse_mode='HTML',
-            reply_markup=back_button("back_main")
+            reply_markup=keyboard
         )
     else:
         await update.message.reply_text(
             text,
             parse_mode='HTML',
-            reply_markup=back_button("back_main")
+            reply_markup=keyboard
         )
 
 
@@ -3,14 +3,17 @@
 """
 from telegram import Update
 from telegram.ext import ContextTypes, ConversationHandler
-from database import db
-from keyboards import tag_management_keyboard, back_button
+from async_database import db
+from keyboards import tag_management_keyboard, tag_suggestions_keyboard, back_button
 import config
 from utils import escape_html
 
 # States
 WAITING_FOR_NEW_TAG = 0
 
+TAG_SUGGESTIONS_KEY = "tag_suggestions"  # התגיות שמוצגות ככפתורים (picktag_<i>)
+PENDING_TAG_KEY = "pending_new_tag"      # תגית חדשה שהוקלדה וממתינה לאישור (picktag_new)
+
 async def manage_tags(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """ניהול תגיות של פרומפט"""
     query = update.callback_query
@@ -19,7 +22,7 @@ async def manage_tags(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     prompt_id = query.data.replace('tags_', '')
     
-    prompt = db.get_prompt(prompt_id, user.id)
+    prompt = await db.get_prompt(prompt_id, user.id)
     
     if not prompt:
         await query.edit_message_text("⚠️ הפרומפט לא נמצא")
@@ -46,28 +49,78 @@ async def manage_tags(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 async def start_add_tag(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """התחלת הוספת תגית"""
+    """התחלת הוספת תגית – עם התגיות הנפוצות של המשתמש ככפתורים"""
     query = update.callback_query
     await query.answer()
     
+    user = update.effective_user
     prompt_id = query.data.replace('addtag_', '')
     context.user_data['adding_tag_to'] = prompt_id
     
-    await query.edit_message_text(
+    prompt = await db.get_prompt(prompt_id, user.id)
+    existing_tags = (prompt or {}).get('tags', [])
+    suggestions = await db.suggest_tags(user.id, exclude=existing_tags)
+    context.user_data[TAG_SUGGESTIONS_KEY] = suggestions
+    context.user_data.pop(PENDING_TAG_KEY, None)
+    
+    text = (
         "🏷️ <b>הוספת תגית חדשה</b>\n\n"
         "שלח את שם התגית (ללא #)\n\n"
-        "דוגמאות:\n"
-        "• <code>python</code>\n"
-        "• <code>telegram-bot</code>\n"
-        "• <code>beginner</code>\n\n"
-        "או שלח /cancel לביטול.",
-        parse_mode='HTML'
+    )
+    if suggestions:
+        text += "או בחר תגית קיימת מהכפתורים למטה.\n\n"
+    else:
+        text += (
+            "דוגמאות:\n"
+            "• <code>python</code>\n"
+            "• <code>telegram-bot</code>\n"
+            "• <code>beginner</code>\n\n"
+        )
+    text += "או שלח /cancel לביטול."
+    
+    await query.edit_message_text(
+        text,
+        parse_mode='HTML',
+        reply_markup=tag_suggestions_keyboard(suggestions, "picktag") if suggestions else None
     )
     
     return WAITING_FOR_NEW_TAG
 
+async def _add_tag(update: Update, context: ContextTypes.DEFAULT_TYPE, prompt: dict, tag: str):
+    """הוספת תגית לפרומפט שכבר נטען; מחזיר את המצב הבא של השיחה."""
+    message = update.effective_message
+    prompt_id = str(prompt['_id'])
+    existing_tags = prompt.get('tags', [])
+    
+    if tag in existing_tags:
+        await message.reply_text(
+            f"⚠️ התגית <code>#{escape_html(tag)}</code> כבר קיימת!",
+            parse_mode='HTML'
+        )
+        return WAITING_FOR_NEW_TAG
+    
+    # בדיקת מגבלת תגיות
+    if len(existing_tags) >= config.MAX_TAGS:
+        await message.reply_text(
+            f"⚠️ הגעת למקסימום של {config.MAX_TAGS} תגיות לפרומפט."
+        )
+        return ConversationHandler.END
+    
+    # הוספת התגית
+    existing_tags.append(tag)
+    await db.update_prompt(prompt_id, update.effective_user.id, {'tags': existing_tags})
+    
+    await message.reply_text(
+        f"✅ התגית <code>#{escape_html(tag)}</code> נוספה!",
+        parse_mode='HTML',
+        reply_markup=back_button(f"tags_{prompt_id}")
+    )
+    
+    context.user_data.clear()
+    return ConversationHandler.END
+
 async def receive_new_tag(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """קבלת תגית חדשה"""
+    """קבלת תגית חדשה; תגית שאינה קיימת אך דומה בתחילתה לקיימות – מציעה אותן קודם"""
     user = update.effective_user
     tag = update.message.text.strip().lower().replace('#', '')
     prompt_id = context.user_data.get('adding_tag_to')
@@ -90,41 +143,57 @@ async def receive_new_tag(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return WAITING_FOR_NEW_TAG
     
     # קבלת הפרומפט
-    prompt = db.get_prompt(prompt_id, user.id)
+    prompt = await db.get_prompt(prompt_id, user.id)
     
     if not prompt:
         await update.message.reply_text("⚠️ הפרומפט לא נמצא")
         return ConversationHandler.END
     
-    # בדיקה אם התגית כבר קיימת
-    existing_tags = prompt.get('tags', [])
-    
-    if tag in existing_tags:
+    # השלמה אוטומטית: תגית חדשה שהיא תחילתה של תגיות קיימות – כנראה התכוונו לאחת מהן
+    completions = await db.suggest_tags(user.id, tag, limit=config.TAG_SUGGESTIONS + 1,
+                                        exclude=prompt.get('tags', []))
+    if tag not in completions and completions and context.user_data.get(PENDING_TAG_KEY) != tag:
+        suggestions = completions[:config.TAG_SUGGESTIONS]
+        context.user_data[TAG_SUGGESTIONS_KEY] = suggestions
+        context.user_data[PENDING_TAG_KEY] = tag
         await update.message.reply_text(
-            f"⚠️ התגית <code>#{escape_html(tag)}</code> כבר קיימת!",
-            parse_mode='HTML'
+            f"🏷️ יש תגיות קיימות שמתחילות ב-<code>{escape_html(tag)}</code>.\n"
+            "בחר אחת מהן, או צור את התגית החדשה:",
+            parse_mode='HTML',
+            reply_markup=tag_suggestions_keyboard(suggestions, "picktag", new_tag=tag)
         )
         return WAITING_FOR_NEW_TAG
     
-    # בדיקת מגבלת תגיות
-    if len(existing_tags) >= config.MAX_TAGS:
-        await update.message.reply_text(
-            f"⚠️ הגעת למקסימום של {config.MAX_TAGS} תגיות לפרומפט."
+    return await _add_tag(update, context, prompt, tag)
+
+async def pick_suggested_tag(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """בחירת תגית מכפתורי ההשלמה (picktag_<i> / picktag_new)"""
+    query = update.callback_query
+    await query.answer()
+    
+    user = update.effective_user
+    prompt_id = context.user_data.get('adding_tag_to')
+    choice = query.data.replace('picktag_', '', 1)
+    suggestions = context.user_data.get(TAG_SUGGESTIONS_KEY) or []
+    if choice == 'new':
+        tag = context.user_data.get(PENDING_TAG_KEY)
+    else:
+        index = int(choice) if choice.isdigit() else -1
+        tag = suggestions[index] if 0 <= index < len(suggestions) else None
+    
+    if not prompt_id or not tag:
+        await query.edit_message_text(
+            "⚠️ ההצעה כבר אינה בתוקף.",
+            reply_markup=back_button(f"tags_{prompt_id}" if prompt_id else "back_main")
         )
         return ConversationHandler.END
     
-    # הוספת התגית
-    existing_tags.append(tag)
-    db.update_prompt(prompt_id, user.id, {'tags': existing_tags})
-    
-    await update.message.reply_text(
-        f"✅ התגית <code>#{escape_html(tag)}</code> נוספה!",
-        parse_mode='HTML',
-        reply_markup=back_button(f"tags_{prompt_id}")
-    )
+    prompt = await db.get_prompt(prompt_id, user.id)
+    if not prompt:
+        await query.edit_message_text("⚠️ הפרומפט לא נמצא")
+        return ConversationHandler.END
     
-    context.user_data.clear()
-    return ConversationHandler.END
+    return await _add_tag(update, context, prompt, tag)
 
 async def remove_tag(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """הסרת תגית"""
@@ -134,7 +203,7 @@ async def remove_tag(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     _, prompt_id, tag = query.data.split('_', 2)
     
-    prompt = db.get_prompt(prompt_id, user.id)
+    prompt = await db.get_prompt(prompt_id, user.id)
     
     if not prompt:
         await query.answer("⚠️ הפרומפט לא נמצא", show_alert=True)
@@ -145,7 +214,7 @@ async def remove_tag(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     if tag in existing_tags:
         existing_tags.remove(tag)
-        db.update_prompt(prompt_id, user.id, {'tags': existing_tags})
+        await db.update_prompt(prompt_id, user.id, {'tags': existing_tags})
         await query.answer(f"✅ התגית #{tag} הוסרה")
         
         # רענון התצוגה
@@ -0,0 +1,169 @@
+"""
+Index-usage audit: runs explain() on every query shape issued by Database and
+flags plans that fall back to a collection scan or an in-memory sort.
+
+Usage:
+    python index_audit.py [user_id]
+"""
+from __future__ import annotations
+
+import sys
+from datetime import datetime
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional
+
+from bson import ObjectId
+
+import config
+from database import Database, DatabaseBase
+from pagination import NEXT, Cursor, PageRequest
+
+# Stages that mean the query is not served by an index
+PROBLEM_STAGES = {
+    "COLLSCAN": "collection scan",
+    "SORT": "in-memory sort",
+}
+
+
+@dataclass
+class QueryShape:
+    name: str
+    collection: str
+    filter: Dict[str, Any] = field(default_factory=dict)
+    sort: Optional[List] = None
+    pipeline: Optional[List[Dict[str, Any]]] = None
+    # Admin-only lookups may legitimately scan (e.g. case-insensitive username regex)
+    admin_only: bool = False
+
+
+@dataclass
+class AuditResult:
+    shape: QueryShape
+    stages: List[str]
+    error: Optional[str] = None
+
+    @property
+    def problems(self) -> List[str]:
+        return [PROBLEM_STAGES[s] for s in self.stages if s in PROBLEM_STAGES]
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and not self.problems
+
+
+def query_shapes(user_id: int) -> List[QueryShape]:
+    """All query shapes Database/AsyncDatabase send to MongoDB, bound to a sample user."""
+    active = {"user_id": user_id, "is_deleted": False}
+    category_pipeline, tag_pipeline = DatabaseBase._user_stats_pipelines(user_id)
+    helpers = DatabaseBase()
+    page_shapes = []
+    for view, (field, _) in DatabaseBase.PAGE_VIEWS.items():
+        sample = 0 if field == "use_count" else datetime.utcnow()
+        request = PageRequest(1, NEXT, Cursor(sample, ObjectId()))
+        page_filter, page_sort, _ = helpers._page_query(user_id, view, request, category="Other")
+        page_shapes.append(QueryShape(f"get_prompt_page ({view}, keyset)", "prompts",
+                                      page_filter, page_sort))
+    return page_shapes + [
+        QueryShape("get_prompt (short_code)", "prompts",
+                   {"short_code": "ABCD", "user_id": user_id, "is_deleted": False}),
+        QueryShape("get_all_prompts", "prompts", active, DatabaseBase.SORT_NEWEST),
+        QueryShape("get_popular_prompts", "prompts", active, DatabaseBase.SORT_POPULAR),
+        QueryShape("get_favorites", "prompts",
+                   {**active, "is_favorite": True}, DatabaseBase.SORT_POPULAR),
+        QueryShape("get_trash", "prompts",
+                   {"user_id": user_id, "is_deleted": True}, DatabaseBase.SORT_RECENTLY_DELETED),
+        QueryShape("search_prompts (text, ranked)", "prompts", pipeline=DatabaseBase._text_rank_pipeline(
+            DatabaseBase._search_filter(user_id, query="prompt"), {"_id": 1},
+            limit=config.SEARCH_MAX_CANDIDATES)),
+        QueryShape("search_prompts (category)", "prompts",
+                   DatabaseBase._search_filter(user_id, category="Other"), DatabaseBase.SORT_NEWEST),
+        QueryShape("search_prompts (tags)", "prompts",
+                   DatabaseBase._search_filter(user_id, tags=["python", "bot"]), DatabaseBase.SORT_NEWEST),
+        QueryShape("count_prompts (category)", "prompts", {**active, "category": "Other"}),
+        QueryShape("count_prompts (favorites)", "prompts", {**active, "is_favorite": True}),
+        QueryShape("update/delete_user_category", "prompts",
+                   {"user_id": user_id, "category": "Other"}),
+        QueryShape("get_all_tags", "prompts", pipeline=[
+            {"$match": active},
+            {"$unwind": "$tags"},
+            {"$group": {"_id": "$tags", "count": {"$sum": 1}}},
+            {"$sort": {"count": -1}},
+        ]),
+        QueryShape("get_user_statistics (categories)", "prompts", pipeline=category_pipeline),
+        QueryShape("get_user_statistics (tags)", "prompts", pipeline=tag_pipeline),
+        QueryShape("get_user_summary", "stats", {"_id": user_id}),
+        QueryShape("get_user_statistics (summary + user)", "stats", pipeline=[
+            {"$match": {"_id": user_id}},
+            {"$lookup": {"from": "users", "localField": "_id",
+                         "foreignField": "user_id", "as": "user"}},
+        ]),
+        QueryShape("rebuild_user_summary", "prompts",
+                   pipeline=DatabaseBase._summary_rebuild_pipeline(user_id)),
+        QueryShape("cleanup_old_trash", "prompts",
+                   {"is_deleted": True, "deleted_at": {"$lt": DatabaseBase._trash_threshold()}}),
+        QueryShape("get_or_create_user", "users", {"user_id": user_id}),
+        QueryShape("find_user_by_identifier (username)", "users",
+                   {"username": {"$regex": "^someone$", "$options": "i"}}, admin_only=True),
+    ]
+
+
+def _collect_stages(node: Any) -> Iterable[str]:
+    """Walk an explain document and yield every plan stage name in the winning plan(s)."""
+    if isinstance(node, dict):
+        for key, value in node.items():
+            # rejectedPlans are alternatives the planner did not pick
+            if key == "rejectedPlans":
+                continue
+            if key == "stage" and isinstance(value, str):
+                yield value
+            else:
+                yield from _collect_stages(value)
+    elif isinstance(node, list):
+        for item in node:
+            yield from _collect_stages(item)
+
+
+def explain_shape(database: Database, shape: QueryShape) -> AuditResult:
+    collection = database.db[shape.collection]
+    try:
+        if shape.pipeline is not None:
+            explain = database.db.command(
+                "explain",
+                {"aggregate": shape.collection, "pipeline": shape.pipeline, "cursor": {}},
+                verbosity="queryPlanner",
+            )
+        else:
+            cursor = collection.find(shape.filter)
+            if shape.sort:
+                cursor = cursor.sort(shape.sort)
+            explain = cursor.limit(10).explain()
+    except Exception as exc:  # pragma: no cover - depends on server state
+        return AuditResult(shape=shape, stages=[], error=str(exc))
+    return AuditResult(shape=shape, stages=list(_collect_stages(explain.get("queryPlanner", explain))))
+
+
+def run_audit(user_id: int, database: Optional[Database] = None) -> List[AuditResult]:
+    if database is None:
+        from database import db as database
+    return [explain_shape(database, shape) for shape in query_shapes(user_id)]
+
+
+def format_report(results: List[AuditResult]) -> str:
+    lines = []
+    for result in results:
+        if result.error:
+            lines.append(f"⚠️ {result.shape.name}: {result.error}")
+        elif result.problems:
+            note = " (admin only)" if result.shape.admin_only else ""
+            lines.append(f"❌ {result.shape.name}{note}: {', '.join(result.problems)}")
+        else:
+            lines.append(f"✅ {result.shape.name}")
+    flagged = sum(1 for r in results if not r.ok and not r.shape.admin_only)
+    lines.append("")
+    lines.append(f"{len(results)} query shapes checked, {flagged} flagged")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    sample_user = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+    print(format_report(run_audit(sample_user)))
@@ -0,0 +1,141 @@
+"""
+In-process prompt cards for inline mode (`@bot query`).
+
+Telegram expects an inline answer within a few hundred milliseconds, and it
+sends a new query on nearly every keystroke. Each user therefore gets a warm
+in-memory set of "cards" – everything an `InlineQueryResultArticle` needs
+(title, content, tags, short code, favorite flag, use count) – with a prefix
+index over title words, tags and the short code:
+
+- A query is split into tokens (same normalization as search_engine.py);
+  every token must be a prefix of some word of the card. An exact short
+  code match comes first, then favorites, then the most used, then newest.
+- An empty query returns favorites followed by the most used prompts.
+
+Cards are loaded with one query on the user's first inline request and kept
+up to date by AsyncDatabase on save / edit / delete / restore / use
+(per_user_index.PerUserIndex, budgeted by the total number of cards).
+"""
+from __future__ import annotations
+
+import re
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from per_user_index import PerUserIndex
+from search_engine import normalize
+
+MAX_PREFIX = 12  # longer query tokens are looked up by their first MAX_PREFIX chars, then checked
+
+_TOKEN = re.compile(r"[^\W_]+", re.UNICODE)
+
+
+def _words(text: str) -> List[str]:
+    return _TOKEN.findall(normalize(text))
+
+
+class Card:
+    __slots__ = ("id", "title", "content", "tags", "short_code", "is_favorite",
+                 "use_count", "created_at", "words")
+
+    def __init__(self, doc: Dict[str, Any]) -> None:
+        self.id = doc["_id"]
+        self.title = doc.get("title") or ""
+        self.content = doc.get("content") or ""
+        self.tags = tuple(doc.get("tags") or ())
+        self.short_code = doc.get("short_code") or ""
+        self.is_favorite = bool(doc.get("is_favorite"))
+        self.use_count = int(doc.get("use_count") or 0)
+        self.created_at = doc.get("created_at") or datetime.min
+        words = _words(self.title)
+        for tag in self.tags:
+            words.extend(_words(tag))
+        if self.short_code:
+            words.append(self.short_code.lower())
+        self.words = frozenset(words)
+
+    def rank_key(self, code: str = ""):
+        return (bool(code) and self.short_code.lower() == code, self.is_favorite,
+                self.use_count, self.created_at)
+
+
+class UserCards:
+    """Cards of one user's active prompts with a word-prefix index."""
+
+    def __init__(self) -> None:
+        self.cards: Dict[Any, Card] = {}
+        self.prefixes: Dict[str, Set[Any]] = {}
+
+    def __len__(self) -> int:
+        return len(self.cards)
+
+    @staticmethod
+    def _prefixes(words: Iterable[str]) -> Set[str]:
+        return {word[:length] for word in words for length in range(1, min(len(word), MAX_PREFIX) + 1)}
+
+    def add(self, doc: Dict[str, Any]) -> None:
+        card = Card(doc)
+        self.remove(card.id)
+        self.cards[card.id] = card
+        for prefix in self._prefixes(card.words):
+            self.prefixes.setdefault(prefix, set()).add(card.id)
+
+    def remove(self, doc_id: Any) -> None:
+        card = self.cards.pop(doc_id, None)
+        if card is None:
+            return
+        for prefix in self._prefixes(card.words):
+            ids = self.prefixes.get(prefix)
+            if ids is not None:
+                ids.discard(doc_id)
+                if not ids:
+                    del self.prefixes[prefix]
+
+    def bump(self, doc_id: Any, amount: int = 1) -> bool:
+        card = self.cards.get(doc_id)
+        if card is None:
+            return False
+        card.use_count += amount
+        return True
+
+    def search(self, query: str, limit: int = 50) -> List[Card]:
+        tokens = _words(query)
+        if not tokens:
+            return self.featured(limit)
+        matched: Optional[Set[Any]] = None
+        for token in sorted(set(tokens), key=len, reverse=True):
+            ids = self.prefixes.get(token[:MAX_PREFIX], set())
+            matched = set(ids) if matched is None else matched & ids
+            if not matched:
+                return []
+        cards = [self.cards[doc_id] for doc_id in matched]
+        long_tokens = [token for token in tokens if len(token) > MAX_PREFIX]
+        if long_tokens:
+            cards = [
+                card for card in cards
+                if all(any(word.startswith(token) for word in card.words) for token in long_tokens)
+            ]
+        code = tokens[0] if len(tokens) == 1 else ""
+        cards.sort(key=lambda card: card.rank_key(code), reverse=True)
+        return cards[:limit]
+
+    def featured(self, limit: int = 50) -> List[Card]:
+        """Favorites, then the most used prompts."""
+        cards = sorted(self.cards.values(), key=lambda card: card.rank_key(), reverse=True)
+        return cards[:limit]
+
+
+def build_cards(docs: Iterable[Dict[str, Any]]) -> UserCards:
+    cards = UserCards()
+    for doc in docs:
+        cards.add(doc)
+    return cards
+
+
+class InlineIndex(PerUserIndex[UserCards]):
+    """Per-user cards under a total-cards budget."""
+
+    def bump(self, user_id: Any, doc_id: Any, amount: int = 1) -> None:
+        cards = self._users.get(user_id)
+        if cards is not None:
+            cards.bump(doc_id, amount)
@@ -5,6 +5,7 @@ from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 from typing import List, Dict, Optional
 from urllib.parse import quote_plus
 import config
+from pagination import NEXT, PREV, callback_data as page_callback
 
 
 def main_menu_keyboard():
@@ -89,43 +90,100 @@ def prompt_actions_keyboard(prompt_id: str, is_favorite: bool = False):
         [
             InlineKeyboardButton("📁 שנה קטגוריה", callback_data=f"chcat_{prompt_id}"),
             InlineKeyboardButton("🏷️ נהל תגיות", callback_data=f"tags_{prompt_id}")
-        ],
-        [
-            InlineKeyboardButton("« חזרה לרשימה", callback_data="my_prompts")
         ]
     ]
+    if config.ENABLE_SEARCH_ENGINE:
+        keyboard.append([
+            InlineKeyboardButton("🔗 פרומפטים דומים", callback_data=f"similar_{prompt_id}")
+        ])
+    keyboard.append([
+        InlineKeyboardButton("« חזרה לרשימה", callback_data="my_prompts")
+    ])
     return InlineKeyboardMarkup(keyboard)
 
-def pagination_keyboard(current_page: int, total_pages: int, prefix: str = "page"):
-    """מקלדת דפדוף"""
+def pagination_keyboard(current_page: int, total_pages: int, prefix: str = "page",
+                        prev_cursor: Optional[str] = None, next_cursor: Optional[str] = None,
+                        back_callback: str = "back_main"):
+    """מקלדת דפדוף לפי סמן (keyset) – הסמנים מקודדים ב-callback_data"""
     keyboard = []
     
     nav_buttons = []
     
-    if current_page > 0:
+    if current_page > 0 and prev_cursor:
         nav_buttons.append(InlineKeyboardButton(
             "« הקודם", 
-            callback_data=f"{prefix}_{current_page - 1}"
+            callback_data=page_callback(prefix, current_page - 1, PREV, prev_cursor)
         ))
     
     nav_buttons.append(InlineKeyboardButton(
-        f"{current_page + 1}/{total_pages}",
+        f"{current_page + 1}/{max(total_pages, 1)}",
         callback_data="noop"
     ))
     
-    if current_page < total_pages - 1:
+    if next_cursor:
         nav_buttons.append(InlineKeyboardButton(
             "הבא »",
-            callback_data=f"{prefix}_{current_page + 1}"
+            callback_data=page_callback(prefix, current_page + 1, NEXT, next_cursor)
         ))
     
     keyboard.append(nav_buttons)
     keyboard.append([
-        InlineKeyboardButton("« חזרה", callback_data="back_main")
+        InlineKeyboardButton("« חזרה", callback_data=back_callback)
     ])
     
     return InlineKeyboardMarkup(keyboard)
 
+def offset_pagination_keyboard(current_page: int, total_pages: int, prefix: str,
+                               back_callback: str = "back_main"):
+    """מקלדת דפדוף לפי מספר עמוד – לרשימות שמוחזקות בשרת (תוצאות חיפוש)"""
+    nav_buttons = []
+    if current_page > 0:
+        nav_buttons.append(InlineKeyboardButton(
+            "« הקודם",
+            callback_data=f"{prefix}_{current_page - 1}"
+        ))
+    nav_buttons.append(InlineKeyboardButton(
+        f"{current_page + 1}/{max(total_pages, 1)}",
+        callback_data="noop"
+    ))
+    if current_page + 1 < total_pages:
+        nav_buttons.append(InlineKeyboardButton(
+            "הבא »",
+            callback_data=f"{prefix}_{current_page + 1}"
+        ))
+    return InlineKeyboardMarkup([
+        nav_buttons,
+        [InlineKeyboardButton("« חזרה", callback_data=back_callback)]
+    ])
+
+def tag_suggestions_keyboard(suggestions: List[str], prefix: str, new_tag: Optional[str] = None,
+                             back_callback: Optional[str] = None):
+    """כפתורי השלמה לתגיות – callback לפי מיקום ברשימה (התגית עצמה עלולה לחרוג מ-64 בתים)"""
+    keyboard = []
+    row = []
+    for index, tag in enumerate(suggestions):
+        row.append(InlineKeyboardButton(f"#{tag}", callback_data=f"{prefix}_{index}"))
+        if len(row) == 2:
+            keyboard.append(row)
+            row = []
+    if row:
+        keyboard.append(row)
+    if new_tag:
+        keyboard.append([
+            InlineKeyboardButton(f"➕ תגית חדשה: #{new_tag}", callback_data=f"{prefix}_new")
+        ])
+    if back_callback:
+        keyboard.append([InlineKeyboardButton("« חזרה", callback_data=back_callback)])
+    return InlineKeyboardMarkup(keyboard)
+
+def near_duplicate_keyboard():
+    """פרומפט חדש שדומה לקיים – לשמור בכל זאת או לבטל"""
+    keyboard = [
+        [InlineKeyboardButton("💾 שמור בכל זאת", callback_data="dupsave_continue")],
+        [InlineKeyboardButton("❌ ביטול", callback_data="back_main")]
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
 def edit_menu_keyboard(prompt_id: str):
     """תפריט עריכה"""
     keyboard = [
@@ -0,0 +1,358 @@
+"""
+Schema migrations and background data migrations.
+
+Schema steps (indexes, index clean-ups) are versioned in SCHEMA_STEPS and
+recorded in the `schema_migrations` collection once applied, so each step runs
+exactly once per database and a boot with nothing pending costs a single read.
+
+Data migrations run in a daemon thread on the instance that holds the distributed
+lock, so startup never waits for them. Each migration walks the collection in
+`_id` order in small batches, writes with `bulk_write`, and stores the last
+processed `_id` in the `migration_checkpoints` collection so a restart resumes
+where the previous run stopped. A pause between batches caps the write rate on
+the primary.
+
+Usage:
+    python migrations.py             # apply pending schema steps, then run data migrations
+    python migrations.py --dry-run   # list pending steps without changing anything
+"""
+from __future__ import annotations
+
+import logging
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from pymongo import ASCENDING, TEXT, IndexModel, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure, PyMongoError
+
+import config
+from database import PROMPT_INDEXES, TEXT_INDEX_KEYS, TEXT_INDEX_NAME
+from near_duplicates import SIGNATURE_FIELD, signature
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINTS_COLLECTION = "migration_checkpoints"
+SCHEMA_COLLECTION = "schema_migrations"
+
+# Server error codes for "an index with this name/keys exists with other options"
+_INDEX_CONFLICT_CODES = {85, 86}
+
+
+# ====== schema steps ======
+
+@dataclass(frozen=True)
+class SchemaStep:
+    version: int
+    name: str
+    description: str
+    apply: Callable[["object"], None]
+
+
+def _build_indexes(collection, models: List[IndexModel]) -> None:
+    # One createIndexes command builds all models in a single collection scan.
+    # MongoDB 4.2+ uses the optimized build (exclusive lock only at start and
+    # end) and ignores `background`; older servers honour it.
+    for model in models:
+        model.document.setdefault("background", True)
+    collection.create_indexes(models)
+
+
+def _prompt_compound_indexes(database) -> None:
+    _build_indexes(database.prompts, [IndexModel(keys, name=name) for name, keys in PROMPT_INDEXES])
+
+
+def _user_scoped_text_index(database) -> None:
+    # A collection may have only one text index – drop the old unscoped one first
+    for index_name, info in database.prompts.index_information().items():
+        is_text = any(direction == TEXT for _, direction in info.get("key", []))
+        if is_text and index_name != TEXT_INDEX_NAME:
+            database.prompts.drop_index(index_name)
+    _build_indexes(database.prompts, [IndexModel(TEXT_INDEX_KEYS, name=TEXT_INDEX_NAME)])
+
+
+def _short_code_unique_index(database) -> None:
+    model = IndexModel(
+        [("user_id", ASCENDING), ("short_code", ASCENDING)],
+        unique=True,
+        name=database.SHORT_CODE_INDEX,
+        # documents without a valid short_code are not indexed
+        partialFilterExpression={"short_code": {"$type": "string"}},
+    )
+    try:
+        _build_indexes(database.prompts, [model])
+    except OperationFailure as exc:
+        if exc.code not in _INDEX_CONFLICT_CODES:
+            raise
+        # an older definition with different options – replaced once, here only
+        database.prompts.drop_index(database.SHORT_CODE_INDEX)
+        _build_indexes(database.prompts, [model])
+
+
+def _users_unique_index(database) -> None:
+    _build_indexes(database.users, [IndexModel([("user_id", ASCENDING)], unique=True)])
+
+
+def _drop_legacy_single_field_indexes(database) -> None:
+    # Superseded by the compound indexes of version 1
+    existing = database.prompts.index_information()
+    for name in ("user_id_1", "category_1", "tags_1", "created_at_-1", "is_deleted_1"):
+        if name in existing:
+            database.prompts.drop_index(name)
+
+
+SCHEMA_STEPS: List[SchemaStep] = [
+    SchemaStep(1, "prompt_compound_indexes", "compound prompt indexes (ESR order)",
+               _prompt_compound_indexes),
+    SchemaStep(2, "user_scoped_text_index", "text index with a user_id prefix",
+               _user_scoped_text_index),
+    SchemaStep(3, "uniq_short_code_per_user", "unique short code per user",
+               _short_code_unique_index),
+    SchemaStep(4, "users_user_id_unique", "unique users.user_id",
+               _users_unique_index),
+    SchemaStep(5, "drop_legacy_single_field_indexes", "drop the old single-field prompt indexes",
+               _drop_legacy_single_field_indexes),
+]
+
+
+def pending_schema_steps(database) -> List[SchemaStep]:
+    """Steps not yet recorded in schema_migrations (one read)."""
+    applied = {doc["_id"] for doc in database.db[SCHEMA_COLLECTION].find({}, {"_id": 1})}
+    return [step for step in SCHEMA_STEPS if step.version not in applied]
+
+
+def apply_schema_migrations(database, dry_run: bool = False) -> List[SchemaStep]:
+    """Apply pending steps in version order; returns the steps applied (or pending, for dry runs).
+
+    Call only from the instance holding the distributed lock, so two instances
+    never build the same index at once."""
+    pending = pending_schema_steps(database)
+    if dry_run:
+        return pending
+    for step in pending:
+        started = time.monotonic()
+        logger.warning("Applying schema step %s (%s)", step.version, step.name)
+        step.apply(database)
+        try:
+            database.db[SCHEMA_COLLECTION].insert_one({
+                "_id": step.version,
+                "name": step.name,
+                "applied_at": datetime.utcnow(),
+                "duration_ms": int((time.monotonic() - started) * 1000),
+            })
+        except DuplicateKeyError:
+            pass
+    return pending
+
+
+class BatchMigration:
+    """A resumable data migration over `prompts` in `_id` order; subclasses implement run_batch()."""
+
+    name = ""
+
+    def __init__(self, database, batch_size: int = None, pause_seconds: float = None):
+        self.database = database
+        self.prompts = database.prompts
+        self.checkpoints = database.db[CHECKPOINTS_COLLECTION]
+        self.batch_size = batch_size or config.MIGRATION_BATCH_SIZE
+        self.pause_seconds = config.MIGRATION_BATCH_PAUSE_SECONDS if pause_seconds is None else pause_seconds
+
+    # ----- checkpoint -----
+    def load_checkpoint(self) -> Dict:
+        return self.checkpoints.find_one({"_id": self.name}) or {"_id": self.name, "processed": 0}
+
+    def _save_checkpoint(self, last_id, processed: int, done: bool = False) -> None:
+        self.checkpoints.update_one(
+            {"_id": self.name},
+            {"$set": {
+                "last_id": last_id,
+                "processed": processed,
+                "done": done,
+                "updated_at": datetime.utcnow(),
+            }},
+            upsert=True,
+        )
+
+    # ----- work -----
+    def run_batch(self, after_id=None) -> Optional[Dict]:
+        """Process the next `batch_size` documents after `after_id`.
+        Returns {"last_id", "scanned", "updated"} or None when the collection is exhausted."""
+        raise NotImplementedError
+
+    def _next_ids(self, after_id, projection: Dict) -> List[Dict]:
+        # A plain _id range keeps every query bounded to batch_size index keys,
+        # however sparse the documents that still need work are.
+        query = {"_id": {"$gt": after_id}} if after_id is not None else {}
+        return list(
+            self.prompts.find(query, projection)
+            .sort("_id", ASCENDING)
+            .limit(self.batch_size)
+        )
+
+    def run(self, stop_event: Optional[threading.Event] = None) -> int:
+        """Run until done (or until `stop_event` is set); returns documents updated in this run."""
+        checkpoint = self.load_checkpoint()
+        if checkpoint.get("done"):
+            return 0
+        last_id = checkpoint.get("last_id")
+        processed = checkpoint.get("processed", 0)
+        updated_total = 0
+        while not (stop_event and stop_event.is_set()):
+            outcome = self.run_batch(last_id)
+            if outcome is None:
+                self._save_checkpoint(last_id, processed, done=True)
+                logger.info("Migration %s finished (%s updated in this run)", self.name, updated_total)
+                return updated_total
+            last_id = outcome["last_id"]
+            processed += outcome["scanned"]
+            updated_total += outcome["updated"]
+            self._save_checkpoint(last_id, processed)
+            if self.pause_seconds:
+                if stop_event:
+                    stop_event.wait(self.pause_seconds)
+                else:
+                    time.sleep(self.pause_seconds)
+        logger.info("Migration %s paused at %s", self.name, last_id)
+        return updated_total
+
+
+class ShortCodeBackfill(BatchMigration):
+    """Assign `short_code` to legacy prompts that were saved without one."""
+
+    name = "short_code_backfill"
+
+    @staticmethod
+    def _missing(doc: Dict) -> bool:
+        return not isinstance(doc.get("short_code"), str) or not doc.get("short_code")
+
+    def _assign(self, docs: List[Dict]) -> int:
+        """Set short codes for `docs`, lengthening only the ones that collide."""
+        pending = [(doc, iter(self.database.SHORT_CODE_LENGTHS)) for doc in docs]
+        assigned = 0
+        while pending:
+            batch = []
+            for doc, lengths in pending:
+                length = next(lengths, None)
+                if length is not None:
+                    batch.append((doc, lengths, self.database._generate_short_code(str(doc["_id"]), length)))
+            if not batch:
+                break
+            requests = [
+                # the filter keeps a code set concurrently by the bot untouched
+                UpdateOne(
+                    {"_id": doc["_id"], "$or": [
+                        {"short_code": {"$exists": False}}, {"short_code": None}, {"short_code": ""},
+                    ]},
+                    {"$set": {"short_code": code}},
+                )
+                for doc, _, code in batch
+            ]
+            failed = {}
+            try:
+                result = self.prompts.bulk_write(requests, ordered=False)
+                assigned += result.modified_count
+            except BulkWriteError as exc:
+                assigned += exc.details.get("nModified", 0)
+                failed = {error["index"]: error for error in exc.details.get("writeErrors", [])}
+            pending = [
+                (doc, lengths) for index, (doc, lengths, _) in enumerate(batch)
+                if failed.get(index, {}).get("code") == 11000
+            ]
+        return assigned
+
+    def run_batch(self, after_id=None) -> Optional[Dict]:
+        docs = self._next_ids(after_id, {"_id": 1, "user_id": 1, "short_code": 1})
+        if not docs:
+            return None
+        missing = [doc for doc in docs if self._missing(doc)]
+        return {
+            "last_id": docs[-1]["_id"],
+            "scanned": len(docs),
+            "updated": self._assign(missing) if missing else 0,
+        }
+
+
+class SignatureBackfill(BatchMigration):
+    """Compute the MinHash `content_signature` of prompts saved before near-duplicate detection."""
+
+    name = "content_signature_backfill"
+
+    def run_batch(self, after_id=None) -> Optional[Dict]:
+        docs = self._next_ids(after_id, {"_id": 1, SIGNATURE_FIELD: 1})
+        if not docs:
+            return None
+        missing = [doc["_id"] for doc in docs if SIGNATURE_FIELD not in doc]
+        updated = 0
+        if missing:
+            requests = []
+            for doc in self.prompts.find({"_id": {"$in": missing}}, {"content": 1}):
+                sig = signature(doc.get("content") or "")
+                if sig is not None:
+                    # the filter keeps a signature written concurrently by a content edit
+                    requests.append(UpdateOne({"_id": doc["_id"], SIGNATURE_FIELD: {"$exists": False}},
+                                              {"$set": {SIGNATURE_FIELD: sig}}))
+            if requests:
+                updated = self.prompts.bulk_write(requests, ordered=False).modified_count
+        return {"last_id": docs[-1]["_id"], "scanned": len(docs), "updated": updated}
+
+
+class MigrationRunner:
+    """Runs registered migrations one after another in a daemon thread."""
+
+    def __init__(self, database, migrations=None):
+        if migrations is None:
+            migrations = [ShortCodeBackfill(database)]
+            if config.ENABLE_NEAR_DUPLICATE_CHECK:
+                migrations.append(SignatureBackfill(database))
+        self.migrations = migrations
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="background-migrations", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self) -> None:
+        for migration in self.migrations:
+            if self._stop.is_set():
+                return
+            try:
+                migration.run(self._stop)
+            except PyMongoError as exc:
+                # the checkpoint is kept; the next start resumes from it
+                logger.warning("Migration %s failed: %s", migration.name, exc)
+
+
+def start_background_migrations(database) -> Optional[MigrationRunner]:
+    if not config.ENABLE_BACKGROUND_MIGRATIONS:
+        return None
+    runner = MigrationRunner(database)
+    runner.start()
+    return runner
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    from database import db
+    dry_run = "--dry-run" in sys.argv[1:]
+    steps = apply_schema_migrations(db, dry_run=dry_run)
+    print(("Pending" if dry_run else "Applied") + f" schema steps: {len(steps)}")
+    for step in steps:
+        print(f"  {step.version:>3}  {step.name} – {step.description}")
+    for migration in MigrationRunner(db).migrations:
+        if dry_run:
+            checkpoint = migration.load_checkpoint()
+            state = "done" if checkpoint.get("done") else f"pending (processed {checkpoint.get('processed', 0)})"
+            print(f"Data migration {migration.name}: {state}")
+        else:
+            migration.run()
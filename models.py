@@ -0,0 +1,65 @@
+"""
+Compact prompt models for list screens.
+
+List screens (my prompts, favorites, category, popular, trash, search
+results, similar prompts) render a truncated title, the category, a few tags
+and the /view_ code. They fetch only those fields (see
+DatabaseBase.LIST_VIEW_PROJECTIONS) and wrap each document in a
+`PromptSummary`: a `__slots__` object without a per-instance `__dict__` and
+without the up to 4000-char `content`.
+
+The detail, copy and edit flows keep loading the full document with
+get_prompt().
+"""
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+class PromptSummary:
+    __slots__ = ("id", "title", "category", "tags", "short_code", "is_favorite",
+                 "use_count", "created_at", "deleted_at")
+
+    def __init__(self, id: Any, title: str = "", category: str = "Other",
+                 tags: Tuple[str, ...] = (), short_code: str = "", is_favorite: bool = False,
+                 use_count: int = 0, created_at: Optional[datetime] = None,
+                 deleted_at: Optional[datetime] = None) -> None:
+        self.id = id
+        self.title = title
+        self.category = category
+        self.tags = tags
+        self.short_code = short_code
+        self.is_favorite = is_favorite
+        self.use_count = use_count
+        self.created_at = created_at
+        self.deleted_at = deleted_at
+
+    @classmethod
+    def from_doc(cls, doc: Dict[str, Any]) -> "PromptSummary":
+        return cls(
+            doc["_id"],
+            doc.get("title") or "",
+            doc.get("category") or "Other",
+            tuple(doc.get("tags") or ()),
+            doc.get("short_code") or "",
+            bool(doc.get("is_favorite")),
+            int(doc.get("use_count") or 0),
+            doc.get("created_at"),
+            doc.get("deleted_at"),
+        )
+
+    @property
+    def code(self) -> str:
+        """The /view_ code: the short code, or the _id for legacy prompts without one."""
+        return self.short_code or str(self.id)
+
+    def short_title(self, length: int = 40) -> str:
+        return self.title[:length] + "..." if len(self.title) > length else self.title
+
+    def __repr__(self) -> str:
+        return f"PromptSummary({self.code!r}, {self.title!r})"
+
+
+def summaries(docs: Iterable[Dict[str, Any]]) -> List[PromptSummary]:
+    return [PromptSummary.from_doc(doc) for doc in docs]
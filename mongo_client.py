@@ -0,0 +1,135 @@
+"""
+Shared, lazily created MongoDB clients: one motor pool for the handlers and a
+small pymongo pool for the lock, migrations and background threads.
+"""
+from __future__ import annotations
+
+import importlib.util
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# compressor name -> module pymongo needs for it (None = stdlib)
+_COMPRESSOR_MODULES = {
+    "zstd": "zstandard",
+    "snappy": "snappy",
+    "zlib": None,
+}
+
+_lock = threading.Lock()
+_clients: Dict[str, MongoClient] = {}
+_async_clients: Dict[str, Any] = {}
+
+
+def available_compressors(requested: Optional[List[str]] = None) -> List[str]:
+    """The requested compressors (in preference order) that can be used in this process."""
+    names = config.MONGO_COMPRESSORS if requested is None else requested
+    usable = []
+    for name in names:
+        if name not in _COMPRESSOR_MODULES:
+            logger.warning("Unknown MongoDB compressor %r ignored", name)
+            continue
+        module = _COMPRESSOR_MODULES[name]
+        if module is None or importlib.util.find_spec(module) is not None:
+            usable.append(name)
+    return usable
+
+
+def client_options(sync: bool = False) -> Dict[str, Any]:
+    """Keyword arguments for the motor client, or with `sync` for the (smaller) pymongo pool."""
+    max_pool = config.MONGO_SYNC_MAX_POOL_SIZE if sync else config.MONGO_MAX_POOL_SIZE
+    min_pool = min(config.MONGO_MIN_POOL_SIZE, 1) if sync else config.MONGO_MIN_POOL_SIZE
+    options: Dict[str, Any] = {
+        "maxPoolSize": max_pool,
+        "minPoolSize": min(min_pool, max_pool),
+        "maxIdleTimeMS": config.MONGO_MAX_IDLE_TIME_MS or None,
+        "serverSelectionTimeoutMS": config.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "connectTimeoutMS": config.MONGO_CONNECT_TIMEOUT_MS,
+        "appname": config.MONGO_APP_NAME,
+        "retryWrites": True,
+    }
+    compressors = available_compressors()
+    if compressors:
+        options["compressors"] = ",".join(compressors)
+        if "zlib" in compressors:
+            options["zlibCompressionLevel"] = config.MONGO_ZLIB_LEVEL
+    return options
+
+
+def get_client(uri: Optional[str] = None) -> MongoClient:
+    """The process-wide pymongo client for `uri` (default: MONGO_URI), created on first use."""
+    uri = uri or config.MONGO_URI
+    client = _clients.get(uri)
+    if client is not None:
+        return client
+    with _lock:
+        client = _clients.get(uri)
+        if client is None:
+            options = client_options(sync=True)
+            client = MongoClient(uri, **options)
+            _clients[uri] = client
+            _log_created("pymongo", options)
+    return client
+
+
+def _log_created(kind: str, options: Dict[str, Any]) -> None:
+    logger.info(
+        "MongoDB %s client created (appname=%s pool=%s-%s compressors=%s)",
+        kind, options["appname"], options["minPoolSize"], options["maxPoolSize"],
+        options.get("compressors", "none"),
+    )
+
+
+def get_async_client(uri: Optional[str] = None):
+    """The process-wide motor client for `uri` (default: MONGO_URI), created on first use."""
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    uri = uri or config.MONGO_URI
+    client = _async_clients.get(uri)
+    if client is None:
+        options = client_options()
+        client = AsyncIOMotorClient(uri, **options)
+        _async_clients[uri] = client
+        _log_created("motor", options)
+    return client
+
+
+def warm_up(client: Optional[MongoClient] = None) -> bool:
+    """Open the first connection now (a ping); the pool then grows to minPoolSize in the background.
+
+    Returns False (and logs) when the server cannot be reached, so callers decide
+    whether that is fatal."""
+    client = client or get_client()
+    try:
+        client.admin.command("ping")
+        return True
+    except PyMongoError as exc:
+        logger.warning("MongoDB warm-up ping failed: %s", exc)
+        return False
+
+
+async def warm_up_async(client=None) -> bool:
+    """Async counterpart of `warm_up` for the motor client."""
+    client = client or get_async_client()
+    try:
+        await client.admin.command("ping")
+        return True
+    except PyMongoError as exc:
+        logger.warning("MongoDB (motor) warm-up ping failed: %s", exc)
+        return False
+
+
+def close_clients() -> None:
+    """Close every client created by this module (tests / orderly shutdown)."""
+    with _lock:
+        for client in list(_clients.values()) + list(_async_clients.values()):
+            client.close()
+        _clients.clear()
+        _async_clients.clear()
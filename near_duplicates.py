@@ -0,0 +1,155 @@
+"""
+Near-duplicate detection for prompt content with MinHash and LSH.
+
+Users tend to save the same prompt again with small edits. Comparing a new
+prompt with every stored one would be linear in the library size (and would
+read every 4000-char document), so each prompt instead carries a compact
+MinHash signature of its content:
+
+- Shingles: word 3-grams of the normalized content (same normalization as
+  search_engine.py). Each shingle is hashed once to 64 bits, and each of the
+  NUM_PERM slots keeps the minimum of a universal hash (a*x + b) mod p over
+  all shingles. The share of equal slots estimates the Jaccard similarity of
+  two shingle sets.
+- Storage: the signature is packed into NUM_PERM * 4 bytes and persisted on
+  the prompt document (`content_signature`), so an index is rebuilt from a
+  projection of signatures without reading any content.
+- LSH: the signature is cut into BANDS bands of ROWS slots; two prompts are
+  candidates when at least one band is identical. With 16 bands of 4 rows a
+  pair at similarity 0.8 becomes a candidate with probability ~0.9999 and a
+  pair at 0.3 with ~0.12, so a lookup touches a handful of buckets instead of
+  the whole library. Candidates are then confirmed on the full signature.
+
+Signatures are loaded per user on first use and kept up to date by
+AsyncDatabase on save / edit / delete / restore (per_user_index.PerUserIndex,
+budgeted by the total number of signatures). Prompts saved before this
+module existed are signed by the background migration SignatureBackfill.
+"""
+from __future__ import annotations
+
+import hashlib
+import random
+import re
+import struct
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from per_user_index import PerUserIndex
+from search_engine import normalize
+
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 3
+SIGNATURE_FIELD = "content_signature"
+
+_MERSENNE = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_TOKEN = re.compile(r"[^\W_]+", re.UNICODE)
+_PACK = struct.Struct(f"<{NUM_PERM}I")
+_BAND_BYTES = ROWS * 4
+
+# fixed seed – stored signatures must stay comparable across restarts and instances
+_rng = random.Random(0x5EED)
+_PERMUTATIONS = tuple((_rng.randrange(1, _MERSENNE), _rng.randrange(0, _MERSENNE)) for _ in range(NUM_PERM))
+
+
+def _shingles(content: str) -> Set[bytes]:
+    words = _TOKEN.findall(normalize(content))
+    if len(words) < SHINGLE_SIZE:
+        return {" ".join(words).encode()} if words else set()
+    return {" ".join(words[i:i + SHINGLE_SIZE]).encode() for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def signature(content: str) -> Optional[bytes]:
+    """Packed MinHash signature of `content`; None for text without words."""
+    shingles = _shingles(content)
+    if not shingles:
+        return None
+    hashes = [int.from_bytes(hashlib.blake2b(shingle, digest_size=8).digest(), "little") for shingle in shingles]
+    return _PACK.pack(*(
+        min((a * value + b) % _MERSENNE for value in hashes) & _MAX_HASH
+        for a, b in _PERMUTATIONS
+    ))
+
+
+def similarity(first: bytes, second: bytes) -> float:
+    """Estimated Jaccard similarity of the shingle sets behind two signatures."""
+    equal = sum(1 for x, y in zip(_PACK.unpack(first), _PACK.unpack(second)) if x == y)
+    return equal / NUM_PERM
+
+
+def _bands(sig: bytes) -> List[Tuple[int, bytes]]:
+    return [(band, sig[band * _BAND_BYTES:(band + 1) * _BAND_BYTES]) for band in range(BANDS)]
+
+
+def _valid(sig: Any) -> bool:
+    return isinstance(sig, (bytes, bytearray)) and len(sig) == _PACK.size
+
+
+class Match(NamedTuple):
+    id: Any
+    short_code: str
+    title: str
+    similarity: float
+
+
+class UserSignatures:
+    """One user's signatures with their LSH buckets."""
+
+    def __init__(self) -> None:
+        self.entries: Dict[Any, Tuple[bytes, str, str]] = {}   # id -> (signature, short_code, title)
+        self.buckets: Dict[Tuple[int, bytes], Set[Any]] = {}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def add(self, doc: Dict[str, Any]) -> None:
+        doc_id = doc["_id"]
+        self.remove(doc_id)
+        sig = doc.get(SIGNATURE_FIELD)
+        if not _valid(sig):
+            return
+        sig = bytes(sig)
+        self.entries[doc_id] = (sig, doc.get("short_code") or str(doc_id), doc.get("title") or "")
+        for key in _bands(sig):
+            self.buckets.setdefault(key, set()).add(doc_id)
+
+    def remove(self, doc_id: Any) -> None:
+        entry = self.entries.pop(doc_id, None)
+        if entry is None:
+            return
+        for key in _bands(entry[0]):
+            ids = self.buckets.get(key)
+            if ids is not None:
+                ids.discard(doc_id)
+                if not ids:
+                    del self.buckets[key]
+
+    def query(self, sig: Optional[bytes], threshold: float, limit: int = 3,
+              exclude: Iterable[Any] = ()) -> List[Match]:
+        """Stored prompts whose estimated similarity to `sig` is at least `threshold`, most similar first."""
+        if not _valid(sig):
+            return []
+        candidates: Set[Any] = set()
+        for key in _bands(sig):
+            candidates |= self.buckets.get(key, set())
+        candidates.difference_update(exclude)
+        matches = []
+        for doc_id in candidates:
+            stored, short_code, title = self.entries[doc_id]
+            score = similarity(sig, stored)
+            if score >= threshold:
+                matches.append(Match(doc_id, short_code, title, score))
+        matches.sort(key=lambda match: match.similarity, reverse=True)
+        return matches[:limit]
+
+
+def build_signatures(docs: Iterable[Dict[str, Any]]) -> UserSignatures:
+    signatures = UserSignatures()
+    for doc in docs:
+        signatures.add(doc)
+    return signatures
+
+
+class NearDuplicateIndex(PerUserIndex[UserSignatures]):
+    """Per-user signature sets under a total-signatures budget."""
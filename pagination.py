@@ -0,0 +1,145 @@
+"""
+Keyset (cursor) pagination helpers.
+
+A page is addressed by the sort key of its boundary document – e.g.
+(created_at, _id) – instead of a skip offset, so MongoDB seeks straight to
+the page through the compound index no matter how deep the page is.
+
+Cursors are packed into a short opaque token that fits inside Telegram's
+64-byte callback_data limit together with the view prefix and page number.
+"""
+from __future__ import annotations
+
+import base64
+import struct
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from bson import ObjectId
+
+NEXT = "n"
+PREV = "p"
+
+_TAG_DATETIME = b"d"
+_TAG_INT = b"i"
+_TAG_NULL = b"z"
+
+
+class Cursor(NamedTuple):
+    value: Any
+    oid: ObjectId
+
+
+class PageRequest(NamedTuple):
+    page: int
+    direction: str
+    cursor: Optional[Cursor]
+
+
+def encode_cursor(value: Any, oid: ObjectId) -> str:
+    """Pack (sort value, _id) into an opaque url-safe token (28 chars)."""
+    if value is None:
+        tag, number = _TAG_NULL, 0
+    elif isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        # BSON dates have millisecond precision
+        tag, number = _TAG_DATETIME, int((value - datetime(1970, 1, 1)).total_seconds() * 1000)
+    else:
+        tag, number = _TAG_INT, int(value)
+    raw = tag + struct.pack(">q", number) + ObjectId(oid).binary
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> Optional[Cursor]:
+    """Reverse of encode_cursor; returns None for malformed tokens."""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+    except (ValueError, TypeError):
+        return None
+    if len(raw) != 21:
+        return None
+    tag, number, oid = raw[:1], struct.unpack(">q", raw[1:9])[0], ObjectId(raw[9:])
+    if tag == _TAG_NULL:
+        return Cursor(None, oid)
+    if tag == _TAG_DATETIME:
+        return Cursor(datetime(1970, 1, 1) + timedelta(milliseconds=number), oid)
+    if tag == _TAG_INT:
+        return Cursor(number, oid)
+    return None
+
+
+def cursor_for(doc: Dict[str, Any], field: str) -> str:
+    return encode_cursor(doc.get(field), doc["_id"])
+
+
+def keyset_filter(field: str, cursor: Cursor, direction: str) -> Dict[str, Any]:
+    """Filter selecting documents strictly after (NEXT) or before (PREV) the cursor
+    in descending (field, _id) order. Missing/null values sort last."""
+    value, oid = cursor
+    if direction == NEXT:
+        if value is None:
+            return {field: None, "_id": {"$lt": oid}}
+        return {"$or": [
+            {field: {"$lt": value}},
+            {field: value, "_id": {"$lt": oid}},
+            {field: None},
+        ]}
+    if value is None:
+        return {"$or": [
+            {field: {"$ne": None}},
+            {field: None, "_id": {"$gt": oid}},
+        ]}
+    return {"$or": [
+        {field: {"$gt": value}},
+        {field: value, "_id": {"$gt": oid}},
+    ]}
+
+
+def callback_data(prefix: str, page: int, direction: str, cursor: str) -> str:
+    return f"{prefix}_{page}_{direction}{cursor}"
+
+
+def parse_callback(data: Optional[str], prefix: str) -> PageRequest:
+    """Parse '<prefix>_<page>_<n|p><cursor>'. Anything else (including legacy
+    '<prefix>_<page>' buttons from old messages) falls back to the first page."""
+    first = PageRequest(0, NEXT, None)
+    if not data or not data.startswith(prefix + "_"):
+        return first
+    parts = data[len(prefix) + 1:].split("_", 1)
+    if len(parts) != 2 or not parts[0].isdigit() or len(parts[1]) < 2:
+        return first
+    direction, token = parts[1][0], parts[1][1:]
+    cursor = decode_cursor(token)
+    if direction not in (NEXT, PREV) or cursor is None:
+        return first
+    return PageRequest(int(parts[0]), direction, cursor)
+
+
+class Page(NamedTuple):
+    items: List[Dict[str, Any]]
+    prev_cursor: Optional[str]
+    next_cursor: Optional[str]
+
+
+def build_page(docs: List[Dict[str, Any]], field: str, limit: int,
+               request_direction: str, had_cursor: bool) -> Page:
+    """Turn a limit+1 fetch into a Page with boundary cursors.
+
+    PREV fetches run in ascending order and are reversed here so items are
+    always in display (descending) order.
+    """
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+    if request_direction == PREV:
+        docs.reverse()
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = had_cursor, has_more
+    if not docs:
+        return Page([], None, None)
+    return Page(
+        docs,
+        cursor_for(docs[0], field) if has_prev else None,
+        cursor_for(docs[-1], field) if has_next else None,
+    )
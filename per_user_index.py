@@ -0,0 +1,91 @@
+"""
+Per-user in-memory structures with LRU eviction under a total-size budget.
+
+Values are loaded from the database on a user's first use and then kept up
+to date incrementally. A write bumps the user's version while a load is in
+flight, and a load that raced a write is returned to its caller but not
+stored. Users are evicted least-recently-used once the summed size of all
+values exceeds the budget.
+"""
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Generic, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class PerUserIndex(Generic[T]):
+    def __init__(self, budget: int, size: Callable[[T], int] = len) -> None:
+        self.budget = max(1, int(budget))
+        self._size = size
+        self._users: "OrderedDict[Any, T]" = OrderedDict()
+        self._versions: Dict[Any, int] = {}
+        self.total = 0
+        self.builds = 0
+        self.evictions = 0
+
+    def get(self, user_id: Any) -> Optional[T]:
+        value = self._users.get(user_id)
+        if value is not None:
+            self._users.move_to_end(user_id)
+        return value
+
+    def begin_load(self, user_id: Any) -> int:
+        """Version to pass to store() after loading from the database."""
+        return self._versions.setdefault(user_id, 0)
+
+    def store(self, user_id: Any, value: T, version: int) -> T:
+        """Keep a loaded value unless a write happened since `version` was read."""
+        if self._versions.pop(user_id, None) == version:
+            self._discard(user_id)
+            self._users[user_id] = value
+            self.total += self._size(value)
+            self.builds += 1
+            self._evict(keep=user_id)
+        return value
+
+    def abort_load(self, user_id: Any) -> None:
+        self._versions.pop(user_id, None)
+
+    def drop(self, user_id: Any) -> None:
+        """Forget a user's value; a load in flight for them is not stored either."""
+        self._touch(user_id)
+        self._discard(user_id)
+
+    def _discard(self, user_id: Any) -> None:
+        value = self._users.pop(user_id, None)
+        if value is not None:
+            self.total -= self._size(value)
+
+    def _evict(self, keep: Any = None) -> None:
+        while self.total > self.budget and len(self._users) > 1:
+            user_id, value = next(iter(self._users.items()))
+            if user_id == keep:
+                break
+            del self._users[user_id]
+            self.total -= self._size(value)
+            self.evictions += 1
+
+    def _touch(self, user_id: Any) -> Optional[T]:
+        # versions are only tracked while a load is in flight
+        if user_id in self._versions:
+            self._versions[user_id] += 1
+        return self._users.get(user_id)
+
+    # ----- incremental updates (no-ops for users without a loaded value) -----
+    def update(self, user_id: Any, change: Callable[[T], None]) -> None:
+        """Apply `change` to the user's value in place and re-account its size."""
+        value = self._touch(user_id)
+        if value is None:
+            return
+        before = self._size(value)
+        change(value)
+        self.total += self._size(value) - before
+        self._evict(keep=user_id)
+
+    def add(self, user_id: Any, doc: Dict[str, Any]) -> None:
+        self.update(user_id, lambda value: value.add(doc))
+
+    def remove(self, user_id: Any, doc_id: Any) -> None:
+        self.update(user_id, lambda value: value.remove(doc_id))
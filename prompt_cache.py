@@ -0,0 +1,299 @@
+"""
+Two-tier read-through cache of prompt documents for get_prompt(): an in-process
+LRU with a TTL, optionally backed by Redis.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import bson
+
+logger = logging.getLogger(__name__)
+
+_OBJECT_ID = re.compile(r"[0-9a-fA-F]{24}")
+_SHORT_CODE = re.compile(r"[0-9A-F]{4,8}")
+
+
+# ====== L2 stores ======
+
+class MemoryStore:
+    """In-memory stand-in for RedisStore (same interface, TTLs included)."""
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic) -> None:
+        self._clock = clock
+        self._values: Dict[str, Tuple[Any, Optional[float]]] = {}
+
+    def _live(self, key: str) -> Any:
+        entry = self._values.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and self._clock() >= expires_at:
+            del self._values[key]
+            return None
+        return value
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return self._live(key)
+
+    async def set(self, key: str, value: bytes, ttl: int) -> None:
+        self._values[key] = (value, self._clock() + ttl if ttl else None)
+
+    async def delete(self, *keys: str) -> None:
+        for key in keys:
+            self._values.pop(key, None)
+
+    async def add_member(self, key: str, member: str, ttl: int) -> None:
+        members = self._live(key) or set()
+        members.add(member)
+        self._values[key] = (members, self._clock() + ttl if ttl else None)
+
+    async def pop_members(self, key: str) -> List[str]:
+        members = self._live(key) or set()
+        self._values.pop(key, None)
+        return list(members)
+
+    async def close(self) -> None:
+        self._values.clear()
+
+
+class RedisStore:
+    """L2 on Redis (redis.asyncio); the client connects lazily on first use."""
+
+    def __init__(self, url: str, timeout_seconds: float = 1.0) -> None:
+        import redis.asyncio as aioredis
+        self._client = aioredis.from_url(
+            url, socket_timeout=timeout_seconds, socket_connect_timeout=timeout_seconds,
+        )
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self._client.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: int) -> None:
+        await self._client.set(key, value, ex=ttl or None)
+
+    async def delete(self, *keys: str) -> None:
+        if keys:
+            await self._client.delete(*keys)
+
+    async def add_member(self, key: str, member: str, ttl: int) -> None:
+        async with self._client.pipeline(transaction=False) as pipe:
+            pipe.sadd(key, member)
+            if ttl:
+                pipe.expire(key, ttl)
+            await pipe.execute()
+
+    async def pop_members(self, key: str) -> List[str]:
+        async with self._client.pipeline(transaction=True) as pipe:
+            pipe.smembers(key)
+            pipe.delete(key)
+            members, _ = await pipe.execute()
+        return [member.decode() if isinstance(member, bytes) else member for member in members]
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+
+# ====== cache ======
+
+def _copy(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Callers get their own copy – the cached document is never handed out."""
+    copy = dict(doc)
+    if isinstance(copy.get("tags"), list):
+        copy["tags"] = list(copy["tags"])
+    return copy
+
+
+class PromptCache:
+    """Single-flight loads; writers invalidate, and a failing L2 is skipped for `retry_seconds`."""
+
+    def __init__(self, max_entries: int = 5000, ttl_seconds: float = 300,
+                 store: Any = None, store_ttl_seconds: int = 3600, retry_seconds: float = 30,
+                 key_prefix: str = "prompttracker:", clock: Callable[[], float] = time.monotonic) -> None:
+        self._max_entries = max(1, int(max_entries))
+        self._ttl = ttl_seconds
+        self._store = store
+        self._store_ttl = int(store_ttl_seconds)
+        self._retry_seconds = retry_seconds
+        self._prefix = key_prefix
+        self._clock = clock
+        self._docs: "OrderedDict[str, Tuple[Dict[str, Any], float]]" = OrderedDict()
+        self._codes: Dict[Tuple[int, str], str] = {}
+        self._by_user: Dict[int, Set[str]] = {}
+        self._inflight: Dict[Tuple[int, str], "asyncio.Future"] = {}
+        # every invalidation bumps the epoch; a load that saw another epoch is not stored
+        self._epoch = 0
+        self._store_down_until = 0.0
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+
+    # ----- keys -----
+    @staticmethod
+    def lookup_key(prompt_id: Any) -> Optional[str]:
+        """'id:<hex>' or 'code:<CODE>' for a valid identifier, else None."""
+        value = str(prompt_id or "").strip()
+        if _OBJECT_ID.fullmatch(value):
+            return f"id:{value.lower()}"
+        code = value.upper()
+        if _SHORT_CODE.fullmatch(code):
+            return f"code:{code}"
+        return None
+
+    def _doc_key(self, doc_id: str) -> str:
+        return f"{self._prefix}prompt:{doc_id}"
+
+    def _code_key(self, user_id: int, code: str) -> str:
+        return f"{self._prefix}code:{user_id}:{code}"
+
+    def _user_key(self, user_id: int) -> str:
+        return f"{self._prefix}user:{user_id}"
+
+    # ----- L1 -----
+    def _l1_get(self, doc_id: str, user_id: int) -> Optional[Dict[str, Any]]:
+        entry = self._docs.get(doc_id)
+        if entry is None:
+            return None
+        doc, stored_at = entry
+        if self._ttl and self._clock() - stored_at > self._ttl:
+            self._forget(doc_id)
+            return None
+        if doc.get("user_id") != user_id or doc.get("is_deleted"):
+            return None
+        self._docs.move_to_end(doc_id)
+        return doc
+
+    def _remember(self, doc: Dict[str, Any]) -> None:
+        doc_id = str(doc["_id"])
+        user_id = doc.get("user_id")
+        self._docs[doc_id] = (doc, self._clock())
+        self._docs.move_to_end(doc_id)
+        self._by_user.setdefault(user_id, set()).add(doc_id)
+        if doc.get("short_code"):
+            self._codes[(user_id, doc["short_code"])] = doc_id
+        while len(self._docs) > self._max_entries:
+            self._forget(next(iter(self._docs)))
+
+    def _forget(self, doc_id: str) -> None:
+        entry = self._docs.pop(doc_id, None)
+        if entry is None:
+            return
+        doc = entry[0]
+        user_id = doc.get("user_id")
+        self._codes.pop((user_id, doc.get("short_code")), None)
+        ids = self._by_user.get(user_id)
+        if ids is not None:
+            ids.discard(doc_id)
+            if not ids:
+                del self._by_user[user_id]
+
+    # ----- L2 (errors never escape) -----
+    async def _remote(self, operation: Callable[[], Awaitable[Any]]) -> Any:
+        if self._store is None or self._clock() < self._store_down_until:
+            return None
+        try:
+            return await operation()
+        except Exception as exc:
+            self._store_down_until = self._clock() + self._retry_seconds
+            logger.warning("Prompt cache L2 unavailable for %ss: %s", self._retry_seconds, exc)
+            return None
+
+    async def _remote_get(self, user_id: int, key: str) -> Optional[Dict[str, Any]]:
+        kind, value = key.split(":", 1)
+        doc_id = value
+        if kind == "code":
+            raw_id = await self._remote(lambda: self._store.get(self._code_key(user_id, value)))
+            if raw_id is None:
+                return None
+            doc_id = raw_id.decode() if isinstance(raw_id, bytes) else raw_id
+        raw = await self._remote(lambda: self._store.get(self._doc_key(doc_id)))
+        if raw is None:
+            return None
+        doc = bson.decode(raw)
+        if doc.get("user_id") != user_id or doc.get("is_deleted"):
+            return None
+        return doc
+
+    async def _remote_put(self, doc: Dict[str, Any], epoch: int) -> None:
+        doc_id, user_id = str(doc["_id"]), doc.get("user_id")
+        await self._remote(lambda: self._store.set(self._doc_key(doc_id), bson.encode(doc), self._store_ttl))
+        await self._remote(lambda: self._store.add_member(self._user_key(user_id), doc_id, self._store_ttl))
+        if doc.get("short_code"):
+            await self._remote(lambda: self._store.set(
+                self._code_key(user_id, doc["short_code"]), doc_id, self._store_ttl))
+        if self._epoch != epoch:
+            # invalidated while we were writing – do not leave the old copy behind
+            await self._remote(lambda: self._store.delete(self._doc_key(doc_id)))
+
+    # ----- public -----
+    async def get(self, user_id: int, prompt_id: Any,
+                  loader: Callable[[], Awaitable[Optional[Dict[str, Any]]]]) -> Optional[Dict[str, Any]]:
+        """The active prompt `prompt_id` (_id or short code) of `user_id`; `loader` reads MongoDB on a miss."""
+        key = self.lookup_key(prompt_id)
+        if key is None:
+            return await loader()
+        kind, value = key.split(":", 1)
+        doc_id = value if kind == "id" else self._codes.get((user_id, value))
+        doc = self._l1_get(doc_id, user_id) if doc_id else None
+        if doc is not None:
+            self.hits += 1
+            return _copy(doc)
+
+        flight = self._inflight.get((user_id, key))
+        if flight is None:
+            flight = asyncio.ensure_future(self._load(user_id, key, loader))
+            # marks an error as retrieved even when every waiter was cancelled
+            flight.add_done_callback(lambda task: task.cancelled() or task.exception())
+            self._inflight[(user_id, key)] = flight
+        # shield: a cancelled caller does not cancel the load other callers wait on
+        doc = await asyncio.shield(flight)
+        return _copy(doc) if doc is not None else None
+
+    async def _load(self, user_id: int, key: str,
+                    loader: Callable[[], Awaitable[Optional[Dict[str, Any]]]]) -> Optional[Dict[str, Any]]:
+        epoch = self._epoch
+        try:
+            doc = await self._remote_get(user_id, key)
+            if doc is not None:
+                self.store_hits += 1
+                if self._epoch == epoch:
+                    self._remember(doc)
+                return doc
+            self.misses += 1
+            doc = await loader()
+            if doc is not None and not doc.get("is_deleted") and self._epoch == epoch:
+                self._remember(doc)
+                await self._remote_put(doc, epoch)
+            return doc
+        finally:
+            self._inflight.pop((user_id, key), None)
+
+    async def bump(self, doc_id: Any, field: str, amount: int = 1) -> None:
+        """Add a counter delta to the cached copy; the shared copy is dropped rather than rewritten."""
+        entry = self._docs.get(str(doc_id))
+        if entry is not None:
+            doc = entry[0]
+            doc[field] = (doc.get(field) or 0) + amount
+        await self._remote(lambda: self._store.delete(self._doc_key(str(doc_id))))
+
+    async def invalidate(self, doc_id: Any) -> None:
+        self._epoch += 1
+        self._forget(str(doc_id))
+        await self._remote(lambda: self._store.delete(self._doc_key(str(doc_id))))
+
+    async def invalidate_user(self, user_id: int) -> None:
+        self._epoch += 1
+        for doc_id in list(self._by_user.get(user_id, ())):
+            self._forget(doc_id)
+        doc_ids = await self._remote(lambda: self._store.pop_members(self._user_key(user_id)))
+        if doc_ids:
+            await self._remote(lambda: self._store.delete(*(self._doc_key(doc_id) for doc_id in doc_ids)))
+
+    async def close(self) -> None:
+        if self._store is not None:
+            await self._remote(self._store.close)
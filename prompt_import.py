@@ -0,0 +1,358 @@
+"""
+Streaming parsers for bulk prompt import.
+
+Every parser takes a text stream and yields ParsedPrompt items one at a time,
+so memory stays bounded by the largest single record rather than the file:
+
+- JSON: a top-level array of objects/strings, or the array under
+  {"prompts": [...]}, is decoded element by element.
+- JSONL / NDJSON: one object (or string) per line.
+- CSV: header row with content/prompt/text, title, category, tags columns.
+- Markdown / plain text: every heading starts a prompt (heading = title);
+  without headings, prompts are separated by '---' lines.
+- ChatGPT `conversations.json` export: every user message becomes a prompt,
+  titled after its conversation.
+
+Any of these may be gzip-compressed (`.gz`, as written by /export).
+
+Validation (length, tag count) happens in `validate()` so callers can report
+what was skipped.
+"""
+from __future__ import annotations
+
+import csv
+import json
+import re
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, TextIO, Tuple
+
+import config
+
+CONTENT_FIELDS = ("content", "prompt", "text", "body")
+TITLE_FIELDS = ("title", "name")
+CATEGORY_FIELDS = ("category", "folder")
+TAG_FIELDS = ("tags", "labels")
+
+FORMAT_JSON = "json"
+FORMAT_JSONL = "jsonl"
+FORMAT_CSV = "csv"
+FORMAT_MARKDOWN = "markdown"
+FORMAT_CHATGPT = "chatgpt"
+
+_EXTENSIONS = {
+    ".json": FORMAT_JSON,
+    ".jsonl": FORMAT_JSONL,
+    ".ndjson": FORMAT_JSONL,
+    ".csv": FORMAT_CSV,
+    ".md": FORMAT_MARKDOWN,
+    ".markdown": FORMAT_MARKDOWN,
+    ".txt": FORMAT_MARKDOWN,
+}
+
+_CHUNK_SIZE = 64 * 1024
+_HEADING = re.compile(r"^#{1,6}\s+(.*?)\s*#*\s*$")
+_SEPARATOR = re.compile(r"^\s*(-{3,}|\*{3,}|_{3,})\s*$")
+_FENCE = re.compile(r"^\s*(```|~~~)")
+
+
+class ImportFormatError(ValueError):
+    """The uploaded file is not in a supported format."""
+
+
+class ParsedPrompt(NamedTuple):
+    content: str
+    title: Optional[str] = None
+    category: Optional[str] = None
+    tags: Tuple[str, ...] = ()
+
+
+class ImportStats:
+    def __init__(self):
+        self.parsed = 0
+        self.imported = 0
+        self.failed = 0
+        self.empty = 0
+        self.too_long = 0
+        self.duplicates = 0
+        self.tags_trimmed = 0
+
+    @property
+    def skipped(self) -> int:
+        return self.empty + self.too_long + self.duplicates
+
+
+def is_gzipped(filename: Optional[str]) -> bool:
+    return (filename or "").lower().endswith(".gz")
+
+
+def detect_format(filename: Optional[str]) -> Optional[str]:
+    name = (filename or "").lower()
+    if name.endswith(".gz"):
+        name = name[:-3]
+    if name.endswith("conversations.json"):
+        return FORMAT_CHATGPT
+    for extension, fmt in _EXTENSIONS.items():
+        if name.endswith(extension):
+            return fmt
+    return None
+
+
+def parse(stream: TextIO, fmt: str) -> Iterator[ParsedPrompt]:
+    """Yield prompts from `stream` in the given format."""
+    if fmt == FORMAT_JSONL:
+        return _parse_jsonl(stream)
+    if fmt == FORMAT_CSV:
+        return _parse_csv(stream)
+    if fmt == FORMAT_MARKDOWN:
+        return _parse_markdown(stream)
+    if fmt in (FORMAT_JSON, FORMAT_CHATGPT):
+        return _parse_json(stream)
+    raise ImportFormatError(f"unsupported format: {fmt}")
+
+
+def validate(prompt: ParsedPrompt, stats: ImportStats) -> Optional[ParsedPrompt]:
+    """Apply MAX_PROMPT_LENGTH / MAX_TAGS; returns None for prompts to skip."""
+    stats.parsed += 1
+    content = (prompt.content or "").strip()
+    if not content:
+        stats.empty += 1
+        return None
+    if len(content) > config.MAX_PROMPT_LENGTH:
+        stats.too_long += 1
+        return None
+    tags = prompt.tags
+    if len(tags) > config.MAX_TAGS:
+        stats.tags_trimmed += 1
+        tags = tags[:config.MAX_TAGS]
+    title = (prompt.title or "").strip()[:100] or None
+    return prompt._replace(content=content, title=title, tags=tags)
+
+
+# ====== records ======
+
+def _first(record: Dict[str, Any], fields: Iterable[str]) -> Any:
+    lowered = {str(key).strip().lower(): value for key, value in record.items()}
+    for field in fields:
+        value = lowered.get(field)
+        if value not in (None, ""):
+            return value
+    return None
+
+
+def _normalize_tags(value: Any) -> Tuple[str, ...]:
+    if value is None:
+        return ()
+    if isinstance(value, str):
+        value = re.split(r"[,;\s]+", value)
+    tags: List[str] = []
+    for tag in value:
+        tag = str(tag).strip().lstrip("#")
+        if tag and tag not in tags:
+            tags.append(tag)
+    return tuple(tags)
+
+
+def _from_record(record: Any) -> Optional[ParsedPrompt]:
+    if isinstance(record, str):
+        return ParsedPrompt(record)
+    if not isinstance(record, dict):
+        return None
+    content = _first(record, CONTENT_FIELDS)
+    if content is None:
+        return None
+    title = _first(record, TITLE_FIELDS)
+    category = _first(record, CATEGORY_FIELDS)
+    return ParsedPrompt(
+        content=str(content),
+        title=str(title) if title is not None else None,
+        category=str(category) if category is not None else None,
+        tags=_normalize_tags(_first(record, TAG_FIELDS)),
+    )
+
+
+def _is_chatgpt_conversation(record: Any) -> bool:
+    return isinstance(record, dict) and isinstance(record.get("mapping"), dict)
+
+
+def _from_conversation(conversation: Dict[str, Any]) -> Iterator[ParsedPrompt]:
+    """User messages of one ChatGPT conversation, in chronological order."""
+    title = conversation.get("title") or None
+    messages = []
+    for node in conversation["mapping"].values():
+        message = (node or {}).get("message") or {}
+        if ((message.get("author") or {}).get("role")) != "user":
+            continue
+        parts = (message.get("content") or {}).get("parts") or []
+        text = "\n".join(part for part in parts if isinstance(part, str)).strip()
+        if text:
+            messages.append((message.get("create_time") or 0, text))
+    messages.sort(key=lambda item: item[0])
+    for index, (_, text) in enumerate(messages, 1):
+        numbered = f"{title} ({index})" if title and len(messages) > 1 else title
+        yield ParsedPrompt(text, numbered, None, ("chatgpt",))
+
+
+def _expand(record: Any) -> Iterator[ParsedPrompt]:
+    if _is_chatgpt_conversation(record):
+        yield from _from_conversation(record)
+        return
+    prompt = _from_record(record)
+    if prompt is not None:
+        yield prompt
+
+
+# ====== formats ======
+
+def _parse_jsonl(stream: TextIO) -> Iterator[ParsedPrompt]:
+    for line_number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as exc:
+            raise ImportFormatError(f"invalid JSON on line {line_number}: {exc.msg}") from exc
+        yield from _expand(record)
+
+
+class _JsonStream:
+    """Reads one JSON value at a time from a text stream, in _CHUNK_SIZE chunks."""
+
+    def __init__(self, stream: TextIO):
+        self._stream = stream
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._position = 0
+        self._eof = False
+
+    def _fill(self) -> bool:
+        chunk = self._stream.read(_CHUNK_SIZE)
+        self._eof = not chunk
+        self._buffer, self._position = self._buffer[self._position:] + chunk, 0
+        return bool(chunk)
+
+    def peek(self, skip: str = " \t\r\n") -> str:
+        """The next character that is not in `skip`; "" at end of input."""
+        while True:
+            while self._position < len(self._buffer) and self._buffer[self._position] in skip:
+                self._position += 1
+            if self._position < len(self._buffer):
+                return self._buffer[self._position]
+            if self._eof or not self._fill():
+                return ""
+
+    def advance(self) -> None:
+        self._position += 1
+
+    def value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                record, end = self._decoder.raw_decode(self._buffer, self._position)
+            except json.JSONDecodeError as exc:
+                if self._eof or not self._fill():
+                    raise ImportFormatError(f"invalid JSON: {exc.msg}") from exc
+                # value continues in the next chunk
+                continue
+            if end == len(self._buffer) and not self._eof and self._fill():
+                # a number may continue in the next chunk
+                continue
+            self._position = end
+            return record
+
+
+def _parse_json(stream: TextIO) -> Iterator[ParsedPrompt]:
+    """Top-level array, or the array under {"prompts": [...]}: decoded one element at a time.
+    Any other top-level object is a single prompt."""
+    reader = _JsonStream(stream)
+    first = reader.peek(" \t\r\n\ufeff")
+    if first == "[":
+        yield from _json_array(reader)
+    elif first == "{":
+        yield from _json_object(reader)
+    elif first:
+        yield from _expand(reader.value())
+
+
+def _json_array(reader: _JsonStream) -> Iterator[ParsedPrompt]:
+    reader.advance()
+    while True:
+        char = reader.peek(" \t\r\n,")
+        if not char:
+            raise ImportFormatError("unexpected end of JSON array")
+        if char == "]":
+            reader.advance()
+            return
+        yield from _expand(reader.value())
+
+
+def _json_object(reader: _JsonStream) -> Iterator[ParsedPrompt]:
+    reader.advance()
+    record: Dict[str, Any] = {}
+    streamed = False
+    while True:
+        char = reader.peek(" \t\r\n,")
+        if not char:
+            raise ImportFormatError("unexpected end of JSON object")
+        if char == "}":
+            break
+        key = reader.value()
+        if not isinstance(key, str) or reader.peek() != ":":
+            raise ImportFormatError("invalid JSON: expected a key")
+        reader.advance()
+        if key == "prompts" and reader.peek() == "[":
+            yield from _json_array(reader)
+            streamed = True
+        else:
+            record[key] = reader.value()
+    if not streamed:
+        yield from _expand(record)
+
+
+def _parse_csv(stream: TextIO) -> Iterator[ParsedPrompt]:
+    reader = csv.reader(stream)
+    header = next(reader, None)
+    if header is None:
+        return
+    columns = [column.strip().lower() for column in header]
+    if not any(field in columns for field in CONTENT_FIELDS):
+        # no recognizable header – the first column is the prompt itself
+        if header and header[0].strip():
+            yield ParsedPrompt(header[0])
+        for row in reader:
+            if row and row[0].strip():
+                yield ParsedPrompt(row[0])
+        return
+    for row in reader:
+        prompt = _from_record(dict(zip(columns, row)))
+        if prompt is not None:
+            yield prompt
+
+
+def _parse_markdown(stream: TextIO) -> Iterator[ParsedPrompt]:
+    title: Optional[str] = None
+    lines: List[str] = []
+    in_fence = False
+
+    def flush() -> Optional[ParsedPrompt]:
+        content = "\n".join(lines).strip()
+        if content:
+            return ParsedPrompt(content, title)
+        return None
+
+    for raw_line in stream:
+        line = raw_line.rstrip("\r\n")
+        if _FENCE.match(line):
+            in_fence = not in_fence
+        if not in_fence:
+            heading = _HEADING.match(line)
+            if heading or _SEPARATOR.match(line):
+                prompt = flush()
+                if prompt:
+                    yield prompt
+                title = heading.group(1) if heading else None
+                lines = []
+                continue
+        lines.append(line)
+    prompt = flush()
+    if prompt:
+        yield prompt
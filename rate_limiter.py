@@ -0,0 +1,220 @@
+"""
+Outbound Bot API rate limiting: token buckets per chat and global, a priority
+queue (interactive before background) and RetryAfter handling.
+"""
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Tuple, Union
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+
+def _seconds(value: Union[int, float, timedelta]) -> float:
+    return value.total_seconds() if isinstance(value, timedelta) else float(value)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self._clock = clock
+        self._tokens = self.capacity
+        self._updated = clock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self) -> float:
+        """Seconds until a token is available (0 = now)."""
+        self._refill()
+        return 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+
+    def take(self) -> None:
+        self._refill()
+        self._tokens -= 1
+
+    def full(self) -> bool:
+        self._refill()
+        return self._tokens >= self.capacity
+
+
+class QueueStats:
+    """Waiting requests per priority, shared by all gates of one limiter."""
+
+    def __init__(self) -> None:
+        self.waiting = {priority: 0 for priority in PRIORITY_NAMES}
+        self.max_waiting = 0
+        self.delayed = 0
+
+    def enter(self, priority: int) -> None:
+        self.waiting[priority] += 1
+        self.delayed += 1
+        self.max_waiting = max(self.max_waiting, sum(self.waiting.values()))
+
+    def leave(self, priority: int) -> None:
+        self.waiting[priority] -= 1
+
+
+class _Gate:
+    """A token bucket with a priority queue of waiting requests in front of it."""
+
+    def __init__(self, bucket: TokenBucket, stats: QueueStats, clock: Callable[[], float]) -> None:
+        self.bucket = bucket
+        self.stats = stats
+        self.paused_until = 0.0
+        self._clock = clock
+        self._waiters: List[Tuple[int, int, "asyncio.Future[None]"]] = []
+        self._pump: Optional["asyncio.Task[None]"] = None
+
+    def _wait_time(self) -> float:
+        return max(self.paused_until - self._clock(), self.bucket.delay())
+
+    def pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, self._clock() + seconds)
+
+    async def acquire(self, priority: int, seq: int) -> None:
+        """Take a token, queueing by (priority, seq) while the bucket is empty or paused."""
+        if not self._waiters and self._wait_time() <= 0:
+            self.bucket.take()
+            return
+        future: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, seq, future))
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.create_task(self._run())
+        self.stats.enter(priority)
+        try:
+            # a cancelled caller cancels the future, and the pump skips it
+            await future
+        finally:
+            self.stats.leave(priority)
+
+    async def _run(self) -> None:
+        while self._waiters:
+            wait = self._wait_time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            self.bucket.take()
+            future.set_result(None)
+
+    def idle(self) -> bool:
+        return not self._waiters and self.paused_until <= self._clock() and self.bucket.full()
+
+    def close(self) -> None:
+        if self._pump is not None:
+            self._pump.cancel()
+        for _, _, future in self._waiters:
+            future.cancel()
+        self._waiters.clear()
+
+
+class PriorityRateLimiter(BaseRateLimiter[int]):
+    """Requests default to INTERACTIVE; bulk senders pass `rate_limit_args=BACKGROUND`."""
+
+    def __init__(self, global_per_second: float = 30, private_per_second: float = 1,
+                 private_burst: int = 3, group_per_minute: float = 20, max_retries: int = 2,
+                 max_chats: int = 10000, clock: Callable[[], float] = time.monotonic) -> None:
+        self._clock = clock
+        self.stats = QueueStats()
+        self._global = _Gate(TokenBucket(global_per_second, global_per_second, clock), self.stats, clock)
+        self._private_rate = private_per_second
+        self._private_burst = private_burst
+        self._group_rate = group_per_minute / 60.0
+        self._group_burst = max(1.0, group_per_minute / 20.0)
+        self._max_retries = max(0, int(max_retries))
+        self._max_chats = max(1, int(max_chats))
+        self._chats: "OrderedDict[Any, _Gate]" = OrderedDict()
+        self._seq = itertools.count()
+        self.retry_after_count = 0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        self._global.close()
+        for gate in self._chats.values():
+            gate.close()
+        self._chats.clear()
+
+    @staticmethod
+    def _is_group(chat_id: Any) -> bool:
+        # groups and channels have negative ids; "@channel" usernames are strings
+        return isinstance(chat_id, str) or chat_id < 0
+
+    def _chat_gate(self, chat_id: Any) -> _Gate:
+        gate = self._chats.get(chat_id)
+        if gate is not None:
+            self._chats.move_to_end(chat_id)
+            return gate
+        if len(self._chats) >= self._max_chats:
+            for key in [key for key, old in self._chats.items() if old.idle()]:
+                del self._chats[key]
+        if self._is_group(chat_id):
+            bucket = TokenBucket(self._group_rate, self._group_burst, self._clock)
+        else:
+            bucket = TokenBucket(self._private_rate, self._private_burst, self._clock)
+        gate = self._chats[chat_id] = _Gate(bucket, self.stats, self._clock)
+        return gate
+
+    def queue_depth(self) -> Dict[str, int]:
+        """Requests currently waiting for a token, per priority."""
+        return {name: self.stats.waiting[priority] for priority, name in PRIORITY_NAMES.items()}
+
+    def metrics(self) -> Dict[str, int]:
+        return {
+            **{f"queued_{name}": count for name, count in self.queue_depth().items()},
+            "max_queued": self.stats.max_waiting,
+            "delayed": self.stats.delayed,
+            "retry_after": self.retry_after_count,
+            "chats": len(self._chats),
+        }
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Any]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[int],
+    ) -> Any:
+        priority = BACKGROUND if rate_limit_args == BACKGROUND else INTERACTIVE
+        chat_id = data.get("chat_id")
+        seq = next(self._seq)
+        attempt = 0
+        while True:
+            chat_gate = self._chat_gate(chat_id) if chat_id is not None else None
+            if chat_gate is not None:
+                await chat_gate.acquire(priority, seq)
+            await self._global.acquire(priority, seq)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as exc:
+                delay = _seconds(exc.retry_after)
+                self.retry_after_count += 1
+                (chat_gate or self._global).pause(delay)
+                if attempt >= self._max_retries:
+                    raise
+                attempt += 1
+                logger.warning("Flood control on %s (chat %s): retrying in %.1fs (attempt %s/%s)",
+                               endpoint, chat_id, delay, attempt, self._max_retries)
@@ -0,0 +1,66 @@
+"""
+In-process cache of rendered prompt detail messages.
+
+The detail screen is shown on every /view_ command, "view" tap, cancelled
+delete and favorite toggle. Rendering it escapes the whole (up to
+4000-char) content, concatenates the message and rebuilds the action
+keyboard, although the result only changes when the prompt or the user's
+categories change.
+
+Entries are keyed by (prompt `_id`, `updated_at`, category version):
+
+- every edit (title, content, category, tags, favorite) goes through
+  update_prompt(), which sets `updated_at`, so an edited prompt misses;
+- the category version (CategorySnapshot.version) changes on any category
+  write, so a renamed category or a new emoji misses.
+
+The use count is the one shown field that changes without `updated_at`
+(uses are counted write-behind), so a message is stored in two parts around
+it and joined with the current count on a hit.
+
+Entries are bounded by count (LRU); an outdated entry is never read again
+and simply ages out.
+"""
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import Any, Hashable, NamedTuple, Optional
+
+
+class RenderedMessage(NamedTuple):
+    head: str         # text up to the use count
+    tail: str         # text after the use count
+    markup: Any       # InlineKeyboardMarkup (immutable, safe to share)
+
+    def text(self, use_count: Any) -> str:
+        return f"{self.head}{use_count}{self.tail}"
+
+
+class RenderCache:
+    def __init__(self, max_entries: int = 1000) -> None:
+        self._max_entries = max(1, int(max_entries))
+        self._entries: "OrderedDict[Hashable, RenderedMessage]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[RenderedMessage]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key: Hashable, message: RenderedMessage) -> RenderedMessage:
+        self._entries[key] = message
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+        return message
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,427 @@
+"""
+In-process per-user full-text search: BM25 with a Hebrew-aware analyzer,
+fuzzy title candidates and similar-prompt lookup.
+"""
+from __future__ import annotations
+
+import heapq
+import math
+import re
+import unicodedata
+from collections import Counter, OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+K1 = 1.2
+B = 0.75
+TITLE_WEIGHT = 2
+# score factor for a match on a derived form (prefix / suffix stripped) instead of the surface form
+DERIVED_FORM_WEIGHT = 0.85
+
+_TOKEN = re.compile(r"[^\W_]+", re.UNICODE)
+_NIQQUD = re.compile(r"[\u0591-\u05bd\u05bf\u05c1\u05c2\u05c4\u05c5\u05c7]")  # cantillation + vowel points
+_GERESH = re.compile(r"[\u05f3\u05f4]")
+_HEBREW = re.compile(r"[\u05d0-\u05ea]")
+_FINALS = str.maketrans({"ך": "כ", "ם": "מ", "ן": "נ", "ף": "פ", "ץ": "צ"})
+# ו, then ש, then one of ב/כ/ל/מ, then ה – e.g. "ושב", "וכשה" is not a valid order
+_HEBREW_PREFIX = re.compile(r"^(ו?)(ש?)([בכלמ]?)(ה?)")
+_MIN_STEM = 2
+# share of the query's trigrams a document must contain to become a fuzzy candidate
+TRIGRAM_MIN_OVERLAP = 0.3
+# "similar prompts": most distinctive source terms used, and the document frequency above which a term
+# is ignored (only once its posting list is longer than SIMILAR_MIN_SKIPPED_POSTING)
+SIMILAR_MAX_TERMS = 40
+SIMILAR_MAX_DF = 0.25
+SIMILAR_MIN_SKIPPED_POSTING = 100
+# share of the library that may be added / removed before the cached TF-IDF norms are recomputed
+NORM_REFRESH_DRIFT = 0.25
+
+STOPWORDS = frozenset({
+    # Hebrew (after final-letter folding)
+    "של", "את", "על", "עמ", "זה", "זו", "גמ", "או", "אמ", "כי", "לא", "יש", "אני", "אתה",
+    "הוא", "היא", "הממ", "הנ", "אנחנו", "כל", "מה", "מי", "איכ", "אשר", "כמו", "רק", "עוד",
+    # English
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "is", "it",
+    "of", "on", "or", "that", "the", "this", "to", "with", "you", "your",
+})
+
+
+# ====== analysis ======
+
+def normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    text = _NIQQUD.sub("", text)
+    text = _GERESH.sub("", text)
+    return text.translate(_FINALS)
+
+
+def tokenize(text: str) -> List[str]:
+    """Surface tokens of `text` (normalized, stopwords removed)."""
+    return [token for token in _TOKEN.findall(normalize(text)) if token not in STOPWORDS]
+
+
+def _hebrew_forms(token: str) -> Set[str]:
+    forms = {token}
+    prefix = _HEBREW_PREFIX.match(token).group(0)
+    # every shorter prefix of the matched sequence is a valid reading as well
+    for cut in range(1, len(prefix) + 1):
+        stem = token[cut:]
+        if len(stem) >= _MIN_STEM + 1:
+            forms.add(stem)
+    for form in list(forms):
+        if len(form) >= _MIN_STEM + 3 and form[-2:] in ("ימ", "ות"):
+            forms.add(form[:-2])
+        elif len(form) >= _MIN_STEM + 2 and form[-1] == "ה":
+            # feminine singular meets its plural: תמונה / תמונות -> תמונ
+            forms.add(form[:-1])
+    return forms
+
+
+def _english_stem(token: str) -> str:
+    if len(token) <= 3:
+        return token
+    if token.endswith("ies") and len(token) > 4:
+        return token[:-3] + "y"
+    if token.endswith("sses"):
+        return token[:-2]
+    if token.endswith("ing") and len(token) > 5:
+        return token[:-3]
+    if token.endswith("ed") and len(token) > 4:
+        return token[:-2]
+    if token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+@lru_cache(maxsize=65536)
+def forms(token: str) -> FrozenSet[str]:
+    """All index forms of a surface token (the token itself included)."""
+    if _HEBREW.search(token):
+        return frozenset(_hebrew_forms(token))
+    stem = _english_stem(token)
+    return frozenset((token, stem))
+
+
+def trigrams(token: str) -> Set[str]:
+    padded = f" {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+# ====== per-user index ======
+
+class TrigramIndex:
+    """Trigrams of title and tag tokens -> doc ids, plus the normalized fields for scoring."""
+
+    def __init__(self) -> None:
+        self.postings: Dict[str, Set[Any]] = {}
+        self.doc_grams: Dict[Any, FrozenSet[str]] = {}
+        self.fields: Dict[Any, Tuple[str, ...]] = {}
+
+    @staticmethod
+    def _fields(doc: Dict[str, Any]) -> Tuple[str, ...]:
+        values = [doc.get("title") or ""] + list(doc.get("tags") or [])
+        return tuple(normalize(value) for value in values if value)
+
+    def add(self, doc_id: Any, doc: Dict[str, Any]) -> int:
+        """Index title + tags of `doc`; returns the number of postings added."""
+        fields = self._fields(doc)
+        grams = frozenset(
+            gram
+            for field in fields
+            for token in _TOKEN.findall(field)
+            for gram in trigrams(token)
+        )
+        for gram in grams:
+            self.postings.setdefault(gram, set()).add(doc_id)
+        self.doc_grams[doc_id] = grams
+        self.fields[doc_id] = fields
+        return len(grams)
+
+    def remove(self, doc_id: Any) -> int:
+        grams = self.doc_grams.pop(doc_id, None)
+        self.fields.pop(doc_id, None)
+        if grams is None:
+            return 0
+        for gram in grams:
+            posting = self.postings.get(gram)
+            if posting is not None:
+                posting.discard(doc_id)
+                if not posting:
+                    del self.postings[gram]
+        return len(grams)
+
+    def candidates(self, query: str, limit: Optional[int] = None) -> List[Tuple[Any, Tuple[str, ...]]]:
+        """[(doc_id, fields)] sharing at least TRIGRAM_MIN_OVERLAP of the query trigrams, most shared first."""
+        grams = {gram for token in _TOKEN.findall(normalize(query)) for gram in trigrams(token)}
+        if not grams:
+            return []
+        shared: Counter = Counter()
+        for gram in grams:
+            shared.update(self.postings.get(gram, ()))
+        needed = max(1, math.ceil(len(grams) * TRIGRAM_MIN_OVERLAP))
+        ranked = [doc_id for doc_id, count in shared.most_common() if count >= needed]
+        if limit:
+            ranked = ranked[:limit]
+        return [(doc_id, self.fields[doc_id]) for doc_id in ranked]
+
+
+class UserIndex:
+    """Inverted index of one user's active prompts."""
+
+    def __init__(self) -> None:
+        self.postings: Dict[str, Dict[Any, float]] = {}
+        self.doc_terms: Dict[Any, Dict[str, float]] = {}
+        self.doc_length: Dict[Any, float] = {}
+        self.total_length = 0.0
+        self.size = 0  # number of (term, doc) postings – the memory budget unit
+        self._norms: Optional[Dict[Any, float]] = None  # BM25 length norms, reset on every change
+        # TF-IDF vector norms – kept per document, recomputed in full once the library drifts
+        self._vector_norms: Optional[Dict[Any, float]] = None
+        self._vector_norms_count = 0
+        self.fuzzy = TrigramIndex()
+
+    def __len__(self) -> int:
+        return len(self.doc_length)
+
+    @staticmethod
+    def _analyze(doc: Dict[str, Any]) -> Tuple[Dict[str, float], float]:
+        weights: Counter = Counter()
+        length = 0.0
+        for field, weight in (("title", TITLE_WEIGHT), ("content", 1)):
+            tokens = Counter(tokenize(doc.get(field) or ""))
+            for token, count in tokens.items():
+                length += weight * count
+                for form in forms(token):
+                    weights[form] += weight * count
+        return dict(weights), length
+
+    def add(self, doc: Dict[str, Any]) -> None:
+        """Index (or re-index) a prompt document; needs _id, title, content, tags."""
+        doc_id = doc["_id"]
+        self.remove(doc_id)
+        terms, length = self._analyze(doc)
+        for term, tf in terms.items():
+            self.postings.setdefault(term, {})[doc_id] = tf
+        self.doc_terms[doc_id] = terms
+        self.doc_length[doc_id] = length
+        self.total_length += length
+        self.size += len(terms) + self.fuzzy.add(doc_id, doc)
+        self._norms = None
+        if self._vector_norms is not None:
+            self._vector_norms[doc_id] = self._vector_norm(terms)
+
+    def remove(self, doc_id: Any) -> None:
+        terms = self.doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        self.size -= self.fuzzy.remove(doc_id)
+        for term in terms:
+            posting = self.postings.get(term)
+            if posting is not None:
+                posting.pop(doc_id, None)
+                if not posting:
+                    del self.postings[term]
+        self.total_length -= self.doc_length.pop(doc_id, 0.0)
+        self.size -= len(terms)
+        self._norms = None
+        if self._vector_norms is not None:
+            self._vector_norms.pop(doc_id, None)
+
+    def _length_norms(self) -> Dict[Any, float]:
+        if self._norms is None:
+            average = (self.total_length / len(self.doc_length)) or 1.0
+            self._norms = {
+                doc_id: K1 * (1 - B + B * length / average)
+                for doc_id, length in self.doc_length.items()
+            }
+        return self._norms
+
+    def search(self, query: str, limit: Optional[int] = None) -> List[Tuple[Any, float]]:
+        """[(doc_id, score)] best first. Every query token contributes its best-matching form."""
+        tokens = tokenize(query)
+        if not tokens or not self.doc_length:
+            return []
+        count = len(self.doc_length)
+        norms = self._length_norms()
+        scores: Dict[Any, float] = {}
+        for token in dict.fromkeys(tokens):
+            best: Dict[Any, float] = {}
+            for form in forms(token):
+                posting = self.postings.get(form)
+                if not posting:
+                    continue
+                idf = math.log(1 + (count - len(posting) + 0.5) / (len(posting) + 0.5))
+                weight = (1.0 if form == token else DERIVED_FORM_WEIGHT) * idf * (K1 + 1)
+                for doc_id, tf in posting.items():
+                    score = weight * tf / (tf + norms[doc_id])
+                    if score > best.get(doc_id, 0.0):
+                        best[doc_id] = score
+            for doc_id, score in best.items():
+                scores[doc_id] = scores.get(doc_id, 0.0) + score
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return ranked[:limit] if limit else ranked
+
+    def _idf(self, term: str) -> float:
+        return math.log((1 + len(self.doc_length)) / (1 + len(self.postings.get(term, ()))))
+
+    def _vector_norm(self, terms: Dict[str, float]) -> float:
+        return math.sqrt(sum(((1 + math.log(tf)) * self._idf(term)) ** 2 for term, tf in terms.items()))
+
+    def vector_norms_stale(self) -> bool:
+        if self._vector_norms is None:
+            return True
+        drift = abs(len(self.doc_length) - self._vector_norms_count)
+        return drift > NORM_REFRESH_DRIFT * max(1, self._vector_norms_count)
+
+    def refresh_vector_norms(self) -> None:
+        """Recompute every TF-IDF norm with the current document frequencies.
+
+        Safe to run in a worker thread: it reads snapshots of the postings and
+        document vectors (which are replaced, never mutated in place), and a
+        document added meanwhile gets its norm lazily in similar().
+        """
+        log, sqrt = math.log, math.sqrt
+        postings = list(self.postings.items())
+        docs = list(self.doc_terms.items())
+        total = 1 + len(docs)
+        idf = {term: log(total / (1 + len(posting))) for term, posting in postings}
+        self._vector_norms = {
+            doc_id: sqrt(sum(((1 + log(tf)) * idf.get(term, 0.0)) ** 2 for term, tf in terms.items()))
+            for doc_id, terms in docs
+        }
+        self._vector_norms_count = len(docs)
+
+    def similar(self, doc_id: Any, limit: int = 5) -> List[Tuple[Any, float]]:
+        """[(doc_id, score)] of the prompts most similar to `doc_id`, best first.
+        The score is a lower bound on the TF-IDF cosine (pruned terms, full norms)."""
+        terms = self.doc_terms.get(doc_id)
+        if not terms:
+            return []
+        if self._vector_norms is None:
+            self.refresh_vector_norms()
+        count = len(self.doc_length)
+        norms = self._vector_norms
+        source_norm = self._norm_of(doc_id)
+        if not source_norm:
+            return []
+
+        max_df = max(SIMILAR_MIN_SKIPPED_POSTING, SIMILAR_MAX_DF * count)
+        weighted = []
+        for term, tf in terms.items():
+            if len(self.postings[term]) <= max_df:
+                idf = self._idf(term)
+                weighted.append((term, (1 + math.log(tf)) * idf, idf))
+        scores: Dict[Any, float] = {}
+        for term, weight, idf in heapq.nlargest(SIMILAR_MAX_TERMS, weighted, key=lambda item: item[1]):
+            for other, tf in self.postings[term].items():
+                scores[other] = scores.get(other, 0.0) + weight * (1 + math.log(tf)) * idf
+        scores.pop(doc_id, None)
+        ranked = []
+        for other, score in scores.items():
+            norm = norms.get(other) or self._norm_of(other)
+            if score > 0 and norm:
+                ranked.append((other, score / (source_norm * norm)))
+        return heapq.nlargest(limit, ranked, key=lambda item: item[1])
+
+    def _norm_of(self, doc_id: Any) -> float:
+        norm = self._vector_norms.get(doc_id)
+        if norm is None and doc_id in self.doc_terms:
+            norm = self._vector_norms[doc_id] = self._vector_norm(self.doc_terms[doc_id])
+        return norm or 0.0
+
+    def fuzzy_candidates(self, query: str, limit: Optional[int] = None) -> List[Tuple[Any, Tuple[str, ...]]]:
+        return self.fuzzy.candidates(query, limit)
+
+
+def build_index(docs: Iterable[Dict[str, Any]]) -> UserIndex:
+    index = UserIndex()
+    for doc in docs:
+        index.add(doc)
+    index.refresh_vector_norms()
+    return index
+
+
+# ====== registry ======
+
+class SearchEngine:
+    """Per-user indexes with LRU eviction under a postings budget.
+
+    Writes that arrive while a user's index is being built are queued and
+    replayed once the build lands, so a prompt saved mid-build is not lost.
+    """
+
+    def __init__(self, max_postings: int = 500_000) -> None:
+        self.max_postings = max(1, int(max_postings))
+        self._indexes: "OrderedDict[Any, UserIndex]" = OrderedDict()
+        self._building: Dict[Any, List[Tuple[str, Any]]] = {}
+        self.total_postings = 0
+        self.builds = 0
+        self.evictions = 0
+
+    def get(self, user_id: Any) -> Optional[UserIndex]:
+        index = self._indexes.get(user_id)
+        if index is not None:
+            self._indexes.move_to_end(user_id)
+        return index
+
+    def begin_load(self, user_id: Any) -> int:
+        """Start queueing the user's writes; store() replays them on the built index."""
+        self._building.setdefault(user_id, [])
+        return 0
+
+    def store(self, user_id: Any, index: UserIndex, version: int = 0) -> UserIndex:
+        for op, value in self._building.pop(user_id, []):
+            if op == "add":
+                index.add(value)
+            else:
+                index.remove(value)
+        self.drop(user_id)
+        self._indexes[user_id] = index
+        self.total_postings += index.size
+        self.builds += 1
+        self._evict(keep=user_id)
+        return index
+
+    def abort_load(self, user_id: Any) -> None:
+        self._building.pop(user_id, None)
+
+    def drop(self, user_id: Any) -> None:
+        index = self._indexes.pop(user_id, None)
+        if index is not None:
+            self.total_postings -= index.size
+
+    def clear(self) -> None:
+        self._indexes.clear()
+        self._building.clear()
+        self.total_postings = 0
+
+    def _evict(self, keep: Any = None) -> None:
+        while self.total_postings > self.max_postings and len(self._indexes) > 1:
+            user_id, index = next(iter(self._indexes.items()))
+            if user_id == keep:
+                break
+            del self._indexes[user_id]
+            self.total_postings -= index.size
+            self.evictions += 1
+
+    # ----- incremental updates (no-ops for users without a loaded index) -----
+    def add(self, user_id: Any, doc: Dict[str, Any]) -> None:
+        if user_id in self._building:
+            self._building[user_id].append(("add", doc))
+        index = self._indexes.get(user_id)
+        if index is None:
+            return
+        before = index.size
+        index.add(doc)
+        self.total_postings += index.size - before
+        self._evict(keep=user_id)
+
+    def remove(self, user_id: Any, doc_id: Any) -> None:
+        if user_id in self._building:
+            self._building[user_id].append(("remove", doc_id))
+        index = self._indexes.get(user_id)
+        if index is None:
+            return
+        before = index.size
+        index.remove(doc_id)
+        self.total_postings += index.size - before
@@ -0,0 +1,76 @@
+"""
+In-process cache of ranked search result sets.
+
+A search ranks every match once and keeps only the ordered list of `_id`s,
+keyed by (user, query, mode, filters). Paging through the results then
+slices that list and fetches one page by `_id` instead of re-running the
+text query (or the BM25 / fuzzy ranking) for every page.
+
+Entries are bounded by count (LRU) and age (TTL). Any write to a user's
+prompts drops all of that user's entries through `invalidate()`, so a saved
+or deleted prompt shows up in the next search. Usage counts and recency are
+part of the ranking but do not invalidate – they are refreshed by the TTL.
+"""
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, NamedTuple, Optional, Sequence, Set, Tuple
+
+
+class SearchResults(NamedTuple):
+    ids: Tuple[Any, ...]
+    fuzzy: bool              # the ids come from the typo-tolerant search
+    created_at: float
+
+
+class SearchResultCache:
+    def __init__(self, max_entries: int = 5000, ttl_seconds: float = 600,
+                 clock: Callable[[], float] = time.monotonic):
+        self._max_entries = max(1, max_entries)
+        self._ttl = ttl_seconds
+        self._clock = clock
+        self._entries: "OrderedDict[Tuple[int, Hashable], SearchResults]" = OrderedDict()
+        self._by_user: Dict[int, Set[Hashable]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int, key: Hashable) -> Optional[SearchResults]:
+        entry = self._entries.get((user_id, key))
+        if entry is None:
+            self.misses += 1
+            return None
+        if self._ttl and self._clock() - entry.created_at > self._ttl:
+            self._discard(user_id, key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end((user_id, key))
+        self.hits += 1
+        return entry
+
+    def put(self, user_id: int, key: Hashable, ids: Sequence[Any],
+            fuzzy: bool = False) -> SearchResults:
+        entry = SearchResults(tuple(ids), fuzzy, self._clock())
+        self._entries[(user_id, key)] = entry
+        self._entries.move_to_end((user_id, key))
+        self._by_user.setdefault(user_id, set()).add(key)
+        while len(self._entries) > self._max_entries:
+            (old_user, old_key), _ = next(iter(self._entries.items()))
+            self._discard(old_user, old_key)
+        return entry
+
+    def invalidate(self, user_id: int) -> None:
+        for key in self._by_user.pop(user_id, ()):
+            self._entries.pop((user_id, key), None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._by_user.clear()
+
+    def _discard(self, user_id: int, key: Hashable) -> None:
+        self._entries.pop((user_id, key), None)
+        keys = self._by_user.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_user[user_id]
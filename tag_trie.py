@@ -0,0 +1,130 @@
+"""
+Per-user prefix tries of tags with usage counts, for tag autocomplete.
+
+Adding a tag used to be typed blind, which produced near-duplicates
+("prompt", "prompts", "promts"), and listing tags meant aggregating the
+prompts collection. Each user now gets a small trie keyed by the lower-cased
+tag, where every tag node holds the number of active prompts carrying it:
+
+- `complete(prefix)` walks to the prefix node and returns the most used tags
+  below it; `top()` is the same with an empty prefix.
+- Counts come from the user's summary document (user-level counters kept by
+  AsyncDatabase) on first use, and are then updated with the same `tags.*`
+  deltas that AsyncDatabase applies to the summary, so the trie never reads
+  the prompts collection.
+
+Tries are kept per user by per_user_index.PerUserIndex, budgeted by the
+number of users.
+"""
+from __future__ import annotations
+
+import heapq
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+
+from per_user_index import PerUserIndex
+
+
+class _Node:
+    __slots__ = ("children", "tag", "count")
+
+    def __init__(self) -> None:
+        self.children: Dict[str, "_Node"] = {}
+        self.tag: Optional[str] = None
+        self.count = 0
+
+
+class TagTrie:
+    def __init__(self, counts: Iterable[Tuple[str, int]] = ()) -> None:
+        self._root = _Node()
+        self._size = 0
+        for tag, count in counts:
+            self.add(tag, count)
+
+    def __len__(self) -> int:
+        return self._size
+
+    @staticmethod
+    def _key(tag: str) -> str:
+        return (tag or "").strip().lower()
+
+    def add(self, tag: str, delta: int = 1) -> None:
+        """Change a tag's count by `delta`; tags that drop to zero are removed."""
+        key = self._key(tag)
+        if not key or not delta:
+            return
+        path = [self._root]
+        node = self._root
+        for char in key:
+            child = node.children.get(char)
+            if child is None:
+                if delta < 0:
+                    return
+                child = node.children[char] = _Node()
+            node = child
+            path.append(node)
+        if node.tag is None:
+            if delta < 0:
+                return
+            node.tag = tag
+            self._size += 1
+        node.count += delta
+        if node.count > 0:
+            return
+        # prune the emptied tag and every node that no longer leads anywhere
+        node.tag, node.count = None, 0
+        self._size -= 1
+        for index in range(len(key), 0, -1):
+            child = path[index]
+            if child.children or child.tag is not None:
+                break
+            del path[index - 1].children[key[index - 1]]
+
+    def count(self, tag: str) -> int:
+        node = self._find(self._key(tag))
+        return node.count if node is not None and node.tag is not None else 0
+
+    def _find(self, key: str) -> Optional[_Node]:
+        node = self._root
+        for char in key:
+            node = node.children.get(char)
+            if node is None:
+                return None
+        return node
+
+    def complete(self, prefix: str = "", limit: int = 6,
+                 exclude: Iterable[str] = ()) -> List[Tuple[str, int]]:
+        """[(tag, count)] under `prefix`, most used first (ties alphabetical)."""
+        start = self._find(self._key(prefix))
+        if start is None:
+            return []
+        excluded = {self._key(tag) for tag in exclude}
+        found = []
+        stack = [start]
+        while stack:
+            node = stack.pop()
+            if node.tag is not None and self._key(node.tag) not in excluded:
+                found.append((node.tag, node.count))
+            stack.extend(node.children.values())
+        key = lambda item: (-item[1], item[0])
+        return heapq.nsmallest(limit, found, key=key) if limit else sorted(found, key=key)
+
+    def top(self, limit: int = 6, exclude: Iterable[str] = ()) -> List[Tuple[str, int]]:
+        return self.complete("", limit, exclude)
+
+
+class TagTrieCache(PerUserIndex[TagTrie]):
+    """Per-user tries, at most `max_users` of them."""
+
+    def __init__(self, max_users: int = 10000) -> None:
+        super().__init__(max_users, size=lambda trie: 1)
+
+    def apply(self, user_id: Any, deltas: Mapping[str, int]) -> None:
+        """Apply {tag: delta} to a loaded trie (no-op for users without one)."""
+        if not deltas:
+            return
+
+        def change(trie: TagTrie) -> None:
+            for tag, delta in deltas.items():
+                trie.add(tag, delta)
+
+        self.update(user_id, change)
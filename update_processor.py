@@ -0,0 +1,82 @@
+"""
+Concurrent update processing with per-user ordering.
+
+Updates from different users run in parallel (bounded by a global limit),
+while updates from the same user are processed strictly in arrival order so
+ConversationHandler flows never observe reordered messages.
+"""
+from __future__ import annotations
+
+import asyncio
+from typing import Any, Awaitable, Dict, Hashable, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Run updates concurrently across users, sequentially within a user.
+
+    The per-user lock is taken *before* the global concurrency slot, so a user
+    who floods the bot waits in their own queue instead of occupying slots that
+    other users need.
+    """
+
+    def __init__(self, max_concurrent_updates: int) -> None:
+        super().__init__(max_concurrent_updates)
+        self._global_slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._key_locks: Dict[Hashable, asyncio.Lock] = {}
+        self._key_waiters: Dict[Hashable, int] = {}
+
+    @staticmethod
+    def _ordering_key(update: object) -> Optional[Hashable]:
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user:
+            return ("user", update.effective_user.id)
+        if update.effective_chat:
+            return ("chat", update.effective_chat.id)
+        return None
+
+    async def process_update(self, update: object, coroutine: Awaitable[Any]) -> None:  # type: ignore[misc]
+        # Overrides the base implementation on purpose: the base class takes the
+        # global semaphore first, which would let one user's queued updates hold
+        # every slot while they wait for each other.
+        key = self._ordering_key(update)
+        if key is None:
+            async with self._global_slots:
+                await self.do_process_update(update, coroutine)
+            return
+
+        lock = self._key_locks.get(key)
+        if lock is None:
+            lock = self._key_locks[key] = asyncio.Lock()
+        self._key_waiters[key] = self._key_waiters.get(key, 0) + 1
+        try:
+            # asyncio.Lock wakes waiters FIFO, and tasks reach this point in
+            # the order the Application created them (arrival order).
+            async with lock:
+                async with self._global_slots:
+                    await self.do_process_update(update, coroutine)
+        finally:
+            remaining = self._key_waiters[key] - 1
+            if remaining:
+                self._key_waiters[key] = remaining
+            else:
+                # Nobody else queued for this user – drop the lock to keep memory bounded
+                del self._key_waiters[key]
+                self._key_locks.pop(key, None)
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    @property
+    def active_users(self) -> int:
+        """Number of users with an update currently running or queued."""
+        return len(self._key_locks)
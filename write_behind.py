@@ -0,0 +1,189 @@
+"""
+Write-behind buffer for `$inc` counters.
+
+Counters that only ever grow or shrink by a delta (prompt `use_count`, the
+per-user `stats.*` counters) do not need a primary write per event. The
+buffer coalesces the deltas in memory per document and writes them out as
+one unordered `bulk_write` per collection:
+
+- every `flush_interval` seconds, from a daemon thread;
+- immediately when `max_pending` distinct documents are waiting;
+- on shutdown – `stop()` is hooked into the bot's post_shutdown, into the
+  distributed lock's release (which also runs from its SIGTERM handler and
+  atexit), so a normal stop or a SIGTERM loses nothing.
+
+Once stopped, the buffer refuses new deltas: `increment()` returns False and
+the caller writes its `$inc` directly, so handlers that are still running
+during shutdown lose nothing either.
+
+`$inc` is commutative, so a flush that happens after another instance has
+taken over the lock still produces the right totals. A flush that fails is
+merged back into the buffer and retried on the next tick.
+
+Readers that must see their own writes (the prompt view right after a copy,
+/stats) apply `pending()` on top of what they read – see `overlay()`.
+"""
+from __future__ import annotations
+
+import atexit
+import logging
+import threading
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# (collection name, key field, key value)
+BufferKey = Tuple[str, str, Any]
+
+
+class WriteBehindBuffer:
+    def __init__(
+        self,
+        database_getter: Callable[[], Any],
+        flush_interval: float = 5.0,
+        max_pending: int = 1000,
+    ) -> None:
+        """`database_getter` returns a pymongo Database; it is only called on flush."""
+        self._database_getter = database_getter
+        self.flush_interval = max(0.1, float(flush_interval))
+        self.max_pending = max(1, int(max_pending))
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending: Dict[BufferKey, Dict[str, int]] = {}
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self.flushed_updates = 0
+        self.failed_flushes = 0
+
+    # ----- producers -----
+    def increment(self, collection: str, key_field: str, key_value: Any, fields: Dict[str, int]) -> bool:
+        """Queue `$inc: fields` for the document `{key_field: key_value}`.
+
+        Returns False (nothing queued) once the buffer is stopped – the caller must write the `$inc` itself.
+        """
+        key = (collection, key_field, key_value)
+        with self._lock:
+            # checked under the lock that stop() takes, so an accepted delta is always in the final flush
+            if self._stopped.is_set():
+                return False
+            deltas = self._pending.setdefault(key, {})
+            for field, amount in fields.items():
+                deltas[field] = deltas.get(field, 0) + amount
+            size = len(self._pending)
+        self._ensure_started()
+        if size >= self.max_pending:
+            self._wake.set()
+        return True
+
+    # ----- readers -----
+    def pending(self, collection: str, key_field: str, key_value: Any) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._pending.get((collection, key_field, key_value), {}))
+
+    def overlay(self, collection: str, key_field: str, docs: Iterable[Optional[Dict[str, Any]]]) -> None:
+        """Add pending deltas to `docs` in place (dotted fields such as `stats.total_uses` included)."""
+        with self._lock:
+            if not self._pending:
+                return
+            snapshot = {
+                key[2]: dict(deltas)
+                for key, deltas in self._pending.items()
+                if key[0] == collection and key[1] == key_field
+            }
+        if not snapshot:
+            return
+        for doc in docs:
+            if not doc:
+                continue
+            deltas = snapshot.get(doc.get(key_field))
+            if not deltas:
+                continue
+            for field, amount in deltas.items():
+                *parents, leaf = field.split(".")
+                target = doc
+                for part in parents:
+                    target = target.setdefault(part, {})
+                    if not isinstance(target, dict):
+                        break
+                else:
+                    target[leaf] = (target.get(leaf) or 0) + amount
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    # ----- flushing -----
+    def flush(self) -> int:
+        """Write everything buffered so far; returns the number of documents updated."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+
+            by_collection: Dict[str, list] = {}
+            for (collection, key_field, key_value), deltas in batch.items():
+                deltas = {field: amount for field, amount in deltas.items() if amount}
+                if deltas:
+                    by_collection.setdefault(collection, []).append(
+                        ((collection, key_field, key_value), UpdateOne({key_field: key_value}, {"$inc": deltas}))
+                    )
+
+            written = 0
+            database = None
+            for collection, entries in by_collection.items():
+                try:
+                    database = database or self._database_getter()
+                    database[collection].bulk_write([request for _, request in entries], ordered=False)
+                    written += len(entries)
+                except PyMongoError as exc:
+                    # keep the deltas – the next flush retries them
+                    self.failed_flushes += 1
+                    logger.warning("Write-behind flush of %s failed (%s updates kept): %s",
+                                   collection, len(entries), exc)
+                    self._restore({key: batch[key] for key, _ in entries})
+            self.flushed_updates += written
+            return written
+
+    def _restore(self, batch: Dict[BufferKey, Dict[str, int]]) -> None:
+        with self._lock:
+            for key, deltas in batch.items():
+                merged = self._pending.setdefault(key, {})
+                for field, amount in deltas.items():
+                    merged[field] = merged.get(field, 0) + amount
+
+    # ----- lifecycle -----
+    def _ensure_started(self) -> None:
+        if self._thread is not None or self._stopped.is_set():
+            return
+        with self._lock:
+            if self._thread is not None or self._stopped.is_set():
+                return
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+        atexit.register(self.stop)
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:  # the thread must survive anything a flush throws
+                logger.exception("Write-behind flush crashed")
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Stop the flush thread and write out whatever is still buffered. Safe to call repeatedly."""
+        with self._lock:
+            self._stopped.set()
+        self._wake.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+        self.flush()